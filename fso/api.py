@@ -19,16 +19,44 @@
 # along with this program. If not, see http://www.gnu.org/licenses/.
 #------------------------------------------------------------------------------
 
+import threading
+import weakref
+
+try:
+  import contextvars
+except ImportError:
+  contextvars = None
+
 from .filesystemoverlay import FileSystemOverlay
+from .image import OverlayImage
 
-__all__ = 'push', 'pop'
+__all__ = 'push', 'pop', 'scope'
 
 _stack = []
 
+#: overlays that were created by push() and recycled by pop()
+_pool   = []
+_pooled = weakref.WeakSet()
+
 #------------------------------------------------------------------------------
-def push(fso=None):
+def push(fso=None, base=None):
+  '''
+  Installs and returns the overlay `fso` (a new one if not specified).
+  If `fso` is an :class:`fso.image.OverlayImage` (or `base` is
+  specified), a new overlay is created with that image as its base.
+  '''
+  if isinstance(fso, OverlayImage):
+    fso, base = None, fso
   if fso is None:
-    fso = FileSystemOverlay(install=False)
+    if _pool:
+      fso = _pool.pop()
+      if base is not None:
+        base.attach(fso)
+    else:
+      fso = FileSystemOverlay(install=False, base=base)
+      _pooled.add(fso)
+  elif base is not None:
+    base.attach(fso)
   if fso.active:
     assert _stack[-1] is fso
     return fso
@@ -38,15 +66,197 @@ def push(fso=None):
   return fso.install()
 
 #------------------------------------------------------------------------------
-def pop():
-  return _stack.pop().uninstall()
+def pop(recycle=False):
+  '''
+  Uninstalls the most recently pushed overlay and returns its entries.
+  If `recycle` is truthy and the overlay was created by :func:`push`,
+  it is then reset and kept for reuse by a subsequent :func:`push`,
+  which avoids re-creating an overlay for every test.
+  '''
+  fso = _stack.pop()
+  ret = fso.uninstall()
+  if recycle and fso in _pooled:
+    _pool.append(fso.reset())
+  return ret
 
 #------------------------------------------------------------------------------
 def peek():
+  '''
+  Returns the overlay that is currently in effect, i.e. the one bound
+  by :func:`scope` in the current context if any, otherwise the most
+  recently pushed one (or ``None``).
+  '''
+  fso = _dispatcher.current()
+  if fso is not None:
+    return fso
   if len(_stack) <= 0:
     return None
   return _stack[-1]
 
+#------------------------------------------------------------------------------
+class Dispatcher(object):
+  '''
+  Replaces each of the functions in `FileSystemOverlay.mapping` (once)
+  with a trampoline that routes calls to the overlay bound in the
+  current ``contextvars`` context (or, if ``contextvars`` is not
+  available, the current thread), or to the original implementation
+  if no overlay is bound. This allows concurrent asyncio tasks and
+  threads to each have an isolated filesystem view; see :func:`scope`.
+
+  The trampolines are installed by the first call to :meth:`install`
+  and removed by the matching last call to :meth:`uninstall`, i.e.
+  they are only in place while at least one scope is active. Their
+  "originals" are whatever is in place when they are installed (e.g.
+  the impostors of an overlay installed by :func:`push`), so scopes
+  and pushes must be properly nested.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self):
+    self.originals   = dict()
+    self.trampolines = dict()
+    self._lock       = threading.Lock()
+    self._count      = 0
+    if contextvars is not None:
+      self._var = contextvars.ContextVar('fso.overlay', default=None)
+    else:
+      self._local = threading.local()
+
+  #----------------------------------------------------------------------------
+  def current(self):
+    'Returns the overlay bound in the current context, or ``None``.'
+    if contextvars is not None:
+      return self._var.get()
+    stack = getattr(self._local, 'stack', None)
+    return stack[-1] if stack else None
+
+  #----------------------------------------------------------------------------
+  def bind(self, fso):
+    'Binds `fso` in the current context and returns a token for `unbind`.'
+    if contextvars is not None:
+      return self._var.set(fso)
+    stack = getattr(self._local, 'stack', None)
+    if stack is None:
+      stack = self._local.stack = []
+    stack.append(fso)
+    return len(stack) - 1
+
+  #----------------------------------------------------------------------------
+  def unbind(self, token):
+    if contextvars is not None:
+      return self._var.reset(token)
+    del self._local.stack[token:]
+
+  #----------------------------------------------------------------------------
+  def _trampoline(self, symbol, original):
+    current = self.current
+    def trampoline(*args, **kw):
+      fso = current()
+      if fso is None:
+        return original(*args, **kw)
+      return fso.impostors[symbol](*args, **kw)
+    trampoline.__name__ = symbol.split(':', 1)[1]
+    return trampoline
+
+  #----------------------------------------------------------------------------
+  def install(self):
+    'Installs the trampolines, unless already installed.'
+    with self._lock:
+      self._count += 1
+      if self._count > 1:
+        return self
+      for symbol, mod, attr, name in FileSystemOverlay._targets():
+        self.originals[symbol] = getattr(mod, attr)
+        self.trampolines[symbol] = self._trampoline(symbol, self.originals[symbol])
+        setattr(mod, attr, self.trampolines[symbol])
+    return self
+
+  #----------------------------------------------------------------------------
+  def uninstall(self):
+    'Removes the trampolines if this matches the first :meth:`install`.'
+    with self._lock:
+      if self._count > 1:
+        self._count -= 1
+        return self
+      targets = [
+        target for target in FileSystemOverlay._targets()
+        if target[0] in self.originals]
+      for symbol, mod, attr, name in targets:
+        if getattr(mod, attr) is not self.trampolines[symbol]:
+          raise TypeError('Dispatcher uninstall order violation')
+      for symbol, mod, attr, name in targets:
+        setattr(mod, attr, self.originals[symbol])
+      self.originals.clear()
+      self.trampolines.clear()
+      self._count = 0
+    return self
+
+  #----------------------------------------------------------------------------
+  @property
+  def installed(self):
+    return self._count > 0
+
+_dispatcher = Dispatcher()
+
+#------------------------------------------------------------------------------
+def dispatcher():
+  'Returns the process-wide :class:`Dispatcher`.'
+  return _dispatcher
+
+#------------------------------------------------------------------------------
+class scope(object):
+  '''
+  A context manager that installs the overlay `fso` (a new one, with
+  `base` as its base, if not specified; see :func:`push`) for the
+  current context only, i.e. only the current thread (or, where
+  ``contextvars`` is available, the current asyncio task and any tasks
+  it creates) sees it. Unlike :func:`push`, this does not replace any
+  functions (apart from the process-wide :class:`Dispatcher`
+  trampolines, which are in place while any scope is active), so any
+  number of scopes can be in effect concurrently. Scopes can be used
+  within a :func:`push` (the scope then overlays the pushed overlay)
+  and vice versa, as long as they are properly nested. Similarly, a
+  scope that is entered while another one is in effect in the current
+  context overlays that scope's overlay. Example::
+
+    def test_one():
+      with fso.scope() as overlay:
+        ...
+
+    threads = [threading.Thread(target=test_one) for idx in range(10)]
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, fso=None, base=None):
+    if isinstance(fso, OverlayImage):
+      fso, base = None, fso
+    if fso is None:
+      fso = FileSystemOverlay(install=False, base=base)
+    elif base is not None:
+      base.attach(fso)
+    self.fso    = fso
+    self._token = None
+
+  #----------------------------------------------------------------------------
+  def __enter__(self):
+    disp  = _dispatcher.install()
+    outer = disp.current()
+    try:
+      self.fso.install(
+        originals=outer.impostors if outer is not None else disp.originals)
+    except Exception:
+      disp.uninstall()
+      raise
+    self._token = disp.bind(self.fso)
+    return self.fso
+
+  #----------------------------------------------------------------------------
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    _dispatcher.unbind(self._token)
+    self.fso.uninstall()
+    _dispatcher.uninstall()
+    return False
+
 #------------------------------------------------------------------------------
 # end of $Id$
 # $ChangeLog$
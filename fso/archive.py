@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import io
+import stat
+import tarfile
+import threading
+import zipfile
+import posixpath
+
+import six
+
+from .cache import LRUCache
+from .content import Content
+
+__all__ = ('Archive',)
+
+#------------------------------------------------------------------------------
+# archives are read with the real implementation (captured at import
+# time), since they are typically opened while an overlay is installed.
+_io_open = io.open
+
+#------------------------------------------------------------------------------
+class MemberSource(object):
+  '''
+  A :class:`fso.content.Content` source that refers to a member of an
+  :class:`Archive`, which is only decompressed when it is first read
+  (see :meth:`Archive.read`).
+  '''
+  def __init__(self, archive, name):
+    self.archive = archive
+    self.name    = name
+  def open(self):
+    return io.BytesIO(self.archive.read(self.name))
+  def __repr__(self):
+    return '<MemberSource %s>' % (self.name,)
+
+
+#------------------------------------------------------------------------------
+class Archive(object):
+  '''
+  A read-only tar (optionally compressed) or zip archive, which can be
+  mounted into a :class:`fso.FileSystemOverlay` (see
+  :meth:`fso.FileSystemOverlay.mount`). Only the archive's index is
+  read when it is opened; member contents are decompressed when they
+  are first read and are then kept in an LRU cache that is bounded to
+  `cache_size` bytes.
+
+  Note that tar archives do not have a central index, i.e. scanning a
+  compressed tarball requires decompressing it once (without keeping
+  any of the content), and that reading a member of a compressed
+  tarball that is not cached decompresses it up to that member.
+  '''
+
+  #: the default maximum number of decompressed bytes that are cached.
+  cache_size = 64 * 1024 * 1024
+
+  #----------------------------------------------------------------------------
+  def __init__(self, source, cache_size=None):
+    '''
+    `source` is either the archive's filename, which is opened with
+    the real ``io.open`` (i.e. never overlayed), or a seekable binary
+    file-like object, which is then owned (and closed) by the archive.
+    '''
+    if isinstance(source, six.string_types):
+      source = _io_open(source, 'rb')
+    self.path   = getattr(source, 'name', None)
+    self._fp    = source
+    self._lock  = threading.Lock()
+    self._cache = LRUCache(
+      self.cache_size if cache_size is None else cache_size, sizeof=len)
+    self._zip   = None
+    self._tar   = None
+    #: maps normalized member names to the zip name or tar member
+    self._keys  = dict()
+    try:
+      if zipfile.is_zipfile(self._fp):
+        self._fp.seek(0)
+        self._zip = zipfile.ZipFile(self._fp)
+      else:
+        self._fp.seek(0)
+        self._tar = tarfile.open(fileobj=self._fp)
+    except Exception:
+      self._fp.close()
+      raise
+
+  #----------------------------------------------------------------------------
+  def __repr__(self):
+    return '<Archive %s>' % (self.path,)
+
+  #----------------------------------------------------------------------------
+  def close(self):
+    with self._lock:
+      if self._zip is not None:
+        self._zip.close()
+      if self._tar is not None:
+        self._tar.close()
+      self._fp.close()
+      self._cache.clear()
+
+  #----------------------------------------------------------------------------
+  def members(self):
+    '''
+    Generates a ``(name, mode, size, target)`` tuple for each member
+    of the archive, where `name` is the member's normalized relative
+    path (members with absolute or parent-relative paths are skipped),
+    `mode` is one of ``stat.S_IFREG``, ``stat.S_IFDIR`` or
+    ``stat.S_IFLNK`` (other member types are skipped), and `target` is
+    the target of symlinks.
+    '''
+    if self._zip is not None:
+      for info in self._zip.infolist():
+        name = _normalize(info.filename)
+        if name is None:
+          continue
+        self._keys[name] = info.filename
+        if info.filename.endswith('/'):
+          yield name, stat.S_IFDIR, 0, None
+        elif stat.S_ISLNK(info.external_attr >> 16):
+          # note: zip symlink targets are stored as the content
+          yield name, stat.S_IFLNK, 0, self.read(name).decode('utf-8')
+        else:
+          yield name, stat.S_IFREG, info.file_size, None
+      return
+    for info in self._tar.getmembers():
+      name = _normalize(info.name)
+      if name is None:
+        continue
+      if info.isdir():
+        yield name, stat.S_IFDIR, 0, None
+      elif info.issym():
+        yield name, stat.S_IFLNK, 0, info.linkname
+      elif info.isfile() or info.islnk():
+        self._keys[name] = info
+        size = info.size
+        if info.islnk():
+          # i.e. a hard link, which shares the content of its target
+          size = self._tar.getmember(info.linkname).size
+        yield name, stat.S_IFREG, size, None
+
+  #----------------------------------------------------------------------------
+  def content(self, name, size):
+    '''
+    Returns a :class:`fso.content.Content` of `size` bytes that refers
+    to (but does not read) the member `name`, as reported by
+    :meth:`members`.
+    '''
+    return Content([(MemberSource(self, name), 0, size)] if size else [])
+
+  #----------------------------------------------------------------------------
+  def read(self, name):
+    'Returns the (decompressed) content of the member `name`.'
+    data = self._cache.get(name)
+    if data is not None:
+      return data
+    with self._lock:
+      key = self._keys[name]
+      if self._zip is not None:
+        data = self._zip.read(key)
+      else:
+        fp = self._tar.extractfile(key)
+        try:
+          data = fp.read()
+        finally:
+          fp.close()
+    return self._cache.put(name, data)
+
+#------------------------------------------------------------------------------
+def _normalize(name):
+  '''
+  Returns the archive member `name` as a normalized relative path, or
+  ``None`` if it is absolute (including drive-qualified names) or
+  refers outside of the archive (via ``..``), i.e. must be skipped.
+  '''
+  name = name.replace('\\', '/')
+  if name.startswith('/') or name[1:2] == ':':
+    return None
+  name = posixpath.normpath(name)
+  if name == '.' or name == '..' or name.startswith('../'):
+    return None
+  return name
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+'''
+Micro-benchmarks for the FileSystemOverlay, run them with::
+
+  python -m fso.benchmark
+
+Each overlay operation is measured against the equivalent native call
+on the same path, for every combination of overlay size (the number
+of unrelated entries in the overlay, see ``--entries``) and path depth
+(see ``--depths``). Use ``--json`` to emit machine-readable results,
+e.g. to track regressions::
+
+  python -m fso.benchmark -n 1000 -e 10,1000,1000000 -d 1,30 --json
+'''
+
+import os
+import sys
+import json
+import stat
+import shutil
+import timeit
+import argparse
+import tempfile
+import itertools
+
+from . import api
+from .filesystemoverlay import FileSystemOverlay, OverlayEntry
+
+#------------------------------------------------------------------------------
+def bench_pushpop():
+  api.push()
+  api.pop()
+
+#------------------------------------------------------------------------------
+def bench_pushpop_recycled():
+  api.push()
+  api.pop(recycle=True)
+
+#------------------------------------------------------------------------------
+_overlay = None
+
+def bench_install_uninstall(fso=None):
+  # note: the overlay is created on first use (not on import), and is
+  #       then reused so that only installation is measured
+  global _overlay
+  if fso is None:
+    if _overlay is None:
+      _overlay = FileSystemOverlay()
+    fso = _overlay
+  fso.install()
+  fso.uninstall()
+
+#------------------------------------------------------------------------------
+benchmarks = (
+  ('push/pop',            bench_pushpop),
+  ('push/pop (recycled)', bench_pushpop_recycled),
+  ('install/uninstall',   bench_install_uninstall),
+)
+
+#------------------------------------------------------------------------------
+class Scenario(object):
+  '''
+  A benchmark fixture: a real directory tree in which `target` is a
+  directory `depth` levels deep holding `files` small files, and an
+  overlay (installed without replacing any functions) that holds
+  `entries` empty files outside of `target`, so that they weigh on
+  the overlay's indices without changing what the measured calls see.
+  '''
+
+  files  = 10
+  size   = 4096
+  bucket = 1000
+
+  #----------------------------------------------------------------------------
+  def __init__(self, entries, depth):
+    self.entries = entries
+    self.depth   = depth
+    self.root    = tempfile.mkdtemp(prefix='fso-benchmark.')
+    self.target  = os.path.join(
+      self.root, *['d%02d' % idx for idx in range(1, depth + 1)])
+    os.makedirs(self.target)
+    os.makedirs(os.path.join(self.root, 'native'))
+    data = b'x' * self.size
+    for idx in range(self.files):
+      with open(os.path.join(self.target, 'f%02d' % idx), 'wb') as fp:
+        fp.write(data)
+    self.file    = os.path.join(self.target, 'f00')
+    self.ofile   = os.path.join(self.root, 'overlay', 'data')
+    self._serial = itertools.count()
+    self.fso     = FileSystemOverlay()
+    self.fso.install(originals=dict(
+      (symbol, getattr(mod, attr))
+      for symbol, mod, attr, name in FileSystemOverlay._targets()))
+    self._populate(data)
+
+  #----------------------------------------------------------------------------
+  def _populate(self, data):
+    # the entries are generated in path order, which keeps the sorted
+    # indices append-only and makes a million-entry overlay affordable
+    fso  = self.fso
+    base = os.path.dirname(self.ofile)
+    fso._addentry(OverlayEntry(fso, base, stat.S_IFDIR))
+    for start in range(0, self.entries, self.bucket):
+      bucket = os.path.join(base, 'b%07d' % (start,))
+      fso._putentry(OverlayEntry(fso, bucket, stat.S_IFDIR))
+      for idx in range(start, min(self.entries, start + self.bucket)):
+        fso._putentry(OverlayEntry(
+          fso, os.path.join(bucket, 'f%07d' % (idx,)), stat.S_IFREG, b''))
+    fso._putentry(OverlayEntry(fso, self.ofile, stat.S_IFREG, data))
+
+  #----------------------------------------------------------------------------
+  def newpath(self, native=False):
+    'Returns a new (unused) path directly below the scenario root.'
+    return os.path.join(
+      self.root, 'native' if native else 'overlay', 'n%d' % next(self._serial))
+
+  #----------------------------------------------------------------------------
+  def deep(self, path):
+    'Returns the path `depth` - 1 levels below `path`.'
+    return os.path.join(path, *['d'] * (self.depth - 1))
+
+  #----------------------------------------------------------------------------
+  def close(self):
+    self.fso.uninstall()
+    shutil.rmtree(self.root)
+
+#------------------------------------------------------------------------------
+def _read(opener, path):
+  with opener(path, 'rb') as fp:
+    return fp.read()
+
+#------------------------------------------------------------------------------
+def _write(opener, path, mode, data=b'x' * 64):
+  with opener(path, mode) as fp:
+    fp.write(data)
+
+#------------------------------------------------------------------------------
+def _mktree(scn, makedirs, opener, native=False):
+  top  = scn.newpath(native=native)
+  path = scn.deep(top)
+  makedirs(path)
+  _write(opener, os.path.join(path, 'file'), 'wb')
+  return top
+
+#------------------------------------------------------------------------------
+def operations(scn):
+  '''
+  Generates ``(name, overlay, native, setup)`` tuples for the
+  operations measured in the scenario `scn`: `overlay` and `native`
+  (which may be ``None`` if there is no native equivalent) are
+  callables; if `setup` is not ``None``, it is a pair of callables
+  that prepare an argument for each call of `overlay` and `native`
+  respectively, and is excluded from the timing.
+  '''
+  fso = scn.fso
+  yield 'stat', lambda: fso.fso_stat(scn.file), lambda: os.stat(scn.file), None
+  yield 'lstat', lambda: fso.fso_lstat(scn.file), lambda: os.lstat(scn.file), None
+  yield 'deref', \
+    lambda: fso.deref(scn.file), lambda: os.path.realpath(scn.file), None
+  yield 'listdir', \
+    lambda: fso.fso_listdir(scn.target), lambda: os.listdir(scn.target), None
+  yield 'changes', lambda: fso.changes, None, None
+  yield 'get_changes (subtree)', \
+    lambda: fso.get_changes(root=scn.target), None, None
+  yield 'open/read', \
+    lambda: _read(fso.fso_open, scn.file), lambda: _read(open, scn.file), None
+  yield 'open/read (overlay)', \
+    lambda: _read(fso.fso_open, scn.ofile), lambda: _read(open, scn.file), None
+  opath = os.path.join(scn.target, 'written')
+  npath = os.path.join(scn.root, 'native', 'written')
+  yield 'open/write', \
+    lambda: _write(fso.fso_open, opath, 'wb'), \
+    lambda: _write(open, npath, 'wb'), None
+  yield 'open/append', \
+    lambda: _write(fso.fso_open, opath, 'ab'), \
+    lambda: _write(open, npath, 'ab'), None
+  yield 'makedirs', \
+    lambda: fso.fso_makedirs(scn.deep(scn.newpath())), \
+    lambda: os.makedirs(scn.deep(scn.newpath(native=True))), None
+  yield 'rmtree', fso.fso_rmtree, shutil.rmtree, (
+    lambda: _mktree(scn, fso.fso_makedirs, fso.fso_open),
+    lambda: _mktree(scn, os.makedirs, open, native=True))
+
+#------------------------------------------------------------------------------
+def measure(func, number, repeat=3, setup=None):
+  '''
+  Returns the best time (in seconds) of one call to `func`. If `setup`
+  is specified, it is called before each call to `func` (untimed) and
+  its return value is passed to `func`.
+  '''
+  if setup is None:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+  timer = timeit.default_timer
+  best  = None
+  for _ in range(repeat):
+    total = 0.0
+    for _ in range(number):
+      arg   = setup()
+      start = timer()
+      func(arg)
+      total += timer() - start
+    best = total if best is None else min(best, total)
+  return best / number
+
+#------------------------------------------------------------------------------
+def run(number, entries, depths, select=None):
+  '''
+  Runs the benchmarks and generates one result dictionary for each
+  with the keys ``name``, ``entries``, ``depth`` (both ``None`` for
+  the benchmarks that do not depend on a scenario), ``usec``,
+  ``native_usec`` and ``ratio`` (the latter two are ``None`` if there
+  is no native equivalent). If `select` is specified, only the
+  benchmarks whose name contains one of its strings are run.
+  '''
+  def selected(name):
+    return not select or any(sel in name for sel in select)
+  def result(name, count, depth, secs, native=None):
+    return dict(
+      name        = name,
+      entries     = count,
+      depth       = depth,
+      usec        = secs * 1e6,
+      native_usec = None if native is None else native * 1e6,
+      ratio       = None if not native else secs / native,
+    )
+  for name, func in benchmarks:
+    if selected(name):
+      yield result(name, None, None, measure(func, number))
+  for count in entries:
+    for depth in depths:
+      scn = Scenario(count, depth)
+      try:
+        for name, func, native, setup in operations(scn):
+          if not selected(name):
+            continue
+          osetup, nsetup = setup or (None, None)
+          secs = measure(func, number, setup=osetup)
+          if native is not None:
+            native = measure(native, number, setup=nsetup)
+          yield result(name, count, depth, secs, native)
+      finally:
+        scn.close()
+
+#------------------------------------------------------------------------------
+def _ints(value):
+  try:
+    return [int(val) for val in value.split(',') if val.strip()]
+  except ValueError:
+    raise argparse.ArgumentTypeError(
+      'expected a comma-separated list of integers: %r' % (value,))
+
+#------------------------------------------------------------------------------
+def _text(results, output):
+  fmt = '%-24s %9s %5s %12s %12s %8s\n'
+  output.write(fmt % ('benchmark', 'entries', 'depth', 'usec', 'native', 'ratio'))
+  for res in results:
+    output.write(fmt % (
+      res['name'],
+      '-' if res['entries'] is None else res['entries'],
+      '-' if res['depth'] is None else res['depth'],
+      '%.2f' % res['usec'],
+      '-' if res['native_usec'] is None else '%.2f' % res['native_usec'],
+      '-' if res['ratio'] is None else '%.2fx' % res['ratio'],
+    ))
+    output.flush()
+
+#------------------------------------------------------------------------------
+def main(args=None):
+  cli = argparse.ArgumentParser(description='FileSystemOverlay benchmarks')
+  cli.add_argument(
+    '-n', '--number', metavar='COUNT', type=int, default=1000,
+    help='number of calls per measurement (default: %(default)s)')
+  cli.add_argument(
+    '-e', '--entries', metavar='LIST', type=_ints, default=[10, 1000, 100000],
+    help='comma-separated list of overlay sizes, i.e. number of overlay'
+    ' entries, to measure with (default: 10,1000,100000)')
+  cli.add_argument(
+    '-d', '--depths', metavar='LIST', type=_ints, default=[1, 10, 30],
+    help='comma-separated list of path depths to measure with'
+    ' (default: 1,10,30)')
+  cli.add_argument(
+    '-b', '--benchmark', metavar='NAME', dest='select', action='append',
+    help='only run the benchmarks whose name contains NAME (can be'
+    ' specified multiple times)')
+  cli.add_argument(
+    '-j', '--json', action='store_true',
+    help='output the results as JSON')
+  cli.add_argument(
+    '-o', '--output', metavar='FILENAME',
+    help='write the results to FILENAME instead of STDOUT')
+  options = cli.parse_args(args)
+  if min(options.depths or [1]) < 1:
+    cli.error('depths must be at least 1')
+  output = sys.stdout
+  if options.output:
+    output = open(options.output, 'w')
+  try:
+    results = run(
+      options.number, options.entries, options.depths, options.select)
+    if not options.json:
+      _text(results, output)
+      return 0
+    json.dump(dict(
+      python  = sys.version.split()[0],
+      platform = sys.platform,
+      number  = options.number,
+      results = list(results),
+    ), output, indent=2, sort_keys=True)
+    output.write('\n')
+  finally:
+    if output is not sys.stdout:
+      output.close()
+  return 0
+
+#------------------------------------------------------------------------------
+if __name__ == '__main__':
+  sys.exit(main())
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import collections
+import threading
+
+#------------------------------------------------------------------------------
+_missing = object()
+
+#------------------------------------------------------------------------------
+class LRUCache(object):
+  '''
+  A simple size-bounded mapping that evicts the least-recently-used
+  items once `maxsize` is exceeded. By default, each item counts as
+  one unit towards `maxsize`; if `sizeof` is specified, it is called
+  with each value to determine its weight instead (e.g. ``len`` to
+  bound the cache by bytes). Caches are thread-safe.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, maxsize, sizeof=None):
+    self.maxsize = maxsize
+    self.sizeof  = sizeof
+    self.size    = 0
+    self._items  = collections.OrderedDict()
+    self._lock   = threading.Lock()
+
+  #----------------------------------------------------------------------------
+  def __len__(self):
+    return len(self._items)
+
+  #----------------------------------------------------------------------------
+  def __contains__(self, key):
+    return key in self._items
+
+  #----------------------------------------------------------------------------
+  def get(self, key, default=None):
+    with self._lock:
+      value = self._items.pop(key, _missing)
+      if value is _missing:
+        return default
+      self._items[key] = value
+      return value
+
+  #----------------------------------------------------------------------------
+  def put(self, key, value):
+    weight = 1 if self.sizeof is None else self.sizeof(value)
+    with self._lock:
+      self._pop(key)
+      if weight > self.maxsize:
+        return value
+      self._items[key] = value
+      self.size += weight
+      while self.size > self.maxsize:
+        self._discard(self._items.popitem(last=False)[1])
+      return value
+
+  #----------------------------------------------------------------------------
+  def pop(self, key, default=None):
+    with self._lock:
+      return self._pop(key, default)
+
+  #----------------------------------------------------------------------------
+  def _pop(self, key, default=None):
+    value = self._items.pop(key, _missing)
+    if value is _missing:
+      return default
+    self._discard(value)
+    return value
+
+  #----------------------------------------------------------------------------
+  def clear(self):
+    with self._lock:
+      self._items.clear()
+      self.size = 0
+
+  #----------------------------------------------------------------------------
+  def _discard(self, value):
+    self.size -= 1 if self.sizeof is None else self.sizeof(value)
+
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
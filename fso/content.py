@@ -0,0 +1,825 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import os
+import io
+import bisect
+import errno
+import tempfile
+import threading
+import uuid
+
+import six
+
+#------------------------------------------------------------------------------
+_datatypes = six.binary_type
+
+#------------------------------------------------------------------------------
+# the overlay's own scratch files must never be overlayed themselves,
+# so the real implementations are captured at import time (file I/O is
+# then done via io.FileIO, which is never overlayed).
+_os_open   = os.open
+_os_unlink = os.unlink
+
+#------------------------------------------------------------------------------
+def _isdata(source):
+  return isinstance(source, _datatypes)
+
+#------------------------------------------------------------------------------
+def _tobytes(data):
+  '''
+  Converts `data` to an immutable byte string; in-memory content is
+  always stored as bytes. Note that, as with the builtin ``file``, text
+  is implicitly encoded in python 2, but rejected in python 3.
+  '''
+  if isinstance(data, six.binary_type):
+    return data
+  if isinstance(data, six.text_type):
+    if six.PY3:
+      raise TypeError('a bytes-like object is required, not %r' % (
+        data.__class__.__name__,))
+    return data.encode()
+  try:
+    return memoryview(data).tobytes()
+  except TypeError:
+    return six.binary_type(data)
+
+#------------------------------------------------------------------------------
+class FileSource(object):
+  '''
+  A lazy reference to the content of a file on the underlying
+  filesystem. The file is only opened (via `opener`, which defaults to
+  ``io.open``) when a range of it is actually read.
+  '''
+  def __init__(self, path, opener=None):
+    self.path   = path
+    self.opener = opener or io.open
+  def open(self):
+    return self.opener(self.path, 'rb')
+  def __repr__(self):
+    return '<FileSource %s>' % (self.path,)
+
+
+#------------------------------------------------------------------------------
+class SpillStore(object):
+  '''
+  A private, anonymous scratch file (it is unlinked as soon as it is
+  created, so it disappears when closed or when the process exits)
+  that in-memory content extents can be moved to, and are then read
+  back lazily from. The file is created in `dirname`, which defaults
+  to the system temporary directory.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, dirname=None):
+    self.dirname = dirname
+    self.size    = 0
+    self._fp     = None
+    self._lock   = threading.Lock()
+
+  #----------------------------------------------------------------------------
+  def __repr__(self):
+    return '<SpillStore size=%d>' % (self.size,)
+
+  #----------------------------------------------------------------------------
+  def __del__(self):
+    self.close()
+
+  #----------------------------------------------------------------------------
+  def _file(self):
+    if self._fp is not None:
+      return self._fp
+    dirname = self.dirname or tempfile.gettempdir()
+    while True:
+      path = os.path.join(
+        dirname, 'fso-spill.%d.%s' % (os.getpid(), uuid.uuid4().hex))
+      try:
+        fd = _os_open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0600)
+        break
+      except OSError as err:
+        if err.errno != errno.EEXIST:
+          raise
+    _os_unlink(path)
+    self._fp = io.FileIO(fd, 'r+')
+    return self._fp
+
+  #----------------------------------------------------------------------------
+  def close(self):
+    if self._fp is not None:
+      self._fp.close()
+      self._fp = None
+
+  #----------------------------------------------------------------------------
+  def store(self, data):
+    '''
+    Appends `data` to the scratch file and returns the extent (i.e.
+    the ``(source, offset, length)`` tuple) that now refers to it.
+    '''
+    with self._lock:
+      fp = self._file()
+      offset = self.size
+      fp.seek(offset)
+      view = memoryview(data)
+      while view:
+        view = view[fp.write(view):]
+      self.size += len(data)
+    return (self, offset, len(data))
+
+  #----------------------------------------------------------------------------
+  def spill(self, content):
+    '''
+    Returns a :class:`Content` equivalent to `content`, but with all
+    of its in-memory extents moved to this store.
+    '''
+    if not content.membytes:
+      return content
+    extents = []
+    for extent in content.extents:
+      source, offset, length = extent
+      if _isdata(source):
+        if offset or length != len(source):
+          source = source[offset:offset + length]
+        extent = self.store(source)
+      extents.append(extent)
+    return Content(extents)
+
+  #----------------------------------------------------------------------------
+  def pread(self, offset, size):
+    with self._lock:
+      fp = self._file()
+      fp.seek(offset)
+      return fp.read(size)
+
+  #----------------------------------------------------------------------------
+  def open(self):
+    return _SpillReader(self)
+
+
+#------------------------------------------------------------------------------
+class _SpillReader(object):
+  def __init__(self, store):
+    self.store = store
+    self.pos   = 0
+  def seek(self, pos):
+    self.pos = pos
+  def read(self, size):
+    ret = self.store.pread(self.pos, size)
+    self.pos += len(ret)
+    return ret
+  def close(self):
+    pass
+
+
+#------------------------------------------------------------------------------
+class Content(object):
+  '''
+  An immutable file content, represented as a sequence of extents,
+  where each extent is a ``(source, offset, length)`` tuple. A source
+  is either an in-memory string, a lazy reference to another file
+  (see :class:`FileSource`), a shared buffer that is not owned by the
+  content (i.e. any object with a ``buffer`` attribute, see
+  :class:`fso.image.ImageSource`), or ``None`` for a hole (i.e. a
+  sparse range of NUL bytes). Derived contents (e.g. via :meth:`append`,
+  :meth:`write` or :meth:`truncate`) share the extents of the content
+  they were derived from, so the underlying data is never copied or
+  materialized unless it is actually read.
+  '''
+
+  #: when writing an in-memory string next to another in-memory
+  #: extent, the two are merged if the result is at most this long.
+  merge_size = 65536
+
+  #----------------------------------------------------------------------------
+  def __init__(self, extents=()):
+    self.extents = tuple(extents)
+    offsets = []
+    size    = 0
+    for extent in self.extents:
+      offsets.append(size)
+      size += extent[2]
+    self.offsets = offsets
+    self.size    = size
+
+  #----------------------------------------------------------------------------
+  @classmethod
+  def frombytes(cls, data):
+    if not data:
+      return cls()
+    data = _tobytes(data)
+    return cls([(data, 0, len(data))])
+
+  #----------------------------------------------------------------------------
+  @classmethod
+  def fromfile(cls, path, size, opener=None):
+    if not size:
+      return cls()
+    return cls([(FileSource(path, opener), 0, size)])
+
+  #----------------------------------------------------------------------------
+  def __repr__(self):
+    return '<Content size=%d extents=%d>' % (self.size, len(self.extents))
+
+  #----------------------------------------------------------------------------
+  @property
+  def membytes(self):
+    'The number of bytes of this content that are held in memory.'
+    return sum(extent[2] for extent in self.extents if _isdata(extent[0]))
+
+  #----------------------------------------------------------------------------
+  def append(self, data):
+    '''
+    Returns a new :class:`Content` with `data` appended to this one.
+    '''
+    if not data:
+      return self
+    data    = _tobytes(data)
+    extents = list(self.extents)
+    if extents:
+      source, offset, length = extents[-1]
+      if _isdata(source) and length + len(data) <= self.merge_size:
+        extents[-1] = (
+          source[offset:offset + length] + data, 0, length + len(data))
+        return self.__class__(extents)
+    extents.append((data, 0, len(data)))
+    return self.__class__(extents)
+
+  #----------------------------------------------------------------------------
+  def write(self, offset, data):
+    '''
+    Returns a new :class:`Content` with `data` written at `offset`,
+    overwriting whatever was there. If `offset` is beyond the end of
+    this content, the gap is filled with a hole. `data` can be either
+    a string or another :class:`Content`, in which case its extents
+    are spliced in (i.e. shared).
+    '''
+    if isinstance(data, Content):
+      if not data.size:
+        return self
+      extents = self._slice(0, offset)
+      if offset > self.size:
+        extents.append((None, 0, offset - self.size))
+      extents.extend(data.extents)
+      extents.extend(self._slice(offset + data.size, self.size))
+      return self.__class__(extents)
+    if not data:
+      return self
+    if offset == self.size:
+      return self.append(data)
+    data    = _tobytes(data)
+    end     = offset + len(data)
+    extents = self._slice(0, offset)
+    if offset > self.size:
+      extents.append((None, 0, offset - self.size))
+    after   = self._slice(end, self.size)
+    if extents:
+      source, soff, length = extents[-1]
+      if _isdata(source) and length + len(data) <= self.merge_size:
+        data = source[soff:soff + length] + data
+        extents.pop()
+    if after:
+      source, soff, length = after[0]
+      if _isdata(source) and length + len(data) <= self.merge_size:
+        data = data + source[soff:soff + length]
+        after.pop(0)
+    extents.append((data, 0, len(data)))
+    extents.extend(after)
+    return self.__class__(extents)
+
+  #----------------------------------------------------------------------------
+  def truncate(self, size):
+    '''
+    Returns a new :class:`Content` that is exactly `size` bytes long,
+    either by dropping the trailing content or extending it with a
+    hole.
+    '''
+    if size == self.size:
+      return self
+    if size < self.size:
+      return self.__class__(self._slice(0, size))
+    return self.__class__(self.extents + ((None, 0, size - self.size),))
+
+  #----------------------------------------------------------------------------
+  def _slice(self, start, stop):
+    'Returns the list of extents covering the range [`start`, `stop`).'
+    stop = min(stop, self.size)
+    if start >= stop:
+      return []
+    ret = []
+    idx = bisect.bisect_right(self.offsets, start) - 1
+    while idx < len(self.extents) and self.offsets[idx] < stop:
+      source, soff, length = self.extents[idx]
+      base = self.offsets[idx]
+      lo   = max(start, base)
+      hi   = min(stop, base + length)
+      if lo == base and hi == base + length:
+        ret.append(self.extents[idx])
+      else:
+        ret.append((source, soff + lo - base, hi - lo))
+      idx += 1
+    return ret
+
+  #----------------------------------------------------------------------------
+  def _locate(self, pos):
+    '''
+    Returns the ``(source, source-offset, remaining)`` of the extent
+    that contains position `pos`.
+    '''
+    idx = bisect.bisect_right(self.offsets, pos) - 1
+    source, soff, length = self.extents[idx]
+    delta = pos - self.offsets[idx]
+    return source, soff + delta, length - delta
+
+  #----------------------------------------------------------------------------
+  def commonprefix(self, other, chunksize=65536):
+    '''
+    Returns the length of the longest common prefix of this content
+    and `other`. Ranges where both refer to the same source at the
+    same offset (e.g. the original portion of an appended file) are
+    skipped without being read.
+    '''
+    end = min(self.size, other.size)
+    pos = 0
+    handles = dict()
+    try:
+      while pos < end:
+        asrc, aoff, alen = self._locate(pos)
+        bsrc, boff, blen = other._locate(pos)
+        count = min(alen, blen, end - pos)
+        if asrc is bsrc and ( asrc is None or aoff == boff ):
+          pos += count
+          continue
+        count = min(count, chunksize)
+        adata = b''.join(self.iterchunks(pos, count, handles=handles))
+        bdata = b''.join(other.iterchunks(pos, count, handles=handles))
+        if adata != bdata:
+          for idx in range(count):
+            if adata[idx:idx + 1] != bdata[idx:idx + 1]:
+              return pos + idx
+        pos += count
+      return pos
+    finally:
+      for fp in handles.values():
+        fp.close()
+
+  #----------------------------------------------------------------------------
+  def commonsuffix(self, other, limit=None, chunksize=65536):
+    '''
+    Returns the length of the longest common suffix of this content
+    and `other`, but at most `limit` bytes (e.g. so that it does not
+    overlap with the common prefix).
+    '''
+    end = min(self.size, other.size)
+    if limit is not None:
+      end = min(end, limit)
+    ret = 0
+    handles = dict()
+    try:
+      while ret < end:
+        count = min(chunksize, end - ret)
+        adata = b''.join(self.iterchunks(
+          self.size - ret - count, count, handles=handles))
+        bdata = b''.join(other.iterchunks(
+          other.size - ret - count, count, handles=handles))
+        if adata != bdata:
+          for idx in range(count - 1, -1, -1):
+            if adata[idx:idx + 1] != bdata[idx:idx + 1]:
+              return ret + count - idx - 1
+        ret += count
+      return ret
+    finally:
+      for fp in handles.values():
+        fp.close()
+
+  #----------------------------------------------------------------------------
+  def getvalue(self):
+    'Materializes and returns the entire content as a string.'
+    return self.read()
+
+  #----------------------------------------------------------------------------
+  def read(self, offset=0, size=-1):
+    'Returns (at most) `size` bytes starting at `offset`.'
+    handles = dict()
+    try:
+      return b''.join(self.iterchunks(offset, size, handles=handles))
+    finally:
+      for fp in handles.values():
+        fp.close()
+
+  #----------------------------------------------------------------------------
+  def iterchunks(self, offset=0, size=-1, chunksize=65536, handles=None,
+                 views=False):
+    '''
+    Generates the content starting at `offset` (and limited to `size`
+    bytes, if non-negative) in chunks of at most `chunksize` bytes
+    for extents that are not in-memory; in-memory extents are yielded
+    as-is, i.e. without copying them. If `views` is truthy, partial
+    in-memory extents are yielded as memoryview slices (instead of
+    copies). Files opened to read extents are cached in `handles` if
+    specified, in which case closing them is the caller's
+    responsibility.
+    '''
+    end = self.size if size is None or size < 0 else min(self.size, offset + size)
+    if offset >= end:
+      return
+    owned = handles is None
+    if owned:
+      handles = dict()
+    try:
+      idx = bisect.bisect_right(self.offsets, offset) - 1
+      pos = offset
+      while pos < end:
+        source, soff, length = self.extents[idx]
+        start = soff + pos - self.offsets[idx]
+        count = min(length - ( pos - self.offsets[idx] ), end - pos)
+        pos  += count
+        idx  += 1
+        if _isdata(source):
+          if start == 0 and count == len(source):
+            yield source
+          elif views:
+            yield memoryview(source)[start:start + count]
+          else:
+            yield source[start:start + count]
+          continue
+        if source is None:
+          while count > 0:
+            yield b'\0' * min(count, chunksize)
+            count -= chunksize
+          continue
+        buf = getattr(source, 'buffer', None)
+        if buf is not None:
+          view = None
+          if views:
+            try:
+              view = memoryview(buf)
+            except TypeError:
+              # i.e. an mmap in python 2, which has no memoryview
+              # support, but can be wrapped in a (read-only) buffer
+              if six.PY2:
+                yield buffer(buf, start, count)
+                continue
+          if view is not None:
+            yield view[start:start + count]
+          else:
+            yield buf[start:start + count]
+          continue
+        fp = handles.get(source)
+        if fp is None:
+          fp = handles[source] = source.open()
+        fp.seek(start)
+        while count > 0:
+          data = fp.read(min(count, chunksize))
+          if not data:
+            raise IOError('premature end of content in %r' % (source,))
+          count -= len(data)
+          yield data
+    finally:
+      if owned:
+        for fp in handles.values():
+          fp.close()
+
+
+#------------------------------------------------------------------------------
+class ContentReader(object):
+  '''
+  A read-only file-like stream over a :class:`Content`. Opening a
+  reader does not copy the content; only the ranges that are actually
+  read are retrieved.
+  '''
+
+  #: onclose: if set, a callable that is called with the stream when
+  #:          it is closed (e.g. to release an associated descriptor).
+  onclose = None
+
+  #: fd: the file descriptor number associated with this stream, if any.
+  fd = None
+
+  #----------------------------------------------------------------------------
+  def __init__(self, content, name=None, mode='rb'):
+    self.content  = content
+    self.name     = name
+    self.mode     = mode
+    self.closed   = False
+    self._pos     = 0
+    self._handles = dict()
+
+  #----------------------------------------------------------------------------
+  def __enter__(self):
+    return self
+
+  #----------------------------------------------------------------------------
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+    return False
+
+  #----------------------------------------------------------------------------
+  def __iter__(self):
+    return self
+
+  #----------------------------------------------------------------------------
+  def next(self):
+    line = self.readline()
+    if not line:
+      raise StopIteration()
+    return line
+  __next__ = next
+
+  #----------------------------------------------------------------------------
+  @property
+  def size(self):
+    return self.content.size
+
+  #----------------------------------------------------------------------------
+  def readable(self):
+    return True
+
+  #----------------------------------------------------------------------------
+  def writable(self):
+    return False
+
+  #----------------------------------------------------------------------------
+  def seekable(self):
+    return True
+
+  #----------------------------------------------------------------------------
+  def _checkclosed(self):
+    if self.closed:
+      raise ValueError('I/O operation on closed file')
+
+  #----------------------------------------------------------------------------
+  def close(self):
+    if self.closed:
+      return
+    self.closed = True
+    for fp in self._handles.values():
+      fp.close()
+    self._handles.clear()
+    if self.onclose is not None:
+      self.onclose(self)
+
+  #----------------------------------------------------------------------------
+  def fileno(self):
+    if self.fd is None:
+      raise IOError(errno.EBADF, 'Stream has no file descriptor')
+    return self.fd
+
+  #----------------------------------------------------------------------------
+  def flush(self):
+    self._checkclosed()
+
+  #----------------------------------------------------------------------------
+  def isatty(self):
+    return False
+
+  #----------------------------------------------------------------------------
+  def tell(self):
+    self._checkclosed()
+    return self._pos
+
+  #----------------------------------------------------------------------------
+  def seek(self, offset, whence=0):
+    self._checkclosed()
+    if whence == 1:
+      offset += self._pos
+    elif whence == 2:
+      offset += self.size
+    if offset < 0:
+      raise IOError(22, 'Invalid argument')
+    self._pos = offset
+    return self._pos
+
+  #----------------------------------------------------------------------------
+  def read(self, size=-1):
+    self._checkclosed()
+    ret = b''.join(self.content.iterchunks(self._pos, size, handles=self._handles))
+    self._pos += len(ret)
+    return ret
+
+  #----------------------------------------------------------------------------
+  def pread(self, size, offset):
+    'Reads `size` bytes at `offset` without changing the position.'
+    self._checkclosed()
+    return b''.join(self.content.iterchunks(offset, size, handles=self._handles))
+
+  #----------------------------------------------------------------------------
+  def readinto(self, buf):
+    self._checkclosed()
+    view  = memoryview(buf)
+    count = 0
+    for chunk in self.content.iterchunks(
+        self._pos, len(view), handles=self._handles, views=True):
+      view[count:count + len(chunk)] = chunk
+      count += len(chunk)
+    self._pos += count
+    return count
+
+  #----------------------------------------------------------------------------
+  def readline(self, size=-1):
+    self._checkclosed()
+    ret = []
+    count = 0
+    for chunk in self.content.iterchunks(self._pos, size, 8192, self._handles):
+      idx = chunk.find(b'\n')
+      if idx >= 0:
+        chunk = chunk[:idx + 1]
+      ret.append(chunk)
+      count += len(chunk)
+      if idx >= 0:
+        break
+    self._pos += count
+    return b''.join(ret)
+
+  #----------------------------------------------------------------------------
+  def readlines(self, hint=-1):
+    ret = []
+    count = 0
+    for line in self:
+      ret.append(line)
+      count += len(line)
+      if 0 < hint <= count:
+        break
+    return ret
+
+
+#------------------------------------------------------------------------------
+class ContentStream(ContentReader):
+  '''
+  A random-access, read/write file-like stream over a
+  :class:`Content`. Each write derives a new content (see
+  :meth:`Content.write`), so the content the stream was opened with is
+  never modified. Sequential writes are buffered in a ``BytesIO`` and
+  only applied when the stream is read from, written to elsewhere,
+  truncated or flushed.
+  The `mode` follows the builtin ``open`` conventions, i.e. ``'r+'``,
+  ``'w'``, ``'w+'``, ``'a'`` and ``'a+'`` (note that a ``'w'`` mode
+  does not truncate the content -- that is the caller's job).
+  '''
+
+  #: the number of buffered bytes after which sequential writes are
+  #: applied to the content (see :meth:`_flushdata`).
+  pending_size = 1 << 20
+
+  #----------------------------------------------------------------------------
+  def __init__(self, content=None, name=None, mode='r+b'):
+    ContentReader.__init__(self, content or Content(), name, mode)
+    self._readable = 'r' in mode or '+' in mode
+    self._writable = 'r' not in mode or '+' in mode
+    self._append   = 'a' in mode
+    self._pending  = None
+    self._pendpos  = 0
+    self._pendlen  = 0
+    if self._append:
+      self._pos = self.content.size
+
+  #----------------------------------------------------------------------------
+  @property
+  def size(self):
+    if self._pending is None:
+      return self.content.size
+    return max(self.content.size, self._pendpos + self._pendlen)
+
+  #----------------------------------------------------------------------------
+  def readable(self):
+    return self._readable
+
+  #----------------------------------------------------------------------------
+  def writable(self):
+    return self._writable
+
+  #----------------------------------------------------------------------------
+  def getcontent(self):
+    'Returns the :class:`Content` reflecting all writes so far.'
+    self._flushpending()
+    return self.content
+
+  #----------------------------------------------------------------------------
+  def _flushpending(self):
+    if self._pending is None:
+      return
+    data = self._pending.getvalue()
+    self._pending = None
+    self._pendlen = 0
+    self.content  = self.content.write(self._pendpos, self._flushdata(data))
+
+  #----------------------------------------------------------------------------
+  def _flushdata(self, data):
+    '''
+    Hook that allows subclasses to transform buffered `data` before it
+    is written to the content; it must return either a string or a
+    :class:`Content`.
+    '''
+    return data
+
+  #----------------------------------------------------------------------------
+  def _checkreadable(self):
+    self._checkclosed()
+    if not self._readable:
+      raise IOError(errno.EBADF, 'File not open for reading')
+    self._flushpending()
+
+  #----------------------------------------------------------------------------
+  def _checkwritable(self):
+    self._checkclosed()
+    if not self._writable:
+      raise IOError(errno.EBADF, 'File not open for writing')
+
+  #----------------------------------------------------------------------------
+  def read(self, size=-1):
+    self._checkreadable()
+    return ContentReader.read(self, size)
+
+  #----------------------------------------------------------------------------
+  def readinto(self, buf):
+    self._checkreadable()
+    return ContentReader.readinto(self, buf)
+
+  #----------------------------------------------------------------------------
+  def pread(self, size, offset):
+    self._checkreadable()
+    return ContentReader.pread(self, size, offset)
+
+  #----------------------------------------------------------------------------
+  def pwrite(self, data, offset):
+    'Writes `data` at `offset` without changing the position.'
+    self._checkwritable()
+    self._flushpending()
+    data = _tobytes(data)
+    self.content = self.content.write(
+      self.content.size if self._append else offset, self._flushdata(data))
+    return len(data)
+
+  #----------------------------------------------------------------------------
+  def readline(self, size=-1):
+    self._checkreadable()
+    return ContentReader.readline(self, size)
+
+  #----------------------------------------------------------------------------
+  def write(self, data):
+    self._checkwritable()
+    if self._append:
+      self._pos = self.size
+    if isinstance(data, six.text_type):
+      data = _tobytes(data)
+    if not data:
+      return
+    if self._pending is not None and self._pos != self._pendpos + self._pendlen:
+      self._flushpending()
+    if self._pending is None:
+      self._pending = io.BytesIO()
+      self._pendpos = self._pos
+    count = self._pending.write(data)
+    self._pendlen += count
+    self._pos     += count
+    if self._pendlen >= self.pending_size:
+      self._flushpending()
+
+  #----------------------------------------------------------------------------
+  def writelines(self, lines):
+    for line in lines:
+      self.write(line)
+
+  #----------------------------------------------------------------------------
+  def truncate(self, size=None):
+    self._checkwritable()
+    self._flushpending()
+    if size is None:
+      size = self._pos
+    if size < 0:
+      raise IOError(errno.EINVAL, 'Invalid argument')
+    self.content = self.content.truncate(size)
+    return size
+
+  #----------------------------------------------------------------------------
+  def flush(self):
+    self._checkclosed()
+    self._flushpending()
+
+  #----------------------------------------------------------------------------
+  def close(self):
+    if not self.closed:
+      self._flushpending()
+    ContentReader.close(self)
+
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import re
+import difflib
+
+from .content import Content
+
+__all__ = ('unified_diff',)
+
+#: the number of leading bytes inspected to detect binary content.
+binary_sniff_size = 8000
+
+_hunk_cre = re.compile(r'^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@')
+
+#------------------------------------------------------------------------------
+def _isbinary(content):
+  return b'\0' in content.read(0, binary_sniff_size)
+
+#------------------------------------------------------------------------------
+def _countlines(content, size, chunksize=65536):
+  ret = 0
+  for chunk in content.iterchunks(0, size, chunksize=chunksize):
+    ret += chunk.count(b'\n')
+  return ret
+
+#------------------------------------------------------------------------------
+def _linestart(content, pos, context, chunksize=65536):
+  '''
+  Returns the offset of the start of the line that contains `pos`,
+  moved back by `context` lines.
+  '''
+  need = context + 1
+  while pos > 0:
+    start = max(0, pos - chunksize)
+    chunk = content.read(start, pos - start)
+    while True:
+      idx = chunk.rfind(b'\n')
+      if idx < 0:
+        break
+      need -= 1
+      if need <= 0:
+        return start + idx + 1
+      chunk = chunk[:idx]
+    pos = start
+  return 0
+
+#------------------------------------------------------------------------------
+def _lineend(content, pos, context, chunksize=65536):
+  '''
+  Returns the offset just after the end of the line that contains
+  `pos`, moved forward by `context` lines.
+  '''
+  need = context + 1
+  while pos < content.size:
+    chunk = content.read(pos, chunksize)
+    start = 0
+    while True:
+      idx = chunk.find(b'\n', start)
+      if idx < 0:
+        break
+      need -= 1
+      if need <= 0:
+        return pos + idx + 1
+      start = idx + 1
+    pos += len(chunk)
+  return content.size
+
+#------------------------------------------------------------------------------
+def unified_diff(old, new, oldname, newname, context=3):
+  '''
+  Generates the lines of a unified diff between the :class:`Content`
+  objects `old` and `new` (either of which may be ``None`` to indicate
+  that the file does not exist on that side). If either side appears
+  to be binary, a single "Binary files ... differ" line is generated
+  instead.
+
+  Only the region between the common prefix and common suffix (plus
+  `context` lines) is ever loaded into memory: the common ranges are
+  compared in chunks, and ranges shared by both contents (e.g. the
+  original portion of an appended file) are skipped without being
+  read at all.
+  '''
+  if old is None:
+    old, oldname = Content(), '/dev/null'
+  if new is None:
+    new, newname = Content(), '/dev/null'
+  prefix = old.commonprefix(new)
+  if prefix == old.size == new.size:
+    return
+  if _isbinary(old) or _isbinary(new):
+    yield 'Binary files %s and %s differ\n' % (oldname, newname)
+    return
+  suffix = old.commonsuffix(new, min(old.size, new.size) - prefix)
+  # note: both cut points must fall on line boundaries in both
+  #       contents, i.e. within the common prefix and suffix.
+  start = _linestart(old, prefix, context)
+  tail  = old.size - _lineend(old, max(prefix, old.size - suffix), context)
+  base  = _countlines(old, start)
+  alines = old.read(start, old.size - tail - start).splitlines(True)
+  blines = new.read(start, new.size - tail - start).splitlines(True)
+  yield '--- %s\n' % (oldname,)
+  yield '+++ %s\n' % (newname,)
+  lines = difflib.unified_diff(alines, blines, n=context)
+  # skip difflib's own (unlabeled) '---' and '+++' header lines
+  next(lines, None)
+  next(lines, None)
+  for line in lines:
+    if line.startswith('@@'):
+      match = _hunk_cre.match(line)
+      yield '@@ -%d%s +%d%s @@\n' % (
+        int(match.group(1)) + base, match.group(2) or '',
+        int(match.group(3)) + base, match.group(4) or '')
+      continue
+    if not line.endswith('\n'):
+      yield line + '\n'
+      yield '\\ No newline at end of file\n'
+      continue
+    yield line
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
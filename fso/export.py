@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import os
+import stat
+import errno
+import tarfile
+import tempfile
+import uuid
+
+from .content import Content, ContentReader, FileSource
+
+__all__ = ('iterlayer', 'TarWriter', 'DirectoryWriter', 'commit')
+
+#: the OCI image layer whiteout prefix, i.e. an empty file named
+#: ``.wh.NAME`` marks ``NAME`` as removed.
+WHITEOUT = '.wh.'
+
+#: the OCI image layer opaque whiteout, i.e. an empty file with this
+#: name marks its directory as hiding all of the underlying children.
+OPAQUE = '.wh..wh..opq'
+
+#------------------------------------------------------------------------------
+def _perms(st, default):
+  return stat.S_IMODE(st.st_mode) if st is not None else default
+
+#------------------------------------------------------------------------------
+def iterlayer(fso, root=None):
+  '''
+  Generates the changes of the :class:`fso.FileSystemOverlay` `fso`
+  within `root` (by default, all changes) as OCI-style image layer
+  records, in path order, i.e. parents always precede their
+  children. Each record is a ``(kind, name, mode, data)`` tuple where
+  `name` is the path relative to `root` and `kind` is one of:
+
+  * ``'dir'``: a directory (which may already exist);
+  * ``'file'``: a regular file, with `data` being its
+    :class:`fso.content.Content` (which is never materialized);
+  * ``'symlink'``: a symlink, with `data` being its target;
+  * ``'whiteout'``: a removed file or directory; and
+  * ``'opaque'``: a directory whose underlying children must all be
+    removed (i.e. that replaced a removed directory).
+
+  Changes below a removed path or below a path that was replaced by a
+  file or symlink are not reported. The parent directories of changes
+  are reported as well (with the permissions of the underlying
+  directory, if it exists), and directories that were renamed are
+  expanded to their full content.
+  '''
+  root    = fso.abs(root or os.sep)
+  lstat   = fso._underlying('os:lstat')
+  hidden  = set()
+  emitted = set([''])
+  def relname(path):
+    return os.path.relpath(path, root) if path != root else ''
+  def lowerstat(path):
+    try:
+      return lstat(path)
+    except OSError:
+      return None
+  def parents(name):
+    missing = []
+    head = os.path.dirname(name)
+    while head not in emitted:
+      missing.append(head)
+      emitted.add(head)
+      head = os.path.dirname(head)
+    for head in reversed(missing):
+      yield 'dir', head, _perms(lowerstat(os.path.join(root, head)), 0o755), None
+  for change in fso.iterchanges(root, relative=False):
+    path  = change[4:]
+    entry = fso.entries.get(path)
+    if entry is None:
+      continue
+    name = relname(path)
+    if not name:
+      continue
+    cur = os.path.dirname(path)
+    while cur not in hidden and cur != os.path.dirname(cur):
+      cur = os.path.dirname(cur)
+    if cur in hidden:
+      continue
+    for record in parents(name):
+      yield record
+    emitted.add(name)
+    if entry.mode != stat.S_IFDIR:
+      hidden.add(path)
+    if entry.mode is None:
+      yield 'whiteout', name, 0, None
+      continue
+    if entry.mode == stat.S_IFLNK:
+      yield 'symlink', name, 0o777, entry.content
+      continue
+    # note: modifications retain the underlying permissions
+    st = None
+    if entry.omode == entry.mode:
+      lpath = fso._lowerpath(path)
+      st = lowerstat(lpath) if lpath is not None else None
+    if entry.mode == stat.S_IFREG:
+      yield 'file', name, _perms(st, 0o644), entry.data
+      continue
+    yield 'dir', name, _perms(st, 0o755), None
+    if entry.origin is not None and entry.omode is not None:
+      yield 'opaque', name, 0, None
+    if entry.origin:
+      for record in _iterlower(fso, entry.origin, path, name):
+        yield record
+
+#------------------------------------------------------------------------------
+def _iterlower(fso, lpath, path, name):
+  '''
+  Generates the layer records for the content of the underlying
+  directory `lpath` as it appears at `path` (i.e. `name`), skipping
+  any children that are overlayed (which are reported separately).
+  '''
+  listdir = fso._underlying('os:listdir')
+  lstat   = fso._underlying('os:lstat')
+  opener  = fso._underlying('__builtin__:open')
+  readlink = fso._underlying('os:readlink')
+  for child in sorted(listdir(lpath)):
+    if os.path.join(path, child) in fso.entries:
+      continue
+    lchild = os.path.join(lpath, child)
+    cname  = os.path.join(name, child)
+    st     = lstat(lchild)
+    if stat.S_ISDIR(st.st_mode):
+      yield 'dir', cname, stat.S_IMODE(st.st_mode), None
+      for record in _iterlower(fso, lchild, os.path.join(path, child), cname):
+        yield record
+    elif stat.S_ISLNK(st.st_mode):
+      yield 'symlink', cname, 0o777, readlink(lchild)
+    elif stat.S_ISREG(st.st_mode):
+      yield 'file', cname, stat.S_IMODE(st.st_mode), Content.fromfile(
+        lchild, st.st_size, opener)
+
+#------------------------------------------------------------------------------
+class _Lower(object):
+  '''
+  The underlying filesystem operations needed to write layers and
+  commit changes. Note that only primitive operations are used, since
+  composite ones (e.g. os.makedirs() or shutil.rmtree()) are
+  implemented with the (possibly overlayed) os module functions.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, fso):
+    for symbol in ('__builtin__:open', 'os:lstat', 'os:listdir', 'os:mkdir',
+                   'os:rmdir', 'os:unlink', 'os:symlink', 'os:rename'):
+      setattr(self, symbol.split(':', 1)[1], fso._underlying(symbol))
+
+  #----------------------------------------------------------------------------
+  def stat(self, path):
+    try:
+      return self.lstat(path)
+    except OSError as err:
+      if err.errno != errno.ENOENT:
+        raise
+      return None
+
+  #----------------------------------------------------------------------------
+  def makedirs(self, path):
+    if self.stat(path) is None:
+      self.makedirs(os.path.dirname(path))
+      self.mkdir(path)
+
+  #----------------------------------------------------------------------------
+  def remove(self, path, st=None):
+    st = st or self.stat(path)
+    if st is None:
+      return
+    if not stat.S_ISDIR(st.st_mode):
+      return self.unlink(path)
+    for name in self.listdir(path):
+      self.remove(os.path.join(path, name))
+    self.rmdir(path)
+
+  #----------------------------------------------------------------------------
+  def write(self, path, content):
+    with self.open(path, 'wb') as fp:
+      for chunk in content.iterchunks():
+        fp.write(chunk)
+    return path
+
+  #----------------------------------------------------------------------------
+  def move(self, src, dst):
+    try:
+      return self.rename(src, dst)
+    except OSError as err:
+      if err.errno != errno.EXDEV:
+        raise
+    self.write(dst, Content.fromfile(src, self.lstat(src).st_size, self.open))
+    self.unlink(src)
+
+#------------------------------------------------------------------------------
+class TarWriter(object):
+  '''
+  Writes layer records (see :func:`iterlayer`) to the tarball
+  `fileobj` as a stream, i.e. file content is copied in chunks
+  directly from the overlay content. `compression` can be ``''``,
+  ``'gz'`` or ``'bz2'``.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, fileobj, compression=''):
+    self.tar = tarfile.open(fileobj=fileobj, mode='w|' + compression)
+
+  #----------------------------------------------------------------------------
+  def write(self, kind, name, mode, data):
+    if kind in ('whiteout', 'opaque'):
+      if kind == 'whiteout':
+        head, tail = os.path.split(name)
+        name = os.path.join(head, WHITEOUT + tail)
+      else:
+        name = os.path.join(name, OPAQUE)
+      self.tar.addfile(tarfile.TarInfo(name))
+      return
+    info = tarfile.TarInfo(name)
+    info.mode = mode
+    if kind == 'dir':
+      info.type = tarfile.DIRTYPE
+      self.tar.addfile(info)
+    elif kind == 'symlink':
+      info.type = tarfile.SYMTYPE
+      info.linkname = data
+      self.tar.addfile(info)
+    else:
+      info.size = data.size
+      with ContentReader(data) as reader:
+        self.tar.addfile(info, reader)
+
+  #----------------------------------------------------------------------------
+  def close(self):
+    self.tar.close()
+
+
+#------------------------------------------------------------------------------
+class DirectoryWriter(object):
+  '''
+  Writes layer records (see :func:`iterlayer`) into the directory
+  `path`, i.e. an extracted OCI-style layer (whiteouts are empty
+  files). The filesystem is accessed via the `fso`'s underlying
+  implementations (see :meth:`fso.FileSystemOverlay._underlying`),
+  so that it is not affected by the overlay itself.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, fso, path):
+    self.path  = path
+    self.lower = _Lower(fso)
+    self.lower.makedirs(path)
+
+  #----------------------------------------------------------------------------
+  def write(self, kind, name, mode, data):
+    path = os.path.join(self.path, name)
+    if kind == 'dir':
+      if self.lower.stat(path) is None:
+        self.lower.mkdir(path)
+        os.chmod(path, mode)
+    elif kind == 'symlink':
+      self.lower.symlink(data, path)
+    elif kind == 'file':
+      self.lower.write(path, data)
+      os.chmod(path, mode)
+    else:
+      if kind == 'whiteout':
+        head, tail = os.path.split(path)
+        path = os.path.join(head, WHITEOUT + tail)
+      else:
+        path = os.path.join(path, OPAQUE)
+      self.lower.open(path, 'wb').close()
+
+  #----------------------------------------------------------------------------
+  def close(self):
+    pass
+
+#------------------------------------------------------------------------------
+def commit(fso, staging=None):
+  '''
+  Applies the changes of `fso` to the underlying filesystem in path
+  order (i.e. parents before children). The content of new or modified
+  files is written directly from the overlay, except for content that
+  refers to underlying files that the changes replace or remove (e.g.
+  modified or renamed files): since these are only referenced, such
+  content is first written to a staging directory in `staging` (by
+  default, the system temporary directory), before anything is
+  modified, and then moved into place. Note that the changes are not
+  applied atomically.
+
+  An :class:`OSError` (ENOTDIR) is raised, before anything is modified,
+  if a directory that the changes are in is not a directory in the
+  underlying filesystem and was not replaced by the overlay, i.e. the
+  underlying filesystem is only ever modified where the overlay was.
+  '''
+  lower   = _Lower(fso)
+  records = []
+  # the paths that are replaced or removed (including their
+  # descendants) and the directories whose children are removed
+  removed = set()
+  cleared = set()
+  for kind, name, mode, data in iterlayer(fso):
+    path = os.path.join(os.sep, name)
+    if kind == 'dir':
+      st = lower.stat(path)
+      entry = fso.entries.get(path)
+      if st is not None and not stat.S_ISDIR(st.st_mode):
+        if entry is None or entry.mode != stat.S_IFDIR:
+          raise OSError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        removed.add(path)
+    elif kind == 'opaque':
+      cleared.add(path)
+    else:
+      removed.add(path)
+    records.append((kind, path, mode, data))
+  def replaced(path):
+    if path in removed:
+      return True
+    while True:
+      head = os.path.dirname(path)
+      if head == path:
+        return False
+      if head in removed or head in cleared:
+        return True
+      path = head
+  stage = None
+  try:
+    for idx, (kind, path, mode, data) in enumerate(records):
+      if kind != 'file' or not any(
+          isinstance(source, FileSource) and replaced(source.path)
+          for source, offset, length in data.extents):
+        continue
+      if stage is None:
+        stage = os.path.join(
+          staging or tempfile.gettempdir(), '.fso-commit.' + uuid.uuid4().hex)
+        lower.mkdir(stage, 0o700)
+      records[idx] = (
+        kind, path, mode, lower.write(os.path.join(stage, str(idx)), data))
+    for kind, path, mode, data in records:
+      if kind == 'whiteout':
+        lower.remove(path)
+      elif kind == 'opaque':
+        for name in lower.listdir(path):
+          lower.remove(os.path.join(path, name))
+      elif kind == 'dir':
+        st = lower.stat(path)
+        if st is not None and not stat.S_ISDIR(st.st_mode):
+          lower.remove(path, st)
+          st = None
+        if st is None:
+          lower.mkdir(path)
+          os.chmod(path, mode)
+      else:
+        lower.remove(path)
+        if kind == 'symlink':
+          lower.symlink(data, path)
+        else:
+          if isinstance(data, Content):
+            lower.write(path, data)
+          else:
+            lower.move(data, path)
+          os.chmod(path, mode)
+  finally:
+    if stage is not None:
+      lower.remove(stage)
+  return len(records)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
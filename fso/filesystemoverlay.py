@@ -31,10 +31,22 @@ import stat
 import collections
 import errno
 import re
+import fnmatch
+import bisect
+import shutil
+import threading
+import itertools
 
 import six
 import asset
-import morph
+
+from .cache import LRUCache
+from .content import Content, ContentReader, ContentStream, FileSource, SpillStore
+from .diff import unified_diff
+from .image import OverlayImage, LayeredDict
+from .archive import Archive
+from .export import iterlayer, commit, TarWriter, DirectoryWriter
+from .matcher import PathMatcher
 
 #------------------------------------------------------------------------------
 class UnknownOverlayMode(Exception): pass
@@ -46,6 +58,15 @@ OverlayStat = collections.namedtuple('OverlayStat', [
 ])
 
 #------------------------------------------------------------------------------
+_magic_cre = re.compile('[*?[]')
+
+#------------------------------------------------------------------------------
+def _lowerstat(st):
+  return OverlayStat(*st[:10], st_overlay=0)
+
+#------------------------------------------------------------------------------
+# note: no longer used (overlay streams are now ContentStreams); only
+#       kept so that existing imports of it keep working.
 class ContextStringIO(six.StringIO):
   def __enter__(self):
     return self
@@ -55,17 +76,38 @@ class ContextStringIO(six.StringIO):
 
 
 #------------------------------------------------------------------------------
-class OverlayFileStream(ContextStringIO):
-  def __init__(self, fso, path, *args, **kwargs):
-    prepend = kwargs.pop('prepend', '')
-    ContextStringIO.__init__(self, *args, **kwargs)
+class OverlayFileStream(ContentStream):
+  def __init__(self, fso, path, base=None, mode='wb', prepend=None, dirty=True):
+    ContentStream.__init__(
+      self, base or Content.frombytes(prepend), name=path, mode=mode)
     self.fso     = fso
     self.path    = path
-    self.prepend = prepend
+    #: base: the :class:`fso.content.Content` that this stream was
+    #:       opened with (or last committed), which is shared, not
+    #:       copied, i.e. writes derive new contents from it.
+    self.base    = self.content
+    #: dirty: whether or not the entry must be committed even if no
+    #:        writes occur, e.g. because it was created or truncated.
+    self.dirty   = dirty
+  def _flushdata(self, data):
+    return self.fso._spillable(data)
+  def _commit(self):
+    content = self.getcontent()
+    if not self.dirty and content is self.base:
+      return
+    self.fso._addentry(OverlayEntry(self.fso, self.path, stat.S_IFREG, content))
+    self.base  = content
+    self.dirty = False
+  def flush(self):
+    ContentStream.flush(self)
+    if self._writable:
+      self._commit()
   def close(self):
-    self.fso._addentry(OverlayEntry(
-      self.fso, self.path, stat.S_IFREG, self.prepend + self.getvalue()))
-    ContextStringIO.close(self)
+    if self.closed:
+      return
+    if self._writable:
+      self._commit()
+    ContentStream.close(self)
 
 
 #------------------------------------------------------------------------------
@@ -73,22 +115,49 @@ class OverlayEntry(object):
   # todo: i should probably make this into a "file-like" object... that way
   #       an open() can return this object and read's and write's can be checked
   #       immediately...
-  def __init__(self, fso, path, mode=stat.S_IFREG, content=None, omode=None):
+  def __init__(self, fso, path, mode=stat.S_IFREG, content=None, omode=None,
+               origin=None):
     self.fso     = fso
     #: path: The FS overlay full path, eg. /path/to/filename.ext.
     self.path    = path
     #: mode: The FS overlay entry type, which can be one of stat.S_IF*
     self.mode    = mode
-    #: content: for S_IFREG entries, the actual content, for S_IFLNK
-    #:          entries, the target of the link.
-    self.content = content
+    #: data: for S_IFREG entries, the :class:`fso.content.Content`
+    #:       object holding the actual content, which may refer to
+    #:       the original file instead of copying it.
+    self.data    = None
+    if mode == stat.S_IFREG:
+      if not isinstance(content, Content):
+        content = Content.frombytes(content)
+      self.data, content = content, None
+    self._content = content
     #: omode: the overlayed entry type, if it existed
     self.omode   = omode
+    #: origin: for S_IFDIR entries, the underlying directory whose
+    #:         children appear in this directory (e.g. because it
+    #:         was renamed to this path), or ``False`` if none do;
+    #:         if ``None``, the underlying directory at `path` is used.
+    self.origin  = origin
+  @property
+  def content(self):
+    '''
+    For S_IFREG entries, the actual content (note that this
+    materializes the entire content in memory), for S_IFLNK entries,
+    the target of the link.
+    '''
+    if self.data is not None:
+      return self.data.getvalue()
+    return self._content
+  @property
+  def size(self):
+    if self.data is not None:
+      return self.data.size
+    return len(self._content or '')
   @property
   def stat(self):
     if self.mode is None:
       raise OSError(2, 'No such file or directory', self.path)
-    size = len(self.content or '')
+    size = self.size
     mode = self.mode
     if mode == stat.S_IFDIR:
       mode |= stat.S_IRWXU
@@ -108,7 +177,242 @@ class OverlayEntry(object):
     return 'mod:' + self.path
   def __repr__(self):
     return '<OverlayEntry %s mode=%r, omode=%r, content-length=%d>' % (
-      self.path, self.mode, self.omode, len(self.content or ''))
+      self.path, self.mode, self.omode, self.size)
+
+
+#------------------------------------------------------------------------------
+class OverlayDirEntry(object):
+  '''
+  An ``os.DirEntry``-like object, as generated by
+  :meth:`FileSystemOverlay.fso_scandir`. The type and stat information
+  is taken from the overlay entry (if the child is overlayed), or
+  from the real ``os.DirEntry`` (if available), or is otherwise
+  retrieved (once) via an lstat of the underlying filesystem at
+  `rpath` (the dereferenced equivalent of `path`), i.e. the parent
+  directory is never re-dereferenced.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, fso, path, name, lstat=None, dirent=None, rpath=None):
+    self.name    = name
+    self.path    = path
+    self._rpath  = rpath or path
+    self._fso    = fso
+    self._lstat  = lstat
+    self._stat   = None
+    self._dirent = dirent
+
+  #----------------------------------------------------------------------------
+  def __repr__(self):
+    return '<OverlayDirEntry %r>' % (self.name,)
+
+  #----------------------------------------------------------------------------
+  def __fspath__(self):
+    return self.path
+
+  #----------------------------------------------------------------------------
+  def inode(self):
+    return self.stat(follow_symlinks=False).st_ino
+
+  #----------------------------------------------------------------------------
+  def is_symlink(self):
+    if self._lstat is None and self._dirent is not None:
+      return self._dirent.is_symlink()
+    return stat.S_ISLNK(self.stat(follow_symlinks=False).st_mode)
+
+  #----------------------------------------------------------------------------
+  def is_dir(self, follow_symlinks=True):
+    return self._istype(stat.S_ISDIR, 'is_dir', follow_symlinks)
+
+  #----------------------------------------------------------------------------
+  def is_file(self, follow_symlinks=True):
+    return self._istype(stat.S_ISREG, 'is_file', follow_symlinks)
+
+  #----------------------------------------------------------------------------
+  def _istype(self, check, method, follow_symlinks):
+    if self._lstat is None and self._dirent is not None:
+      if not ( follow_symlinks and self._dirent.is_symlink() ):
+        return getattr(self._dirent, method)(follow_symlinks=False)
+    try:
+      return check(self.stat(follow_symlinks=follow_symlinks).st_mode)
+    except OSError:
+      return False
+
+  #----------------------------------------------------------------------------
+  def stat(self, follow_symlinks=True):
+    if self._lstat is None:
+      # note: only real entries get here, so the overlay can be skipped
+      self._lstat = self._fso._lower_lstat(self._rpath)
+    if not follow_symlinks or not stat.S_ISLNK(self._lstat.st_mode):
+      return self._lstat
+    if self._stat is None:
+      # symlinks may well point into the overlay...
+      self._stat = self._fso.fso_stat(self._rpath)
+    return self._stat
+
+
+#------------------------------------------------------------------------------
+class _ScandirIterator(object):
+  def __init__(self, entries):
+    self._entries = entries
+  def __iter__(self):
+    return self
+  def __next__(self):
+    return next(self._entries)
+  next = __next__
+  def close(self):
+    self._entries.close()
+  def __enter__(self):
+    return self
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+    return False
+
+
+#------------------------------------------------------------------------------
+# the descriptors reserved for overlay streams must be real, so the
+# real implementations are captured at import time.
+_os_open  = os.open
+_os_close = os.close
+_os_dup   = os.dup
+
+#------------------------------------------------------------------------------
+class StripedLock(object):
+  '''
+  A fixed set of re-entrant locks that keys (e.g. directory paths)
+  are hashed onto, so that operations on different keys can usually
+  proceed in parallel without allocating a lock per key. Calling the
+  instance with one or more keys returns a context manager that
+  acquires all of the corresponding locks in a consistent order
+  (which avoids deadlocks between multi-key acquisitions).
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, count=64):
+    self._locks = [threading.RLock() for idx in range(count)]
+
+  #----------------------------------------------------------------------------
+  def __call__(self, *keys):
+    count = len(self._locks)
+    if len(keys) == 1:
+      return self._locks[hash(keys[0]) % count]
+    return _MultiLock([self._locks[idx] for idx in
+                       sorted(set(hash(key) % count for key in keys))])
+
+
+#------------------------------------------------------------------------------
+class _MultiLock(object):
+  def __init__(self, locks):
+    self.locks = locks
+  def __enter__(self):
+    for lock in self.locks:
+      lock.acquire()
+    return self
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    for lock in reversed(self.locks):
+      lock.release()
+    return False
+
+
+#------------------------------------------------------------------------------
+class FileDescriptorTable(object):
+  '''
+  Maps file descriptor numbers to overlay streams. Each descriptor is
+  a real one (a duplicate of ``os.devnull``), which guarantees that it
+  does not collide with any other descriptor and that descriptor-level
+  calls that are not overlayed (e.g. ``fcntl`` and ``select``) still
+  work. Lookups are O(1) list indexing. As with ``os.dup``, duplicated
+  descriptors share the same stream (and therefore file offset), which
+  is only closed when its last descriptor is closed.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self):
+    self._streams = []
+    self._refs    = dict()
+    self._lock    = threading.Lock()
+
+  #----------------------------------------------------------------------------
+  def __len__(self):
+    return len(list(iter(self)))
+
+  #----------------------------------------------------------------------------
+  def __iter__(self):
+    for fd, stream in enumerate(self._streams):
+      if stream is not None:
+        yield fd
+
+  #----------------------------------------------------------------------------
+  def __contains__(self, fd):
+    return self.get(fd) is not None
+
+  #----------------------------------------------------------------------------
+  def __getitem__(self, fd):
+    stream = self.get(fd)
+    if stream is None:
+      raise KeyError(fd)
+    return stream
+
+  #----------------------------------------------------------------------------
+  def get(self, fd, default=None):
+    streams = self._streams
+    if 0 <= fd < len(streams):
+      stream = streams[fd]
+      if stream is not None:
+        return stream
+    return default
+
+  #----------------------------------------------------------------------------
+  def _register(self, fd, stream):
+    with self._lock:
+      streams = self._streams
+      if fd >= len(streams):
+        streams.extend([None] * ( fd + 1 - len(streams) ))
+      streams[fd] = stream
+      self._refs[id(stream)] = self._refs.get(id(stream), 0) + 1
+      if stream.fd is None:
+        stream.fd = fd
+    return fd
+
+  #----------------------------------------------------------------------------
+  def reserve(self, stream):
+    'Reserves a new descriptor for `stream` and returns it.'
+    return self._register(_os_open(os.devnull, os.O_RDWR), stream)
+
+  #----------------------------------------------------------------------------
+  def dup(self, fd):
+    'Reserves a new descriptor that shares the stream of `fd`.'
+    return self._register(_os_dup(fd), self[fd])
+
+  #----------------------------------------------------------------------------
+  def adopt(self, fd):
+    '''
+    Makes closing the stream of `fd` also release `fd` (as the file
+    objects returned by ``os.fdopen`` do).
+    '''
+    stream = self[fd]
+    def onclose(stream):
+      if self.get(fd) is stream:
+        self.release(fd)
+    stream.onclose = onclose
+    return stream
+
+  #----------------------------------------------------------------------------
+  def release(self, fd):
+    '''
+    Releases `fd` and returns its stream if this was the last
+    descriptor referring to it (in which case the caller should close
+    it), otherwise ``None``.
+    '''
+    with self._lock:
+      stream = self[fd]
+      self._streams[fd] = None
+      _os_close(fd)
+      count = self._refs.pop(id(stream)) - 1
+      if count > 0:
+        self._refs[id(stream)] = count
+        return None
+      return stream
 
 
 #------------------------------------------------------------------------------
@@ -132,23 +436,64 @@ class FileSystemOverlay(object):
     'os:lstat'          : 'fso_lstat',
     'os:symlink'        : 'fso_symlink',
     'os:listdir'        : 'fso_listdir',
+    'os:walk'           : 'fso_walk',
     'os:mkdir'          : 'fso_mkdir',
     'os:makedirs'       : 'fso_makedirs',
     'os:rmdir'          : 'fso_rmdir',
+    'os:rename'         : 'fso_rename',
     'os:access'         : 'fso_access',
     'os:open'           : 'fso_os_open',
     'os:fdopen'         : 'fso_os_fdopen',
     'os:read'           : 'fso_os_read',
     'os:write'          : 'fso_os_write',
     'os:close'          : 'fso_os_close',
+    'os:lseek'          : 'fso_os_lseek',
+    'os:fstat'          : 'fso_os_fstat',
+    'os:dup'            : 'fso_os_dup',
+    'os:ftruncate'      : 'fso_os_ftruncate',
     'os.path:exists'    : 'fso_exists',
     'os.path:lexists'   : 'fso_lexists',
     'os.path:islink'    : 'fso_islink',
     'shutil:rmtree'     : 'fso_rmtree',
+    'shutil:copyfile'   : 'fso_copyfile',
+    'shutil:copy'       : 'fso_copy',
+    'shutil:copy2'      : 'fso_copy2',
+    'shutil:copytree'   : 'fso_copytree',
+    'shutil:move'       : 'fso_move',
+    'glob:glob'         : 'fso_glob',
+    'glob:iglob'        : 'fso_iglob',
   }
 
+  if hasattr(os, 'pread'):
+    mapping['os:pread']  = 'fso_os_pread'
+    mapping['os:pwrite'] = 'fso_os_pwrite'
+
+  if hasattr(os, 'scandir'):
+    mapping['os:scandir'] = 'fso_scandir'
+
+  if hasattr(os, 'replace'):
+    mapping['os:replace'] = 'fso_replace'
+
+  #: the number of locks that directories are hashed onto to make
+  #: check-then-act sequences (e.g. in mkdir) atomic without
+  #: serializing operations in unrelated directories.
+  lock_stripes = 64
+
+  #: the maximum number of resolved paths kept in the deref() cache;
+  #: when exceeded, the cache is simply reset.
+  deref_cache_size = 65536
+
+  #: the default maximum number of underlying filesystem lookups kept
+  #: when snapshot mode is enabled with ``snapshot=True``.
+  snapshot_size = 65536
+
+  #: the directory that content exceeding `membudget` is spilled to;
+  #: if ``None``, the system temporary directory is used.
+  spill_dir = None
+
   #----------------------------------------------------------------------------
-  def __init__(self, install=False, passthru=None):
+  def __init__(self, install=False, passthru=None, snapshot=False,
+               membudget=None, base=None, hermetic=False):
     '''
     :Parameters:
 
@@ -163,25 +508,143 @@ class FileSystemOverlay(object):
       against any file that is operated on; if it matches, no overlay
       will be applied, i.e. this list excludes a set of files. The
       specified regexes can be either strings or re.RegexObject
-      instances. Note that these regexes will be given only the
-      fully-dereferenced paths to be tested.
+      instances. Note that these regexes will be given absolute
+      paths, both as given and after dereferencing their parent
+      directory (e.g. a path through a symlink into a passthru
+      directory matches), for all overlayed operations alike: if a
+      path matches as given, the overlay is bypassed entirely, i.e.
+      the path is not dereferenced. The regexes are compiled into a
+      :class:`fso.matcher.PathMatcher`, so large sets are cheap.
+
+    snapshot : {bool, int, fso.cache.LRUCache}, optional, default: false
+
+      Enables "snapshot" mode, in which the underlying filesystem is
+      assumed not to change while the overlay is in use: the results
+      of lstat(), stat(), readlink() and listdir() calls against it
+      (including failures such as ENOENT) are cached on first access
+      and never re-checked. If ``True``, up to `snapshot_size` lookups
+      are kept; if an integer, that many are kept; if an
+      :class:`fso.cache.LRUCache`, that cache is used, which allows a
+      snapshot to be shared by several overlays. The least-recently
+      used lookups are evicted first.
+
+    membudget : int, optional, default: none
+
+      The maximum number of bytes of file content that this overlay
+      should hold in memory. When exceeded, the content of the
+      least-recently stored entries (and any data being written
+      through open streams) is moved to a private, anonymous scratch
+      file in `spill_dir`, and read back lazily when needed. If not
+      specified, all content is kept in memory.
+
+    base : fso.image.OverlayImage, optional, default: none
+
+      An image (see :meth:`freeze`) of another overlay that this
+      overlay should start with, i.e. all of its entries are present
+      (and reported as changes) but their contents are shared with the
+      image, not copied.
+
+    hermetic : {bool, list(str)}, optional, default: false
+
+      Enables "hermetic" mode, in which the underlying filesystem is
+      not accessed at all (apart from `passthru` paths), i.e. only
+      this overlay's entries exist and the root directory is initially
+      empty. If a list of paths, the underlying files and directories
+      at (or within) those paths remain visible (e.g. fixture data), as
+      do their ancestor directories, but these only list the
+      whitelisted children. Note that whitelisted paths are read
+      through, i.e. changes to them are overlayed.
     '''
     self.entries    = {}
+    self._paths     = []
+    self._changes   = []
+    self._children  = {}
+    self._origins   = {}
+    # the sorted paths and changes of an attached image (see _layer)
+    self._basepaths   = ()
+    self._basechanges = ()
+    self._derefs    = {}
+    self._derefdeps = {}
     self._installed = False
+    self._patched   = False
     self.impostors  = dict()
     self.originals  = dict()
     self.vaporized  = None
-    self.fds        = dict()
+    self.fds        = FileDescriptorTable()
     self.passthru   = passthru or []
+    self._passthru  = None
+    self._snapshot  = None
+    self._hermetic  = None
+    self._whitelist = None
+    if hermetic:
+      self._sethermetic([] if hermetic is True else hermetic)
+    if snapshot is True:
+      self._snapshot = LRUCache(self.snapshot_size)
+    elif isinstance(snapshot, LRUCache):
+      self._snapshot = snapshot
+    elif snapshot:
+      self._snapshot = LRUCache(snapshot)
+    self.membudget  = membudget
+    self._spill     = None
+    self._memused   = 0
+    self._resident  = collections.OrderedDict()
+    self._journal   = None
+    # the outstanding checkpoint tokens, in journal order
+    self._jmarks    = []
+    self._jseq      = 0
+    # `_dirlocks` guard check-then-act sequences per (parent)
+    # directory; `_indexlock` guards the shared indices and caches and
+    # is only ever held briefly (and never while acquiring a dirlock).
+    self._dirlocks  = StripedLock(self.lock_stripes)
+    self._indexlock = threading.RLock()
+    self._gen       = 0
+    self._changelist = None
     if self.passthru:
-      if not morph.isseq(self.passthru):
-        self.passthru = [self.passthru]
-      self.passthru = [re.compile(expr) if morph.isstr(expr) else expr
-                       for expr in self.passthru]
+      self._passthru = PathMatcher(self.passthru)
+      self.passthru  = self._passthru.patterns
     self._makeImpostors()
+    if base is not None:
+      base.attach(self)
     if install:
       self.install()
 
+  #----------------------------------------------------------------------------
+  def _sethermetic(self, whitelist):
+    '''
+    Sets up hermetic mode: `self._whitelist` is the set of whitelisted
+    paths (and their resolved paths), and `self._hermetic` maps each
+    (non-whitelisted) ancestor directory of a whitelisted path to the
+    names of the children that lead to one.
+    '''
+    paths = set()
+    for path in whitelist:
+      paths.add(os.path.abspath(path))
+      paths.add(os.path.realpath(path))
+    self._whitelist = paths
+    self._hermetic  = {os.sep: set()}
+    for path in paths:
+      cur = path
+      while True:
+        head, tail = os.path.split(cur)
+        if not tail:
+          break
+        if self._whitelisted(head):
+          break
+        self._hermetic.setdefault(head, set()).add(tail)
+        cur = head
+
+  #----------------------------------------------------------------------------
+  def _whitelisted(self, path):
+    'Returns whether `path` is at or within a hermetic-mode whitelisted path.'
+    cur = path
+    while True:
+      if cur in self._whitelist:
+        return True
+      head, tail = os.path.split(cur)
+      if not tail:
+        return False
+      cur = head
+
   #----------------------------------------------------------------------------
   @property
   def installed(self):
@@ -192,9 +655,9 @@ class FileSystemOverlay(object):
   def active(self):
     if not self._installed:
       return False
-    for symbol, handle in self.impostors.items():
-      mod, attr = symbol.split(':', 1)
-      mod = asset.symbol(mod)
+    if not self._patched:
+      return True
+    for symbol, mod, attr, handle in self._patches:
       if getattr(mod, attr) is not handle:
         return False
     return True
@@ -209,7 +672,15 @@ class FileSystemOverlay(object):
     return False
 
   #----------------------------------------------------------------------------
-  def install(self):
+  def install(self, originals=None):
+    '''
+    Installs this overlay by replacing the overlayed functions (see
+    `mapping`) with this overlay's implementations. Alternatively, if
+    `originals` (a dictionary of the underlying implementations keyed
+    by `mapping` symbol) is specified, nothing is replaced, i.e. the
+    caller is responsible for routing calls to `impostors` (see
+    :func:`fso.api.scope`).
+    '''
     if self.installed:
       if not self.active:
         raise TypeError('FileSystemOverlay 0x%x install collision' % (id(self),))
@@ -217,10 +688,15 @@ class FileSystemOverlay(object):
     if len(self.originals) != 0:
       raise ValueError('i-rep violation: `self.originals` is not empty')
     self._installed = True
-    for symbol, handle in self.impostors.items():
-      mod, attr = symbol.split(':', 1)
-      mod = asset.symbol(mod)
-      self.originals[symbol] = getattr(mod, attr)
+    self._resetcaches()
+    if originals is not None:
+      self._patched = False
+      self.originals.update(originals)
+      return self
+    self._patched = True
+    originals = self.originals
+    for symbol, mod, attr, handle in self._patches:
+      originals[symbol] = getattr(mod, attr)
       setattr(mod, attr, handle)
     return self
 
@@ -231,27 +707,137 @@ class FileSystemOverlay(object):
     if not self.active:
       raise TypeError('FileSystemOverlay 0x%x uninstall order violation' % (id(self),))
     self._installed = False
-    for symbol, handle in self.originals.items():
-      mod, attr = symbol.split(':', 1)
-      mod = asset.symbol(mod)
-      setattr(mod, attr, handle)
+    if self._patched:
+      originals = self.originals
+      for symbol, mod, attr, handle in self._patches:
+        setattr(mod, attr, originals[symbol])
     self.originals.clear()
     self.vaporized = dict(self.entries)
-    self.entries.clear()
+    self._clear()
     return self.vaporized
 
+  #----------------------------------------------------------------------------
+  def reset(self):
+    '''
+    Discards all changes (and checkpoints), i.e. returns this overlay
+    to the state it was constructed in, but without re-creating any
+    of its internal structures, so that an overlay can be reused
+    cheaply (e.g. see ``fso.pop(recycle=True)``). Whether or not the
+    overlay is installed is not affected.
+    '''
+    self.vaporized = None
+    self._clear()
+    return self
+
+  #----------------------------------------------------------------------------
+  def _clear(self):
+    self.entries.clear()
+    del self._paths[:]
+    del self._changes[:]
+    self._children.clear()
+    self._origins.clear()
+    self._basepaths   = ()
+    self._basechanges = ()
+    self._gen += 1
+    self._resident.clear()
+    self._memused = 0
+    # note: the spill store is not closed, since vaporized entries
+    #       may still refer to it; it closes itself once unreferenced.
+    self._spill   = None
+    self._resetcaches()
+    self.release()
+
+  #----------------------------------------------------------------------------
+  def _resetcaches(self):
+    self._derefs.clear()
+    self._derefdeps.clear()
+
   #----------------------------------------------------------------------------
   def _makeImpostors(self):
     if self.impostors:
       raise ValueError('impostors have already been populated')
-    for orig, impost in self.mapping.items():
-      self.impostors[orig] = getattr(self, impost)
+    self._patches = []
+    for symbol, mod, attr, name in self._targets():
+      handle = self.impostors[symbol] = getattr(self, name)
+      self._patches.append((symbol, mod, attr, handle))
+    return self
+
+  #----------------------------------------------------------------------------
+  @classmethod
+  def _targets(cls):
+    '''
+    Returns the ``(symbol, module, attribute, method-name)`` tuples
+    for all symbols in `mapping`, i.e. with the modules already
+    resolved. These are only computed once per class (therefore,
+    `mapping` should not be changed once an instance is created).
+    '''
+    ret = cls.__dict__.get('_resolved')
+    if ret is None:
+      ret = []
+      for symbol, name in sorted(cls.mapping.items()):
+        mod, attr = symbol.split(':', 1)
+        ret.append((symbol, asset.symbol(mod), attr, name))
+      ret = cls._resolved = tuple(ret)
+    return ret
+
+  #----------------------------------------------------------------------------
+  def _layer(self, entries, paths, changes, children, origins):
+    '''
+    Makes the (empty) overlay use the given structures (typically
+    those of an :class:`fso.image.OverlayImage`) as its base state,
+    without copying them: `entries`, `children` and `origins` are
+    wrapped in :class:`fso.image.LayeredDict` layers, and the sorted
+    `paths` and `changes` are merged with this overlay's own sorted
+    indices (which only hold its own entries) when iterated. None of
+    the structures is ever modified.
+    '''
+    self.entries      = LayeredDict(entries)
+    self._children    = LayeredDict(children)
+    self._origins     = LayeredDict(origins)
+    self._basepaths   = paths
+    self._basechanges = changes
+    self._gen += 1
+    self._resetcaches()
     return self
 
+  #----------------------------------------------------------------------------
+  def _nextchange(self, path, inclusive=True):
+    '''
+    Returns the ``(path, change)`` of the entry with the smallest path
+    that is greater than (or equal to, if `inclusive`) `path`, or
+    ``(None, None)`` if there is none. Entries of an attached image
+    that this overlay overrides or removed are skipped.
+    '''
+    find  = bisect.bisect_left if inclusive else bisect.bisect_right
+    paths = self._paths
+    idx   = find(paths, path)
+    ret   = (paths[idx], self._changes[idx]) if idx < len(paths) else (None, None)
+    bases = self._basepaths
+    if bases:
+      hidden = self.entries.hidden
+      idx = find(bases, path)
+      while idx < len(bases) and bases[idx] in hidden:
+        idx += 1
+      if idx < len(bases) and ( ret[0] is None or bases[idx] < ret[0] ):
+        ret = (bases[idx], self._basechanges[idx])
+    return ret
+
   #----------------------------------------------------------------------------
   @property
   def changes(self):
-    return [ self.entries[path].change for path in sorted(self.entries.keys()) ]
+    '''
+    The changes (``add:PATH``, ``mod:PATH`` or ``del:PATH``) in path
+    order, as a new list. This copies the sorted change index; if an
+    image is attached, the merged index is cached until the overlay
+    is next modified.
+    '''
+    if not self._basepaths:
+      return list(self._changes)
+    gen, ret = self._changelist or (None, None)
+    if gen != self._gen:
+      ret = list(self.iterchanges())
+      self._changelist = (self._gen, ret)
+    return list(ret)
 
   #----------------------------------------------------------------------------
   def getChanges(self, *args, **kws):
@@ -269,27 +855,288 @@ class FileSystemOverlay(object):
     '''
     if root is None:
       return self.changes
-    root = self.abs(root)
     if not recurse:
+      root = self.abs(root)
       if root not in self.entries:
         return None
       if relative:
         return self.entries[root].change[:4]
       return self.entries[root].change
-    ret = []
-    for path in sorted(self.entries.keys()):
-      if path == root or path.startswith(root + '/'):
-        change = self.entries[path].change
-        if relative:
-          change = change[:4] + change[4 + len(root) + 1:]
-        ret.append(change)
-    return ret
+    return list(self.iterchanges(root, relative=relative))
 
   #----------------------------------------------------------------------------
-  @property
-  def diff(self):
-    # TODO: implement...
-    raise NotImplementedError()
+  def iterchanges(self, root=None, relative=True):
+    '''
+    Generates the same changes as :meth:`get_changes` (with `recurse`
+    enabled), in path order, but without building a list. Each step
+    is an O(log n) lookup in the sorted path index, so the overlay
+    may be modified while iterating; changes to paths that have not
+    been reached yet will be reflected.
+    '''
+    if root is None:
+      path, change = self._nextchange('')
+      while path is not None:
+        yield change
+        path, change = self._nextchange(path, inclusive=False)
+      return
+    root = self.abs(root)
+    if root in self.entries:
+      yield self.entries[root].change[:4] if relative else self.entries[root].change
+    # all descendants of `root` share the `prefix`, and are therefore
+    # contiguous in the sorted index
+    prefix = root if root.endswith(os.sep) else root + os.sep
+    path, change = self._nextchange(prefix)
+    while path is not None and path.startswith(prefix):
+      if relative:
+        change = change[:4] + change[4 + len(root) + 1:]
+      yield change
+      path, change = self._nextchange(path, inclusive=False)
+
+  #----------------------------------------------------------------------------
+  def diff(self, root=None, relative=True, context=3):
+    '''
+    Generates the lines of a unified diff between the original and
+    the overlay content of each changed regular file or symlink (for
+    symlinks, the "content" is the link target) at or below `root`
+    (all, if not specified), in path order. Files whose content
+    appears to be binary generate a "Binary files ... differ" line
+    instead. Each file's diff is only computed when the generator
+    reaches it, and only the changed region of a file (plus `context`
+    lines) is ever loaded into memory -- see
+    :func:`fso.diff.unified_diff`.
+
+    If `relative` is truthy and `root` is specified, the paths in the
+    file headers are relative to `root`.
+    '''
+    if root is not None:
+      root = self.abs(root)
+    for change in self.iterchanges(root, relative=False):
+      path  = change[4:]
+      entry = self.entries.get(path)
+      if entry is None:
+        continue
+      name = path
+      if relative and root is not None:
+        name = path[len(root) + 1:] or os.path.basename(path)
+      old = self._diffcontent(path, entry.omode, None)
+      new = self._diffcontent(path, entry.mode, entry)
+      if old is None and new is None:
+        continue
+      for line in unified_diff(old, new, name, name, context=context):
+        yield line
+
+  #----------------------------------------------------------------------------
+  def _diffcontent(self, path, mode, entry):
+    '''
+    Returns the diffable :class:`Content` of `path` (the overlay entry
+    if `entry` is specified, otherwise the original) if `mode` is a
+    regular file or symlink, otherwise ``None``.
+    '''
+    if mode is None:
+      return None
+    mode = stat.S_IFMT(mode)
+    if mode == stat.S_IFLNK:
+      target = entry.content if entry is not None else self._lower_readlink(path)
+      return Content.frombytes(target)
+    if mode != stat.S_IFREG:
+      return None
+    if entry is not None:
+      return entry.data
+    # note: if the overlay content still refers to the original, the
+    #       same source is re-used so that the shared ranges are
+    #       skipped without being read (see Content.commonprefix).
+    lpath   = self._lowerpath(path)
+    current = self.entries.get(path)
+    if current is not None and current.data is not None:
+      for source, soff, length in current.data.extents:
+        if isinstance(source, FileSource) and source.path == lpath:
+          return Content([(source, 0, self._lower_lstat(path).st_size)])
+    return Content.fromfile(
+      lpath, self._lower_lstat(path).st_size,
+      self.originals.get('__builtin__:open'))
+
+  #----------------------------------------------------------------------------
+  def export(self, target, root=None, compression=None):
+    '''
+    Streams the changes within `root` (by default, all changes) to
+    `target` as an OCI-style image layer (see
+    :func:`fso.export.iterlayer`), i.e. removals are recorded as
+    ``.wh.NAME`` whiteout files. If `target` is a file-like object or
+    a filename ending with ``.tar``, ``.tar.gz``, ``.tgz`` or
+    ``.tar.bz2``, a tarball is written (with the specified or implied
+    `compression`), otherwise the layer is written into the directory
+    `target` (which is created if needed). Content is copied in
+    chunks, i.e. it is never materialized. The target is always
+    written to the underlying filesystem, and the number of records
+    written is returned.
+    '''
+    fileobj = None
+    if not isinstance(target, six.string_types):
+      writer = TarWriter(target, compression or '')
+    else:
+      for suffix, implied in (
+          ('.tar', ''), ('.tar.gz', 'gz'), ('.tgz', 'gz'), ('.tar.bz2', 'bz2')):
+        if target.endswith(suffix):
+          break
+      else:
+        implied = None
+      if implied is None:
+        writer = DirectoryWriter(self, target)
+      else:
+        fileobj = self._underlying('__builtin__:open')(target, 'wb')
+        writer = TarWriter(fileobj, implied if compression is None else compression)
+    count = 0
+    try:
+      for record in iterlayer(self, root):
+        writer.write(*record)
+        count += 1
+    finally:
+      writer.close()
+      if fileobj is not None:
+        fileobj.close()
+    return count
+
+  #----------------------------------------------------------------------------
+  def commit(self):
+    '''
+    Applies all changes to the underlying filesystem (see
+    :func:`fso.export.commit`) and then discards them, i.e. this
+    overlay is :meth:`reset`. This allows an overlay to be used as a
+    "dry-run" layer whose changes can be reviewed (e.g. with
+    :meth:`diff`) before they are committed. Returns the number of
+    operations applied.
+    '''
+    count = commit(self, staging=self.spill_dir)
+    if self._snapshot is not None:
+      self._snapshot.clear()
+    self.reset()
+    return count
+
+  #----------------------------------------------------------------------------
+  def _underlying(self, symbol):
+    '''
+    Returns the implementation of `symbol` (see `mapping`) that this
+    overlay overlays, i.e. the original if installed, otherwise the
+    current implementation.
+    '''
+    func = self.originals.get(symbol)
+    if func is None:
+      mod, attr = symbol.split(':', 1)
+      func = getattr(asset.symbol(mod), attr)
+    return func
+
+  #----------------------------------------------------------------------------
+  def freeze(self):
+    '''
+    Returns an :class:`fso.image.OverlayImage` of the current entries
+    of this overlay. Images are compact and picklable, and are meant
+    to be used as the `base` of other overlays, e.g. to populate
+    fixtures once and share them with process-pool test workers::
+
+      with fso.push() as overlay:
+        # ... create lots of fixture files ...
+        image = overlay.freeze()
+      # ... in each worker process:
+      with fso.push(image) as overlay:
+        # ... the fixtures are all there ...
+    '''
+    return OverlayImage.freeze(self.entries)
+
+  #----------------------------------------------------------------------------
+  def save(self, target):
+    '''
+    Saves the current entries of this overlay to `target` (a filename
+    or a binary file-like object) as a binary image (see
+    :meth:`fso.image.OverlayImage.dump`), which :meth:`load` (or
+    :meth:`fso.image.OverlayImage.load`) can memory-map later, e.g. to
+    persist fixtures across processes or CI jobs::
+
+      with fso.push() as overlay:
+        # ... create lots of fixture files ...
+        overlay.save('fixtures.fsoimg')
+      # ... later:
+      with FileSystemOverlay.load('fixtures.fsoimg') as overlay:
+        # ... the fixtures are all there ...
+    '''
+    OverlayImage.dump(self.entries, target)
+
+  #----------------------------------------------------------------------------
+  @classmethod
+  def load(cls, source, **kw):
+    '''
+    Returns a new overlay (constructed with the keyword arguments
+    `kw`) whose base is the image saved in `source` (see :meth:`save`).
+    '''
+    return cls(base=OverlayImage.load(source), **kw)
+
+  #----------------------------------------------------------------------------
+  def checkpoint(self):
+    '''
+    Returns a token that identifies the current state of the overlay,
+    which can later be restored with :meth:`rollback`. This is O(1):
+    from the first checkpoint on, the overlay journals the entries
+    that each change replaces, so that rolling back only costs
+    O(number of changes since the checkpoint), regardless of the
+    total number of entries. For example::
+
+      class MyTest(unittest.TestCase):
+        @classmethod
+        def setUpClass(cls):
+          cls.fso = fso.push()
+          # ... create lots of fixture files ...
+          cls.base = cls.fso.checkpoint()
+        def tearDown(self):
+          self.fso.rollback(self.base)
+
+    Note that streams that are open during a rollback are not
+    affected, i.e. if they are written to afterwards, the file will
+    be changed again.
+    '''
+    with self._indexlock:
+      if self._journal is None:
+        self._journal = []
+      token = (len(self._journal), self._jseq)
+      self._jseq += 1
+      self._jmarks.append(token)
+      return token
+
+  #----------------------------------------------------------------------------
+  def rollback(self, token):
+    '''
+    Restores the state of the overlay to when :meth:`checkpoint`
+    returned `token`. The token remains valid, i.e. the same state
+    can be restored repeatedly, but checkpoints taken after `token`
+    are invalidated.
+    '''
+    with self._indexlock:
+      journal = self._journal
+      idx = bisect.bisect_left(self._jmarks, token)
+      if journal is None or idx >= len(self._jmarks) \
+          or self._jmarks[idx] != token:
+        raise ValueError('invalid or expired checkpoint %r' % (token,))
+      del self._jmarks[idx + 1:]
+      pos = token[0]
+      # note: the restore operations are not themselves journaled
+      self._journal = None
+      try:
+        while len(journal) > pos:
+          path, entry = journal.pop()
+          if entry is not None:
+            self._putentry(entry)
+          elif path in self.entries:
+            self._popentry(path)
+      finally:
+        self._journal = journal
+
+  #----------------------------------------------------------------------------
+  def release(self):
+    '''
+    Stops journaling changes and invalidates all outstanding
+    :meth:`checkpoint` tokens, freeing the entries they retained.
+    '''
+    with self._indexlock:
+      self._journal = None
+      self._jmarks  = []
 
   #----------------------------------------------------------------------------
   def apply(self, files):
@@ -307,19 +1154,227 @@ class FileSystemOverlay(object):
       with open(name, 'wb') as fp:
         fp.write(content)
 
+  #----------------------------------------------------------------------------
+  def mount(self, path, archive, cache_size=None):
+    '''
+    Populates the directory `path` (which is created if it does not
+    exist) with the members of the tar or zip `archive` (a filename
+    or an :class:`fso.archive.Archive`), and returns the archive
+    (which the caller should close once it is no longer needed; the
+    archive file itself may also be an overlay file).
+    Only the archive's index is read: the members' contents are
+    decompressed when first read (and cached, up to `cache_size`
+    bytes). This is a lazy alternative to :meth:`apply` for large
+    fixture trees, for example::
+
+      with fso.push() as overlay:
+        overlay.mount('/srv/app', 'fixtures/app-release.tar.gz')
+        # do stuff with the files...
+    '''
+    if not isinstance(archive, Archive):
+      archive = Archive(self.fso_open(archive, 'rb'), cache_size=cache_size)
+    root = self.abs(path)
+    if not self.fso_lexists(root):
+      if not self.fso_exists(os.path.dirname(root)):
+        self.fso_makedirs(os.path.dirname(root))
+      root = self.deref(root, to_parent=True)
+      # note: a new root does not expose any underlying children,
+      #       which avoids probing the underlying filesystem for
+      #       every member.
+      self._addentry(OverlayEntry(self, root, stat.S_IFDIR, origin=False))
+    elif not self._isdir(root):
+      raise OSError(errno.ENOTDIR, 'Not a directory', path)
+    else:
+      root = self.deref(root)
+    dirs = set([''])
+    for name, mode, size, target in archive.members():
+      # note: archives do not necessarily contain all directories
+      missing = []
+      head = name if mode == stat.S_IFDIR else os.path.dirname(name)
+      while head not in dirs:
+        missing.append(head)
+        dirs.add(head)
+        head = os.path.dirname(head)
+      for head in reversed(missing):
+        cur = os.path.join(root, head)
+        if not self._isdir(cur):
+          self._addentry(OverlayEntry(self, cur, stat.S_IFDIR))
+      if mode == stat.S_IFLNK:
+        self._addentry(OverlayEntry(self, os.path.join(root, name), mode, target))
+      elif mode == stat.S_IFREG:
+        self._addentry(OverlayEntry(
+          self, os.path.join(root, name), mode, archive.content(name, size)))
+    return archive
+
   #----------------------------------------------------------------------------
   def _addentry(self, entry):
-    if entry.path in self.entries:
-      entry.omode = self.entries[entry.path].omode
+    with self._dirlocks(os.path.dirname(entry.path)):
+      self._setentry(entry)
+
+  #----------------------------------------------------------------------------
+  def _setentry(self, entry):
+    '''
+    Records `entry` as a change, i.e. determines what it overlays.
+
+    IMPORTANT: expects the dirlock of `entry`'s parent to be held.
+    '''
+    current = self.entries.get(entry.path)
+    if current is not None:
+      entry.omode = current.omode
       if entry.mode is None and entry.omode is None:
-        del self.entries[entry.path]
+        self._popentry(entry.path)
         return
+      if entry.mode == stat.S_IFDIR and entry.origin is None \
+          and current.mode is None and current.omode == stat.S_IFDIR:
+        # a directory that replaces a removed original directory must
+        # not expose the original's children
+        entry.origin = False
     else:
       try:
-        entry.omode = stat.S_IFMT(self.originals['os:lstat'](entry.path).st_mode)
+        entry.omode = stat.S_IFMT(self._lower_lstat(entry.path).st_mode)
       except Exception:
         pass
-    self.entries[entry.path] = entry
+    self._putentry(entry)
+
+  #----------------------------------------------------------------------------
+  def _putentry(self, entry):
+    '''
+    Stores `entry` in `self.entries` and registers it (and any
+    missing ancestors) in the directory child index, `self._children`,
+    which maps a directory path to the names of the entries (or
+    ancestors of entries) directly within it. The entry's path and
+    change are also kept in the sorted indices `self._paths` and
+    `self._changes`, and the replaced entry (if any) is journaled if
+    a :meth:`checkpoint` is active.
+    '''
+    with self._indexlock:
+      self._gen += 1
+      if entry.path not in self.entries:
+        cur = entry.path
+        while True:
+          head, tail = os.path.split(cur)
+          if not tail:
+            break
+          kids = self._ownkids(head)
+          if kids is not None:
+            kids.add(tail)
+            break
+          self._children[head] = set([tail])
+          cur = head
+      if self._journal is not None:
+        self._journal.append((entry.path, self.entries.get(entry.path)))
+      self._invalidate(entry.path)
+      self._unaccount(entry.path)
+      idx = bisect.bisect_left(self._paths, entry.path)
+      if idx < len(self._paths) and self._paths[idx] == entry.path:
+        self._changes[idx] = entry.change
+      else:
+        self._paths.insert(idx, entry.path)
+        self._changes.insert(idx, entry.change)
+      self.entries[entry.path] = entry
+      if entry.origin is not None:
+        self._origins[entry.path] = entry.origin
+      else:
+        self._origins.pop(entry.path, None)
+      if entry.data is not None:
+        size = entry.data.membytes
+        if size:
+          self._resident[entry.path] = size
+          self._memused += size
+          if self.membudget is not None and self._memused > self.membudget:
+            self._enforcebudget()
+
+  #----------------------------------------------------------------------------
+  def _popentry(self, path):
+    '''
+    Removes the entry for `path` from `self.entries` and unregisters
+    it (and any ancestors that are no longer needed) from the
+    directory child index.
+    '''
+    with self._indexlock:
+      self._gen += 1
+      if self._journal is not None:
+        self._journal.append((path, self.entries[path]))
+      self._invalidate(path)
+      self._unaccount(path)
+      entry = self.entries.pop(path)
+      self._origins.pop(path, None)
+      idx = bisect.bisect_left(self._paths, path)
+      if idx < len(self._paths) and self._paths[idx] == path:
+        del self._paths[idx]
+        del self._changes[idx]
+      cur = path
+      while cur not in self.entries and cur not in self._children:
+        head, tail = os.path.split(cur)
+        if not tail:
+          break
+        kids = self._ownkids(head)
+        kids.discard(tail)
+        if kids:
+          break
+        del self._children[head]
+        cur = head
+      return entry
+
+  #----------------------------------------------------------------------------
+  def _ownkids(self, path):
+    'Returns the (modifiable) child names of `path` in the child index.'
+    if isinstance(self._children, LayeredDict):
+      return self._children.owned(path, set)
+    return self._children.get(path)
+
+  #----------------------------------------------------------------------------
+  def _unaccount(self, path):
+    size = self._resident.pop(path, None)
+    if size is not None:
+      self._memused -= size
+
+  #----------------------------------------------------------------------------
+  def _spillstore(self):
+    if self._spill is None:
+      self._spill = SpillStore(self.spill_dir)
+    return self._spill
+
+  #----------------------------------------------------------------------------
+  def _enforcebudget(self):
+    '''
+    Moves the content of the least-recently stored entries to the
+    spill store until the in-memory content fits within `membudget`.
+    Note that this does not change the entries' content, only where
+    it is kept, and therefore the entries are updated in-place.
+    '''
+    store = self._spillstore()
+    while self._memused > self.membudget and self._resident:
+      path, size = self._resident.popitem(last=False)
+      self._memused -= size
+      entry = self.entries[path]
+      entry.data = store.spill(entry.data)
+
+  #----------------------------------------------------------------------------
+  def _spillable(self, data):
+    '''
+    Returns `data` (being written through an open stream) as-is if it
+    fits within `membudget`, otherwise as a :class:`Content` that
+    refers to a copy of it in the spill store.
+    '''
+    if self.membudget is None or self._memused + len(data) <= self.membudget:
+      return data
+    return self._spillstore().spill(Content.frombytes(data))
+
+  #----------------------------------------------------------------------------
+  def _invalidate(self, path):
+    '''
+    Evicts all cached deref() resolutions that depended on the state
+    of `path`, either directly or via another cached resolution.
+    '''
+    deps = self._derefdeps
+    if path not in deps:
+      return
+    stack = [path]
+    while stack:
+      for key in deps.pop(stack.pop(), ()):
+        if self._derefs.pop(key, None) is not None and key in deps:
+          stack.append(key)
 
   #############################################################################
   ### ... AND NOW, THE IMPOSTORS ! ############################################
@@ -336,24 +1391,59 @@ class FileSystemOverlay(object):
     path = self.abs(path)
     if to_parent:
       head, tail = os.path.split(path)
-      return os.path.join(self.deref(head), tail)
-    # TODO: root on windows... ugh.
-    curpath  = '/'
-    segments = path.split('/')
-    for idx, seg in enumerate(segments):
-      curpath = os.path.join(curpath, seg)
-      st = self._lstat(curpath)
-      if stat.S_ISLNK(st.st_mode):
-        target = os.path.join(os.path.dirname(curpath), self.fso_readlink(curpath))
-        target = os.path.join(target, *segments[idx + 1:])
-        return self.deref(target)
-    return os.path.join('/', *segments)
+      return os.path.join(self._deref(head), tail)
+    return self._deref(path)
+
+  #----------------------------------------------------------------------------
+  def _deref(self, path):
+    '''
+    IMPORTANT: expects `path` to already be abs()'olutized.
+
+    Resolves `path` one segment at a time, memoizing each resolved
+    prefix in `self._derefs` so that subsequent lookups that share a
+    prefix (e.g. everything under ``/srv/app/releases/current``) do
+    not need to lstat() it again. Each cached resolution is recorded
+    in `self._derefdeps` against the paths it inspected, so that
+    _invalidate() can evict exactly the resolutions affected by a
+    change.
+    '''
+    ret = self._derefs.get(path)
+    if ret is not None:
+      return ret
+    head, tail = os.path.split(path)
+    if not tail:
+      # TODO: root on windows... ugh.
+      return head
+    # note: if the entries change while resolving (i.e. in another
+    #       thread), the resolution may be stale and is not cached.
+    gen    = self._gen
+    rhead  = self._deref(head)
+    cur    = os.path.join(rhead, tail)
+    st     = self._lstat(cur)
+    target = None
+    if stat.S_ISLNK(st.st_mode):
+      target = self.abs(os.path.join(rhead, self._readlink(cur)))
+      ret = self._deref(target)
+    else:
+      ret = cur
+    with self._indexlock:
+      if gen != self._gen:
+        return ret
+      deps = self._derefdeps
+      if len(self._derefs) >= self.deref_cache_size:
+        self._resetcaches()
+      deps.setdefault(head, set()).add(path)
+      deps.setdefault(cur, set()).add(path)
+      if target is not None:
+        deps.setdefault(target, set()).add(path)
+      self._derefs[path] = ret
+    return ret
 
   #----------------------------------------------------------------------------
   def _stat(self, path):
     '''IMPORTANT: expects `path`'s parent to already be deref()'erenced.'''
     if path not in self.entries:
-      return OverlayStat(*self.originals['os:stat'](path)[:10], st_overlay=0)
+      return self._lower_stat(path)
     st = self.entries[path].stat
     if stat.S_ISLNK(st.st_mode):
       return self._stat(self.deref(path))
@@ -363,9 +1453,133 @@ class FileSystemOverlay(object):
   def _lstat(self, path):
     '''IMPORTANT: expects `path`'s parent to already be deref()'erenced.'''
     if path not in self.entries:
-      return OverlayStat(*self.originals['os:lstat'](path)[:10], st_overlay=0)
+      return self._lower_lstat(path)
     return self.entries[path].stat
 
+  #----------------------------------------------------------------------------
+  def _lower(self, symbol, path, convert=None):
+    '''
+    Calls the original (i.e. underlying) implementation of `symbol`
+    for `path`, consulting and populating the snapshot cache when in
+    snapshot mode. If `convert` is specified, it is applied to
+    successful results before they are cached. In hermetic mode,
+    paths that are not whitelisted fail with ENOENT without any
+    underlying access.
+    '''
+    path = self._lowerpath(path)
+    if path is None:
+      raise OSError(errno.ENOENT, 'No such file or directory')
+    if self._hermetic is not None:
+      kids = self._hermetic.get(path)
+      if kids is None:
+        if not self._whitelisted(path):
+          raise OSError(errno.ENOENT, 'No such file or directory', path)
+      elif symbol == 'os:listdir':
+        lexists = self.originals['os.path:lexists']
+        ret = [name for name in sorted(kids)
+               if lexists(os.path.join(path, name))]
+        return ret if convert is None else convert(ret)
+    if self._snapshot is None:
+      ret = self.originals[symbol](path)
+      return ret if convert is None else convert(ret)
+    key = (symbol, path)
+    ret = self._snapshot.get(key)
+    if ret is None:
+      try:
+        ret = self.originals[symbol](path)
+        if convert is not None:
+          ret = convert(ret)
+      except EnvironmentError as err:
+        ret = err
+      self._snapshot.put(key, ret)
+    if isinstance(ret, EnvironmentError):
+      raise ret.__class__(ret.errno, ret.strerror, ret.filename)
+    return ret
+
+  #----------------------------------------------------------------------------
+  def _lowerpath(self, path):
+    '''
+    Returns the underlying path that the overlay path `path` refers
+    to, which differs from `path` only if an ancestor is a directory
+    that was renamed (see :meth:`fso_rename`), or ``None`` if `path`
+    is within a directory that does not expose any underlying
+    children. This is O(depth), but only if any such directories
+    exist.
+    '''
+    if not self._origins:
+      return path
+    cur = path
+    while True:
+      origin = self._origins.get(cur)
+      if origin is not None:
+        if origin is False:
+          return None
+        return origin + path[len(cur):]
+      head, tail = os.path.split(cur)
+      if not tail:
+        return path
+      cur = head
+
+  #----------------------------------------------------------------------------
+  def _lower_stat(self, path):
+    return self._lower('os:stat', path, _lowerstat)
+
+  #----------------------------------------------------------------------------
+  def _lower_lstat(self, path):
+    return self._lower('os:lstat', path, _lowerstat)
+
+  #----------------------------------------------------------------------------
+  def _lower_readlink(self, path):
+    return self._lower('os:readlink', path)
+
+  #----------------------------------------------------------------------------
+  def _lower_listdir(self, path):
+    return list(self._lower('os:listdir', path, tuple))
+
+  #----------------------------------------------------------------------------
+  def _lower_forget(self, path):
+    '''
+    Evicts any snapshot information about `path` (and its parent's
+    listing), which is needed when a passthru operation modifies the
+    underlying filesystem.
+    '''
+    if self._snapshot is None:
+      return
+    path = self._lowerpath(path)
+    if path is None:
+      return
+    for symbol in ('os:stat', 'os:lstat', 'os:readlink'):
+      self._snapshot.pop((symbol, path))
+    self._snapshot.pop(('os:listdir', os.path.dirname(path)))
+
+  #----------------------------------------------------------------------------
+  def _ispassthru(self, path):
+    '''IMPORTANT: expects `path` to already be abs()'olutized.'''
+    return self._passthru is not None and self._passthru.match(path)
+
+  #----------------------------------------------------------------------------
+  def _passthrupath(self, path):
+    '''
+    Returns the path that the original implementation should be given
+    if `path` is a passthru path, otherwise ``None``. As documented
+    for `passthru`, `path` is matched both as given (absolutized) and
+    after dereferencing its parent directory; in the latter case, the
+    dereferenced path is returned (since the given one may only exist
+    in the overlay). All overlayed operations apply this same rule.
+    '''
+    if self._passthru is None:
+      return None
+    apath = self.abs(path)
+    if self._ispassthru(apath):
+      return path
+    try:
+      rpath = self.deref(apath, to_parent=True)
+    except OSError:
+      return None
+    if rpath != apath and self._ispassthru(rpath):
+      return rpath
+    return None
+
   #----------------------------------------------------------------------------
   def fso_anystat(self, path, link):
     # TODO: what about if path == '/'...
@@ -374,6 +1588,9 @@ class FileSystemOverlay(object):
     #   - ensure that all directory components to dirname(path)
     #     exist and are directories
     #   - then check the file itself
+    ppath = self._passthrupath(path)
+    if ppath is not None:
+      return self.originals['os:lstat' if link else 'os:stat'](ppath)
     path = self.abs(path)
     head, tail = os.path.split(path)
     head = self.deref(head)
@@ -413,6 +1630,9 @@ class FileSystemOverlay(object):
   #----------------------------------------------------------------------------
   def fso_exists(self, path):
     'overlays os.path.exists()'
+    ppath = self._passthrupath(path)
+    if ppath is not None:
+      return self.originals['os.path:exists'](ppath)
     try:
       return self._exists(self.deref(path))
     except os.error:
@@ -421,6 +1641,9 @@ class FileSystemOverlay(object):
   #----------------------------------------------------------------------------
   def fso_lexists(self, path):
     'overlays os.path.lexists()'
+    ppath = self._passthrupath(path)
+    if ppath is not None:
+      return self.originals['os.path:lexists'](ppath)
     try:
       return self._lexists(self.deref(path, to_parent=True))
     except os.error:
@@ -428,6 +1651,9 @@ class FileSystemOverlay(object):
 
   #----------------------------------------------------------------------------
   def fso_access(self, path, mode):
+    ppath = self._passthrupath(path)
+    if ppath is not None:
+      return self.originals['os:access'](ppath, mode)
     try:
       st = self.fso_stat(path)
     except OSError:
@@ -443,39 +1669,264 @@ class FileSystemOverlay(object):
   #----------------------------------------------------------------------------
   def fso_listdir(self, path):
     'overlays os.listdir()'
+    ppath = self._passthrupath(path)
+    if ppath is not None:
+      return self.originals['os:listdir'](ppath)
     path = self.deref(path)
     if not stat.S_ISDIR(self._stat(path).st_mode):
       raise OSError(20, 'Not a directory', path)
     try:
-      ret = self.originals['os:listdir'](path)
+      ret = self._lower_listdir(path)
     except Exception:
       # assuming that `path` was created within this FSO...
       ret = []
-    for entry in self.entries.values():
-      if not entry.path.startswith(path + '/'):
-        continue
-      subpath = entry.path[len(path) + 1:]
-      if '/' in subpath:
+    with self._indexlock:
+      kids = list(self._children.get(path, ()))
+    if not kids:
+      return ret
+    present = set(ret)
+    deleted = set()
+    for name in kids:
+      entry = self.entries.get(os.path.join(path, name))
+      if entry is None:
         continue
       if entry.mode is None:
-        if subpath in ret:
-          ret.remove(subpath)
-      else:
-        if subpath not in ret:
-          ret.append(subpath)
+        if name in present:
+          deleted.add(name)
+      elif name not in present:
+        ret.append(name)
+    if deleted:
+      ret = [name for name in ret if name not in deleted]
     return ret
 
+  #----------------------------------------------------------------------------
+  def fso_scandir(self, path='.'):
+    '''
+    Overlays os.scandir(), generating :class:`OverlayDirEntry` objects
+    (also on platforms that do not provide os.scandir()). `path` is
+    dereferenced once, and the real directory is scanned once (with
+    the real os.scandir(), if available and not in snapshot mode);
+    overlayed children are then merged in from the directory index.
+    '''
+    apath = self.abs(path)
+    if 'os:scandir' in self.originals:
+      ppath = self._passthrupath(path)
+      if ppath is not None:
+        return self.originals['os:scandir'](ppath)
+    rpath = self.deref(apath)
+    if not stat.S_ISDIR(self._stat(rpath).st_mode):
+      raise OSError(20, 'Not a directory', path)
+    with self._indexlock:
+      kids = set(self._children.get(rpath, ()))
+    scandir = None
+    if self._snapshot is None and self._hermetic is None:
+      scandir = self.originals.get('os:scandir')
+    try:
+      if scandir is not None:
+        lpath = self._lowerpath(rpath)
+        real = list(scandir(lpath)) if lpath is not None else []
+      else:
+        real = self._lower_listdir(rpath)
+    except OSError:
+      # assuming that `path` was created within this FSO...
+      real = []
+    return _ScandirIterator(self._scandir(path, rpath, real, kids))
+
+  #----------------------------------------------------------------------------
+  def _scandir(self, path, rpath, real, kids):
+    for item in real:
+      dirent = None
+      if not isinstance(item, six.string_types):
+        dirent, item = item, item.name
+      lstat = None
+      if item in kids:
+        kids.discard(item)
+        entry = self.entries.get(os.path.join(rpath, item))
+        if entry is not None:
+          if entry.mode is None:
+            continue
+          lstat, dirent = entry.stat, None
+      yield OverlayDirEntry(
+        self, os.path.join(path, item), item, lstat=lstat, dirent=dirent,
+        rpath=os.path.join(rpath, item))
+    for name in kids:
+      entry = self.entries.get(os.path.join(rpath, name))
+      if entry is None or entry.mode is None:
+        continue
+      yield OverlayDirEntry(
+        self, os.path.join(path, name), name, lstat=entry.stat)
+
+  #----------------------------------------------------------------------------
+  def fso_walk(self, top, topdown=True, onerror=None, followlinks=False):
+    '''
+    Overlays os.walk(), based on :meth:`fso_scandir`, i.e. the
+    classification of each child uses the overlay or scan information
+    instead of a separate (fully dereferencing) stat.
+    '''
+    try:
+      entries = list(self.fso_scandir(top))
+    except OSError as err:
+      if onerror is not None:
+        onerror(err)
+      return
+    dirs    = []
+    nondirs = []
+    links   = set()
+    names   = set(entry.name for entry in entries)
+    for entry in entries:
+      if entry.is_dir():
+        dirs.append(entry.name)
+        if not followlinks and entry.is_symlink():
+          links.add(entry.name)
+      else:
+        nondirs.append(entry.name)
+    if topdown:
+      yield top, dirs, nondirs
+    for name in dirs:
+      # note: when topdown, `dirs` may have been modified by the caller
+      if name in links:
+        continue
+      path = os.path.join(top, name)
+      if not followlinks and name not in names and self.fso_islink(path):
+        continue
+      for item in self.fso_walk(path, topdown, onerror, followlinks):
+        yield item
+    if not topdown:
+      yield top, dirs, nondirs
+
+  #----------------------------------------------------------------------------
+  def fso_glob(self, pathname, recursive=False):
+    'overlays glob.glob()'
+    return list(self.fso_iglob(pathname, recursive=recursive))
+
+  #----------------------------------------------------------------------------
+  def fso_iglob(self, pathname, recursive=False):
+    '''
+    Overlays glob.iglob(), with the same semantics (including ``**``
+    if `recursive` is truthy), but matching directly against the
+    merged directory listings of :meth:`fso_scandir`, i.e. without a
+    separate lstat (and dereference) per candidate. Each wildcard
+    segment is translated (via fnmatch) only once per call, and
+    matches are generated lazily.
+    '''
+    base = ''
+    rest = pathname
+    if rest.startswith(os.sep):
+      base = os.sep
+      rest = rest.lstrip(os.sep)
+    segments = []
+    for seg in rest.split(os.sep):
+      if recursive and seg == '**':
+        segments.append((seg, True))
+      elif _magic_cre.search(seg):
+        segments.append((seg, re.compile(fnmatch.translate(seg))))
+      else:
+        segments.append((seg, None))
+    if not any(matcher for seg, matcher in segments):
+      # note: as with glob, non-wildcard patterns only check existence
+      if pathname.endswith(os.sep):
+        if self._isdir(pathname):
+          yield pathname
+      elif self.fso_lexists(pathname):
+        yield pathname
+      return
+    for path in self._iglob(base, segments):
+      yield path
+
+  #----------------------------------------------------------------------------
+  def _iglob(self, base, segments):
+    (seg, matcher), rest = segments[0], segments[1:]
+    if matcher is None:
+      if not seg and rest:
+        # i.e. repeated separators
+        path = base
+      else:
+        path = os.path.join(base, seg) if base else seg
+      if rest:
+        for match in self._iglob(path, rest):
+          yield match
+      elif not seg:
+        if self._isdir(base):
+          yield path
+      elif self.fso_lexists(path):
+        yield path
+      return
+    if matcher is True:
+      paths = self._iglobtree(base, dironly=bool(rest))
+      if base:
+        paths = itertools.chain([os.path.join(base, '')], paths)
+    else:
+      paths = self._iglobdir(base, seg, matcher, dironly=bool(rest))
+    for path in paths:
+      if not rest:
+        yield path
+        continue
+      for match in self._iglob(path, rest):
+        yield match
+
+  #----------------------------------------------------------------------------
+  def _iglobdir(self, base, pattern, matcher, dironly):
+    try:
+      entries = list(self.fso_scandir(base or os.curdir))
+    except OSError:
+      return
+    hidden = pattern.startswith('.')
+    for entry in entries:
+      if not hidden and entry.name.startswith('.'):
+        continue
+      if not matcher.match(entry.name):
+        continue
+      if dironly and not entry.is_dir():
+        continue
+      yield os.path.join(base, entry.name) if base else entry.name
+
+  #----------------------------------------------------------------------------
+  def _iglobtree(self, base, dironly):
+    try:
+      entries = list(self.fso_scandir(base or os.curdir))
+    except OSError:
+      return
+    for entry in entries:
+      if entry.name.startswith('.'):
+        continue
+      isdir = entry.is_dir()
+      if dironly and not isdir:
+        continue
+      path = os.path.join(base, entry.name) if base else entry.name
+      yield path
+      if isdir:
+        for sub in self._iglobtree(path, dironly):
+          yield sub
+
+  #----------------------------------------------------------------------------
+  def _isdir(self, path):
+    try:
+      return stat.S_ISDIR(self.fso_stat(path).st_mode)
+    except OSError:
+      return False
+
   #----------------------------------------------------------------------------
   def fso_mkdir(self, path, mode=None):
     'overlays os.mkdir()'
+    ppath = self._passthrupath(path)
+    if ppath is not None:
+      self._lower_forget(self.abs(ppath))
+      if mode is None:
+        return self.originals['os:mkdir'](ppath)
+      return self.originals['os:mkdir'](ppath, mode)
     path = self.deref(path, to_parent=True)
-    if self._lexists(path):
-      raise OSError(17, 'File exists', path)
-    self._addentry(OverlayEntry(self, path, stat.S_IFDIR))
+    with self._dirlocks(os.path.dirname(path)):
+      if self._lexists(path):
+        raise OSError(17, 'File exists', path)
+      self._addentry(OverlayEntry(self, path, stat.S_IFDIR))
 
   #----------------------------------------------------------------------------
   def fso_makedirs(self, path, mode=None):
-    'overlays os.makedirs()'
+    '''
+    Overlays os.makedirs(). Each missing directory is created with
+    :meth:`fso_mkdir`, i.e. the components that are passthru paths
+    are created in the underlying filesystem.
+    '''
     path = self.abs(path)
     cur = '/'
     segments = path.split('/')
@@ -486,8 +1937,15 @@ class FileSystemOverlay(object):
       except OSError:
         st = None
       if st is None:
-        self.fso_mkdir(cur)
-        continue
+        try:
+          self.fso_mkdir(cur)
+          continue
+        except OSError as err:
+          # as with os.makedirs(), intermediate directories may have
+          # been created concurrently
+          if err.errno != errno.EEXIST or idx + 1 == len(segments):
+            raise
+        st = self.fso_stat(cur)
       if idx + 1 == len(segments):
         raise OSError(17, 'File exists', path)
       if not stat.S_ISDIR(st.st_mode):
@@ -496,39 +1954,228 @@ class FileSystemOverlay(object):
   #----------------------------------------------------------------------------
   def fso_rmdir(self, path):
     'overlays os.rmdir()'
-    st = self.fso_lstat(path)
-    if not stat.S_ISDIR(st.st_mode):
-      raise OSError(20, 'Not a directory', path)
-    if len(self.fso_listdir(path)) > 0:
-      raise OSError(39, 'Directory not empty', path)
-    self._addentry(OverlayEntry(self, path, None))
+    ppath = self._passthrupath(path)
+    if ppath is not None:
+      self._lower_forget(self.abs(ppath))
+      return self.originals['os:rmdir'](ppath)
+    path = self.abs(path)
+    # note: the directory itself is also locked so that no entries
+    #       can be created in it while checking that it is empty.
+    with self._dirlocks(os.path.dirname(path), path):
+      st = self.fso_lstat(path)
+      if not stat.S_ISDIR(st.st_mode):
+        raise OSError(20, 'Not a directory', path)
+      if len(self.fso_listdir(path)) > 0:
+        raise OSError(39, 'Directory not empty', path)
+      self._addentry(OverlayEntry(self, path, None))
+
+  #----------------------------------------------------------------------------
+  def fso_rename(self, src, dst):
+    '''
+    Overlays os.rename(). Renaming an original directory is O(1): its
+    underlying children are not enumerated, instead the new directory
+    entry refers to the original directory (see
+    :attr:`OverlayEntry.origin`). Only the overlay entries within the
+    directory (i.e. changes) are moved, in bulk, which is O(k) for k such
+    entries (plus splicing the sorted path index).
+    '''
+    psrc = self._passthrupath(src)
+    pdst = self._passthrupath(dst)
+    if psrc is not None or pdst is not None:
+      src, dst = psrc or src, pdst or dst
+      self._lower_forget(self.abs(src))
+      self._lower_forget(self.abs(dst))
+      return self.originals['os:rename'](src, dst)
+    src = self.deref(src, to_parent=True)
+    dst = self.deref(dst, to_parent=True)
+    if not stat.S_ISDIR(self._stat(os.path.dirname(dst)).st_mode):
+      raise OSError(errno.ENOTDIR, 'Not a directory', dst)
+    with self._dirlocks(os.path.dirname(src), os.path.dirname(dst)):
+      st = self._lstat(src)
+      if src == dst:
+        return
+      try:
+        dst_st = self._lstat(dst)
+      except OSError:
+        dst_st = None
+      if stat.S_ISDIR(st.st_mode):
+        if dst.startswith(src.rstrip(os.sep) + os.sep):
+          raise OSError(errno.EINVAL, 'Invalid argument', dst)
+        if dst_st is not None:
+          if not stat.S_ISDIR(dst_st.st_mode):
+            raise OSError(errno.ENOTDIR, 'Not a directory', dst)
+          if len(self.fso_listdir(dst)) > 0:
+            raise OSError(errno.ENOTEMPTY, 'Directory not empty', dst)
+      elif dst_st is not None and stat.S_ISDIR(dst_st.st_mode):
+        raise OSError(errno.EISDIR, 'Is a directory', dst)
+      self._rename(src, dst, st, dst_st)
+
+  #----------------------------------------------------------------------------
+  def _subentries(self, path):
+    'Returns the entries strictly within the directory `path`.'
+    prefix = path.rstrip(os.sep) + os.sep
+    with self._indexlock:
+      if not self._basepaths:
+        lo = bisect.bisect_left(self._paths, prefix)
+        hi = bisect.bisect_left(self._paths, prefix[:-1] + chr(ord(os.sep) + 1))
+        return [self.entries[key] for key in self._paths[lo:hi]]
+      ret = []
+      key = self._nextchange(prefix)[0]
+      while key is not None and key.startswith(prefix):
+        ret.append(self.entries[key])
+        key = self._nextchange(key, inclusive=False)[0]
+      return ret
+
+  #----------------------------------------------------------------------------
+  def fso_replace(self, src, dst):
+    'overlays os.replace()'
+    return self.fso_rename(src, dst)
+
+  #----------------------------------------------------------------------------
+  def _rename(self, src, dst, st, dst_st):
+    '''
+    IMPORTANT: expects `src` and `dst` to be deref()'erenced (up to
+    the parent) and validated, and their parents' dirlocks to be held.
+    '''
+    entry = self.entries.get(src)
+    mode  = stat.S_IFMT(st.st_mode)
+    if mode == stat.S_IFDIR:
+      origin = entry.origin if entry is not None else None
+      if origin is None and ( entry is None or entry.omode == stat.S_IFDIR ):
+        origin = self._lowerpath(src)
+      # note: `dst` is either an empty directory or does not exist,
+      #       i.e. any entries within it are removals of original
+      #       children, which must neither apply to nor be exposed by
+      #       the new directory.
+      for item in self._subentries(dst):
+        self._popentry(item.path)
+      if origin is None and dst_st is not None:
+        origin = False
+      self._setentry(OverlayEntry(self, dst, mode, origin=origin))
+    elif mode == stat.S_IFLNK:
+      self._setentry(OverlayEntry(self, dst, mode, self._readlink(src)))
+    elif entry is not None:
+      self._setentry(OverlayEntry(self, dst, mode, entry.data))
+    else:
+      self._setentry(OverlayEntry(self, dst, mode, Content.fromfile(
+        self._lowerpath(src), st.st_size, self.originals['__builtin__:open'])))
+    # note: the moved entries are moved before the source itself is
+    #       removed so that removing it does not expose them.
+    if mode == stat.S_IFDIR and not self._basepaths:
+      self._moveentries(src, dst)
+    elif mode == stat.S_IFDIR:
+      prefix = src.rstrip(os.sep) + os.sep
+      for item in self._subentries(src):
+        self._popentry(item.path)
+        self._setentry(OverlayEntry(
+          self, os.path.join(dst, item.path[len(prefix):]), item.mode,
+          item.data if item.data is not None else item._content,
+          origin=item.origin))
+    self._setentry(OverlayEntry(self, src, None))
+
+  #----------------------------------------------------------------------------
+  def _moveentries(self, src, dst):
+    '''
+    Moves the entries strictly within the directory `src` to the
+    (empty) directory `dst` in bulk: the moved range of the sorted
+    indices is spliced with one slice operation each. Since `dst`
+    exposes the same underlying directory as `src` did (see
+    :meth:`_rename`), the moved entries overlay the same underlying
+    entries as before, i.e. the underlying filesystem is not
+    consulted.
+
+    IMPORTANT: only applies to the overlay's own entries, i.e. expects
+    that no image is attached.
+    '''
+    prefix = src.rstrip(os.sep) + os.sep
+    with self._indexlock:
+      self._gen += 1
+      lo = bisect.bisect_left(self._paths, prefix)
+      hi = bisect.bisect_left(self._paths, prefix[:-1] + chr(ord(os.sep) + 1))
+      paths = self._paths[lo:hi]
+      moved = []
+      heads = set([src])
+      for path in paths:
+        entry = self.entries.pop(path)
+        if self._journal is not None:
+          self._journal.append((path, entry))
+        self._invalidate(path)
+        self._origins.pop(path, None)
+        item = OverlayEntry(
+          self, dst + path[len(src):], entry.mode,
+          entry.data if entry.data is not None else entry._content,
+          omode=entry.omode, origin=entry.origin)
+        size = self._resident.pop(path, None)
+        if size is not None:
+          self._resident[item.path] = size
+        moved.append(item)
+        head = os.path.dirname(path)
+        while head not in heads:
+          heads.add(head)
+          head = os.path.dirname(head)
+      del self._paths[lo:hi]
+      del self._changes[lo:hi]
+      idx = bisect.bisect_left(self._paths, dst.rstrip(os.sep) + os.sep)
+      self._paths[idx:idx] = [item.path for item in moved]
+      self._changes[idx:idx] = [item.change for item in moved]
+      for item in moved:
+        if self._journal is not None:
+          self._journal.append((item.path, None))
+        self._invalidate(item.path)
+        self.entries[item.path] = item
+        if item.origin is not None:
+          self._origins[item.path] = item.origin
+      # note: the child index sets are copied, since they may be shared
+      #       with an (empty) attached image.
+      for head in heads:
+        kids = self._children.pop(head, None)
+        if kids is not None:
+          self._children[dst + head[len(src):]] = set(kids)
 
   #----------------------------------------------------------------------------
   def fso_readlink(self, path):
     'overlays os.readlink()'
+    ppath = self._passthrupath(path)
+    if ppath is not None:
+      return self.originals['os:readlink'](ppath)
     path = self.deref(path, to_parent=True)
     st = self.fso_lstat(path)
     if not stat.S_ISLNK(st.st_mode):
       raise OSError(22, 'Invalid argument', path)
-    if st.st_overlay:
+    return self._readlink(path)
+
+  #----------------------------------------------------------------------------
+  def _readlink(self, path):
+    '''IMPORTANT: expects `path`'s parent to already be deref()'erenced.'''
+    if path in self.entries:
       return self.entries[path].content
-    return self.originals['os:readlink'](path)
+    return self._lower_readlink(path)
 
   #----------------------------------------------------------------------------
   def fso_symlink(self, source, link_name):
     'overlays os.symlink()'
+    ppath = self._passthrupath(link_name)
+    if ppath is not None:
+      self._lower_forget(self.abs(ppath))
+      return self.originals['os:symlink'](source, ppath)
     path = self.deref(link_name, to_parent=True)
-    if self._exists(path):
-      raise OSError(17, 'File exists')
-    self._addentry(OverlayEntry(self, path, stat.S_IFLNK, source))
+    with self._dirlocks(os.path.dirname(path)):
+      if self._exists(path):
+        raise OSError(17, 'File exists')
+      self._addentry(OverlayEntry(self, path, stat.S_IFLNK, source))
 
   #----------------------------------------------------------------------------
   def fso_unlink(self, path):
     'overlays os.unlink()'
+    ppath = self._passthrupath(path)
+    if ppath is not None:
+      self._lower_forget(self.abs(ppath))
+      return self.originals['os:unlink'](ppath)
     path = self.deref(path, to_parent=True)
-    if not self._lexists(path):
-      raise OSError(2, 'No such file or directory', path)
-    self._addentry(OverlayEntry(self, path, None))
+    with self._dirlocks(os.path.dirname(path)):
+      if not self._lexists(path):
+        raise OSError(2, 'No such file or directory', path)
+      self._addentry(OverlayEntry(self, path, None))
 
   #----------------------------------------------------------------------------
   def fso_remove(self, path):
@@ -545,7 +2192,11 @@ class FileSystemOverlay(object):
 
   #----------------------------------------------------------------------------
   def fso_rmtree(self, path, ignore_errors=False, onerror=None):
-    'overlays shutil.rmtree()'
+    '''
+    Overlays shutil.rmtree(). The tree is removed with the overlayed
+    operations, i.e. the passthru paths within it are removed from
+    the underlying filesystem.
+    '''
     if ignore_errors:
       def onerror(*args):
         pass
@@ -583,14 +2234,170 @@ class FileSystemOverlay(object):
     except os.error:
       onerror(os.rmdir, path, sys.exc_info())
 
+  #----------------------------------------------------------------------------
+  def _sharedcontent(self, path):
+    '''
+    Returns the content of the regular file `path` (following
+    symlinks) as a :class:`fso.content.Content`, without reading it:
+    overlay content is immutable and is therefore shared as-is, and
+    the content of an original file is only referenced.
+    '''
+    try:
+      path = self.deref(path)
+      st = self._stat(path)
+    except OSError:
+      raise IOError(errno.ENOENT, 'No such file or directory', path)
+    if stat.S_ISDIR(st.st_mode):
+      raise IOError(errno.EISDIR, 'Is a directory', path)
+    if not stat.S_ISREG(st.st_mode):
+      raise IOError(errno.ENOENT, 'No such file or directory', path)
+    if path in self.entries:
+      return self.entries[path].data
+    return Content.fromfile(
+      self._lowerpath(path), st.st_size, self.originals['__builtin__:open'])
+
+  #----------------------------------------------------------------------------
+  def fso_copyfile(self, src, dst, follow_symlinks=True):
+    '''
+    Overlays shutil.copyfile(). Unlike the original, no data is
+    actually copied: `dst` shares the content of `src` (see
+    :meth:`_sharedcontent`).
+    '''
+    pdst = self._passthrupath(dst)
+    if pdst is not None:
+      kw = dict() if follow_symlinks else dict(follow_symlinks=False)
+      return self.originals['shutil:copyfile'](src, pdst, **kw)
+    if not follow_symlinks and self.fso_islink(src):
+      self.fso_symlink(self.fso_readlink(src), dst)
+      return dst
+    content = self._sharedcontent(src)
+    head, tail = os.path.split(self.abs(dst))
+    try:
+      head = self.deref(head)
+      if not stat.S_ISDIR(self._stat(head).st_mode):
+        raise OSError(errno.ENOTDIR, 'Not a directory', head)
+    except OSError:
+      raise IOError(errno.ENOENT, 'No such file or directory', dst)
+    path, st = self._writetarget(os.path.join(head, tail), True)
+    if path == self.deref(src):
+      raise getattr(shutil, 'SameFileError', shutil.Error)(
+        '`%s` and `%s` are the same file' % (src, dst))
+    self._addentry(OverlayEntry(self, path, stat.S_IFREG, content))
+    return dst
+
+  #----------------------------------------------------------------------------
+  def fso_copy(self, src, dst, follow_symlinks=True):
+    '''
+    Overlays shutil.copy(). Note that since overlay entries do not
+    track permission bits, only the content is copied.
+    '''
+    if self._isdir(dst):
+      dst = os.path.join(dst, os.path.basename(src))
+    return self.fso_copyfile(src, dst, follow_symlinks=follow_symlinks)
+
+  #----------------------------------------------------------------------------
+  def fso_copy2(self, src, dst, follow_symlinks=True):
+    '''
+    Overlays shutil.copy2(). Note that since overlay entries do not
+    track permission bits or timestamps, only the content is copied.
+    '''
+    return self.fso_copy(src, dst, follow_symlinks=follow_symlinks)
+
+  #----------------------------------------------------------------------------
+  def fso_copytree(self, src, dst, symlinks=False, ignore=None,
+                   copy_function=None, ignore_dangling_symlinks=False,
+                   dirs_exist_ok=False):
+    '''
+    Overlays shutil.copytree(). The tree is listed via
+    :meth:`fso_scandir` and every file is copied with `copy_function`
+    (by default, :meth:`fso_copy2`), i.e. each copy only records a
+    reference to the original's content.
+    '''
+    if copy_function is None:
+      copy_function = self.fso_copy2
+    entries = list(self.fso_scandir(src))
+    names   = [entry.name for entry in entries]
+    ignored = ignore(src, names) if ignore is not None else ()
+    if not ( dirs_exist_ok and self._isdir(dst) ):
+      self.fso_makedirs(dst)
+    errors = []
+    for entry in entries:
+      if entry.name in ignored:
+        continue
+      srcname = os.path.join(src, entry.name)
+      dstname = os.path.join(dst, entry.name)
+      try:
+        if entry.is_symlink():
+          if symlinks:
+            self.fso_symlink(self.fso_readlink(srcname), dstname)
+            continue
+          if ignore_dangling_symlinks and not self.fso_exists(srcname):
+            continue
+        if entry.is_dir():
+          self.fso_copytree(
+            srcname, dstname, symlinks, ignore, copy_function,
+            ignore_dangling_symlinks, dirs_exist_ok)
+        else:
+          copy_function(srcname, dstname)
+      except shutil.Error as err:
+        errors.extend(err.args[0])
+      except EnvironmentError as why:
+        errors.append((srcname, dstname, str(why)))
+    if errors:
+      raise shutil.Error(errors)
+    return dst
+
+  #----------------------------------------------------------------------------
+  def fso_move(self, src, dst, copy_function=None):
+    '''
+    Overlays shutil.move(), which (as the original) uses
+    :meth:`fso_rename`, i.e. it is O(1) for original files and
+    directories. If that fails, the source is copied with
+    :meth:`fso_copytree` (preserving symlinks) or `copy_function` (by
+    default, :meth:`fso_copy2`), i.e. without copying any data, and
+    then removed.
+    '''
+    if copy_function is None:
+      copy_function = self.fso_copy2
+    if self._isdir(dst):
+      if self.abs(src).rstrip(os.sep) == self.abs(dst).rstrip(os.sep):
+        raise shutil.Error('Destination path \'%s\' already exists' % (dst,))
+      dst = os.path.join(dst, os.path.basename(src.rstrip(os.sep)))
+      if self.fso_lexists(dst):
+        raise shutil.Error('Destination path \'%s\' already exists' % (dst,))
+    try:
+      self.fso_rename(src, dst)
+      return dst
+    except OSError:
+      pass
+    if self.fso_islink(src):
+      self.fso_symlink(self.fso_readlink(src), dst)
+      self.fso_unlink(src)
+    elif self._isdir(src):
+      # note: as with shutil.move(), this compares the absolute paths,
+      #       since `dst`'s parent need not exist
+      asrc = self.abs(src).rstrip(os.sep) + os.sep
+      if self.abs(dst).startswith(asrc):
+        raise shutil.Error(
+          'Cannot move a directory \'%s\' into itself \'%s\'.' % (src, dst))
+      self.fso_copytree(src, dst, symlinks=True, copy_function=copy_function)
+      self.fso_rmtree(src)
+    else:
+      copy_function(src, dst)
+      self.fso_unlink(src)
+    return dst
+
   #----------------------------------------------------------------------------
   def fso_open(self, path, mode=None, buffering=None):
     # todo: what about `buffering`?...
-    # todo: pass `mode` to ContextStringIO/OverlayFileStream so
-    #       that other params can be leveraged? eg. 'b' / '+' / 'U'...
+    # todo: overlay streams are always binary -- should 'U' (universal
+    #       newline) translation be supported?...
 
     if mode is None or mode in ('U', 'rU'):
       mode = 'r'
+    ppath = self._passthrupath(path)
+    if ppath is not None:
+      return self._passthru_open(ppath, mode)
     head, tail = os.path.split(path)
     try:
       head = self.deref(head)
@@ -598,29 +2405,20 @@ class FileSystemOverlay(object):
       raise IOError(errno.ENOENT, 'No such file or directory', path)
     path = os.path.join(head, tail)
 
-    for regex in self.passthru:
-      if regex.match(path):
-        return self.originals['__builtin__:open'](path, mode)
-
     st   = self._stat(head)
     if not stat.S_ISDIR(st.st_mode):
       raise IOError(errno.ENOENT, 'No such file or directory', path)
 
     # todo: do better sanity checking of 'mode'...
 
-    if 'r' in mode and ( 'w' in mode or 'a' in mode ) or '+' in mode:
-      # TODO: remove this restriction...
+    if 'r' in mode and ( 'w' in mode or 'a' in mode ):
       raise ValueError('unsupported FSO mode %s' % (mode,))
 
     if 'r' not in mode and 'w' not in mode and 'a' not in mode:
       raise UnknownOverlayMode(mode)
 
-    # todo: perhaps all operations should return an OverlayStream
-    #       so that "accidental" writes on a 'r' declared fp are
-    #       caught?... is that even a possible problem?
-
     # read
-    if 'r' in mode:
+    if 'r' in mode and '+' not in mode:
       try:
         path = self.deref(path)
         st = self._stat(path)
@@ -631,12 +2429,67 @@ class FileSystemOverlay(object):
       if not stat.S_ISREG(st.st_mode):
         raise IOError(errno.ENOENT, 'No such file or directory', path)
       if path in self.entries:
-        return ContextStringIO(self.entries[path].content)
-      return self.originals['__builtin__:open'](path, mode)
+        return ContentReader(self.entries[path].data, name=path, mode=mode)
+      return self.originals['__builtin__:open'](self._lowerpath(path), mode)
+
+    # update/write/append
+    flags = os.O_RDWR if '+' in mode else os.O_WRONLY
+    if 'w' in mode:
+      flags |= os.O_CREAT | os.O_TRUNC
+    elif 'a' in mode:
+      flags |= os.O_CREAT | os.O_APPEND
+    return self._openfile(path, flags, mode)
+
+  #----------------------------------------------------------------------------
+  def _passthru_open(self, path, mode):
+    if 'r' not in mode or '+' in mode:
+      self._lower_forget(self.abs(path))
+    return self.originals['__builtin__:open'](path, mode)
+
+  #----------------------------------------------------------------------------
+  def _openfile(self, path, flags, mode):
+    '''
+    Opens `path` for writing and/or reading (according to `mode`),
+    creating or truncating it according to the os.O_* `flags`, and
+    returns an :class:`OverlayFileStream`.
+
+    IMPORTANT: expects `path`'s parent to already be deref()'erenced.
+    '''
+    if flags & os.O_CREAT and flags & os.O_EXCL:
+      # the file is created immediately (instead of when the stream is
+      # first flushed) so that exclusive creation is atomic.
+      with self._dirlocks(os.path.dirname(path)):
+        if self._lexists(path):
+          raise IOError(errno.EEXIST, 'File exists', path)
+        self._addentry(OverlayEntry(self, path, stat.S_IFREG, b''))
+      return OverlayFileStream(self, path, mode=mode, dirty=False)
+
+    path, st = self._writetarget(path, flags & os.O_CREAT)
+    if st is None or flags & os.O_TRUNC:
+      if 'r' in mode and '+' not in mode:
+        # read-only streams never commit, i.e. the file is created (or
+        # truncated) immediately
+        self._addentry(OverlayEntry(self, path, stat.S_IFREG, b''))
+        return OverlayFileStream(self, path, mode=mode, dirty=False)
+      return OverlayFileStream(self, path, mode=mode)
 
-    # write/append
+    if path in self.entries:
+      base = self.entries[path].data
+    else:
+      # note: the original is only referenced here, not read -- its
+      #       content is only retrieved if and when it is read.
+      base = Content.fromfile(
+        self._lowerpath(path), st.st_size, self.originals['__builtin__:open'])
+    return OverlayFileStream(self, path, base=base, mode=mode, dirty=False)
 
-    # dereference all symlinks up until the tail is either a file or non-existent
+  #----------------------------------------------------------------------------
+  def _writetarget(self, path, create):
+    '''
+    Dereferences all symlinks in `path` up until the tail is either a
+    regular file or non-existent, and returns a tuple of the resulting
+    path and its lstat() (or ``None`` if it does not exist and
+    `create` is truthy).
+    '''
     while True:
       head, tail = os.path.split(path)
       try:
@@ -647,41 +2500,20 @@ class FileSystemOverlay(object):
       try:
         st = self._lstat(path)
       except OSError:
-        # the file does not exist -- swith 'a' to 'w' (if currently 'a')
-        if 'a' in mode:
-          mode = mode.replace('a', '')
-        if 'w' not in mode:
-          mode = 'w' + mode
-        break
+        if not create:
+          raise IOError(errno.ENOENT, 'No such file or directory', path)
+        return path, None
       if stat.S_ISREG(st.st_mode):
-        break
+        return path, st
       if stat.S_ISLNK(st.st_mode):
         path = os.path.join(head, self.fso_readlink(path))
         continue
       raise IOError(
         errno.EISDIR, 'FSO ERROR: unexpected stat while write/append', path)
 
-    # write
-    if 'a' not in mode:
-      return OverlayFileStream(self, path)
-
-    # append
-    if path in self.entries:
-      if self.entries[path].mode is None:
-        # note: this should never happen -- lstat() should have raised OSError()
-        return OverlayFileStream(self, path)
-      return OverlayFileStream(self, path, prepend=self.entries[path].content)
-
-    with self.originals['__builtin__:open'](path, 'rb') as fp:
-      return OverlayFileStream(self, path, prepend=fp.read())
-
   #----------------------------------------------------------------------------
   def fso_os_open(self, path, flags, mode=0777):
-    # todo: support all `flags` bits:
-    #         os.O_APPEND
-    #         os.O_CREAT
-    #         os.O_EXCL
-    #         os.O_TRUNC
+    # todo: support the remaining `flags` bits, eg:
     #         os.O_DSYNC
     #         os.O_RSYNC
     #         os.O_SYNC
@@ -702,51 +2534,142 @@ class FileSystemOverlay(object):
     #         os.O_DIRECTORY
     #         os.O_NOFOLLOW
     #         os.O_NOATIME
-    nmode = ''
-    if os.O_RDONLY & flags:
-      nmode = 'r'
-    elif os.O_WRONLY & flags:
-      nmode = 'w'
-    elif os.O_RDWR & flags:
-      # TODO: this makes it behave as if `os.O_TRUNC` had been specified,
-      #       but not checking for that... the reason to use 'w' instead
-      #       of 'r+' is simply that the current implementation of fso_open()
-      #       then won't throw a ENOENT error...
-      nmode = 'w'
-    else:
-      raise IOError(errno.EINVAL, 'Invalid argument', flags)
-    if os.O_APPEND & flags:
-      nmode += 'b'
-    fp = self.fso_open(path, nmode)
-    self.fds[id(fp)] = fp
-    return id(fp)
+    access = flags & ( os.O_RDONLY | os.O_WRONLY | os.O_RDWR )
+    if access not in ( os.O_RDONLY, os.O_WRONLY, os.O_RDWR ):
+      raise OSError(errno.EINVAL, 'Invalid argument', path)
+    ppath = self._passthrupath(path)
+    if ppath is not None:
+      return self._passthru_osopen(self.abs(ppath), flags, mode)
+    path = self.abs(path)
+    try:
+      head, tail = os.path.split(path)
+      try:
+        head = self.deref(head)
+      except OSError:
+        raise IOError(errno.ENOENT, 'No such file or directory', path)
+      path = os.path.join(head, tail)
+      if access == os.O_RDONLY and not flags & ( os.O_CREAT | os.O_TRUNC ):
+        try:
+          path = self.deref(path)
+          st = self._stat(path)
+        except OSError:
+          raise IOError(errno.ENOENT, 'No such file or directory', path)
+        if path not in self.entries:
+          # not overlayed: use a real descriptor at native cost
+          return self.originals['os:open'](self._lowerpath(path), flags, mode)
+        if not stat.S_ISREG(st.st_mode):
+          raise IOError(errno.EISDIR, 'Is a directory', path)
+        fp = ContentReader(self.entries[path].data, name=path, mode='rb')
+      elif access == os.O_RDONLY:
+        # note: O_CREAT and O_TRUNC do not make the descriptor writable
+        fp = self._openfile(path, flags, 'rb')
+      else:
+        nmode = 'a' if flags & os.O_APPEND else 'w'
+        if access == os.O_RDWR:
+          nmode += '+'
+        fp = self._openfile(path, flags, nmode + 'b')
+    except IOError as err:
+      raise OSError(err.errno, err.strerror, err.filename)
+    return self.fds.reserve(fp)
+
+  #----------------------------------------------------------------------------
+  def _passthru_osopen(self, path, flags, mode):
+    if flags & ( os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_TRUNC ):
+      self._lower_forget(path)
+    return self.originals['os:open'](path, flags, mode)
 
   #----------------------------------------------------------------------------
-  def fso_os_fdopen(self, fd, mode=None, bufsize=None):
+  def fso_os_fdopen(self, fd, *args, **kw):
     if fd not in self.fds:
-      return self.originals['os:fdopen'](fd, mode, bufsize)
+      return self.originals['os:fdopen'](fd, *args, **kw)
     # todo: ensure that modes are consistent?...
-    return self.fds[fd]
+    return self.fds.adopt(fd)
 
   #----------------------------------------------------------------------------
   def fso_os_read(self, fd, n):
-    if fd not in self.fds:
+    stream = self.fds.get(fd)
+    if stream is None:
       return self.originals['os:read'](fd, n)
-    return self.fds[fd].read(n)
+    try:
+      return stream.read(n)
+    except IOError as err:
+      raise OSError(err.errno, err.strerror)
 
   #----------------------------------------------------------------------------
   def fso_os_write(self, fd, str):
-    if fd not in self.fds:
+    stream = self.fds.get(fd)
+    if stream is None:
       return self.originals['os:write'](fd, str)
-    self.fds[fd].write(str)
+    try:
+      stream.write(str)
+    except IOError as err:
+      raise OSError(err.errno, err.strerror)
     return len(str)
 
+  #----------------------------------------------------------------------------
+  def fso_os_pread(self, fd, n, offset):
+    stream = self.fds.get(fd)
+    if stream is None:
+      return self.originals['os:pread'](fd, n, offset)
+    try:
+      return stream.pread(n, offset)
+    except IOError as err:
+      raise OSError(err.errno, err.strerror)
+
+  #----------------------------------------------------------------------------
+  def fso_os_pwrite(self, fd, str, offset):
+    stream = self.fds.get(fd)
+    if stream is None:
+      return self.originals['os:pwrite'](fd, str, offset)
+    if not stream.writable():
+      raise OSError(errno.EBADF, 'Bad file descriptor')
+    return stream.pwrite(str, offset)
+
+  #----------------------------------------------------------------------------
+  def fso_os_lseek(self, fd, pos, how):
+    stream = self.fds.get(fd)
+    if stream is None:
+      return self.originals['os:lseek'](fd, pos, how)
+    try:
+      return stream.seek(pos, how)
+    except IOError as err:
+      raise OSError(err.errno, err.strerror)
+
+  #----------------------------------------------------------------------------
+  def fso_os_fstat(self, fd):
+    stream = self.fds.get(fd)
+    if stream is None:
+      return self.originals['os:fstat'](fd)
+    mode = stat.S_IFREG | stat.S_IRUSR | stat.S_IWUSR
+    return OverlayStat(
+      st_mode=mode, st_size=stream.size, st_overlay=1,
+      st_ino=0, st_dev=0, st_nlink=0, st_uid=0, st_gid=0,
+      st_atime=0, st_mtime=0, st_ctime=0)
+
+  #----------------------------------------------------------------------------
+  def fso_os_dup(self, fd):
+    if fd not in self.fds:
+      return self.originals['os:dup'](fd)
+    return self.fds.dup(fd)
+
+  #----------------------------------------------------------------------------
+  def fso_os_ftruncate(self, fd, length):
+    stream = self.fds.get(fd)
+    if stream is None:
+      return self.originals['os:ftruncate'](fd, length)
+    if not stream.writable():
+      raise OSError(errno.EINVAL, 'Invalid argument')
+    stream.truncate(length)
+    stream.flush()
+
   #----------------------------------------------------------------------------
   def fso_os_close(self, fd):
     if fd not in self.fds:
       return self.originals['os:close'](fd)
-    self.fds.pop(fd).close()
-
+    stream = self.fds.release(fd)
+    if stream is not None:
+      stream.onclose = None
+      stream.close()
 
 #------------------------------------------------------------------------------
 # end of $Id$
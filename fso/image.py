@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import os
+import io
+import stat
+import mmap
+import struct
+
+import six
+
+try:
+  from collections.abc import MutableMapping
+except ImportError:
+  from collections import MutableMapping
+
+from .content import Content
+
+__all__ = ('OverlayImage',)
+
+#------------------------------------------------------------------------------
+# images are saved and loaded with the real implementation (captured
+# at import time), since that typically happens while an overlay is
+# installed.
+_io_open = io.open
+
+#------------------------------------------------------------------------------
+# the binary image file format (see OverlayImage.save) is:
+#   MAGIC | contents blob | index records | TRAILER
+# where each index record is a _record header followed by the path and
+# the target (if any); integers are little-endian.
+MAGIC    = b'FSOIMG01'
+_record  = struct.Struct('<IIIQQBI')
+_trailer = struct.Struct('<QQ8s')
+
+#: _record target kinds
+_NONE, _FALSE, _STR = 0, 1, 2
+
+#------------------------------------------------------------------------------
+def _encode(value):
+  if isinstance(value, six.text_type):
+    return value.encode('utf-8')
+  return value
+
+#------------------------------------------------------------------------------
+def _decode(value):
+  value = bytes(value)
+  if six.PY3:
+    return value.decode('utf-8')
+  return value
+
+#------------------------------------------------------------------------------
+class ImageSource(object):
+  '''
+  A :class:`fso.content.Content` source that refers to the contents
+  blob of an :class:`OverlayImage`. Since the blob is shared by all
+  overlays that attach to the image (and is never modified), reading
+  from it does not require any handles and partial extents can be
+  served as zero-copy views (memoryviews, or, for memory-mapped blobs
+  in python 2, read-only buffer objects).
+  '''
+  def __init__(self, buffer):
+    self.buffer = buffer
+  def open(self):
+    return io.BytesIO(self.buffer)
+  def __repr__(self):
+    return '<ImageSource size=%d>' % (len(self.buffer),)
+
+
+#------------------------------------------------------------------------------
+class LayeredDict(MutableMapping):
+  '''
+  A dictionary that is a copy-on-write layer over the dictionary
+  `base`, which is never modified, i.e. creating one is O(1) and it
+  only stores its own changes: items that are set are stored in
+  `local`, and the keys of `base` that are overridden or deleted are
+  kept in `hidden`.
+  '''
+
+  _missing = object()
+
+  #----------------------------------------------------------------------------
+  def __init__(self, base):
+    self.base   = base
+    self.local  = dict()
+    self.hidden = set()
+
+  #----------------------------------------------------------------------------
+  def __repr__(self):
+    return '<LayeredDict local=%d hidden=%d base=%d>' % (
+      len(self.local), len(self.hidden), len(self.base))
+
+  #----------------------------------------------------------------------------
+  def __getitem__(self, key):
+    ret = self.local.get(key, self._missing)
+    if ret is not self._missing:
+      return ret
+    if key in self.hidden:
+      raise KeyError(key)
+    return self.base[key]
+
+  #----------------------------------------------------------------------------
+  def get(self, key, default=None):
+    ret = self.local.get(key, self._missing)
+    if ret is not self._missing:
+      return ret
+    if key in self.hidden:
+      return default
+    return self.base.get(key, default)
+
+  #----------------------------------------------------------------------------
+  def __contains__(self, key):
+    return key in self.local or ( key in self.base and key not in self.hidden )
+
+  #----------------------------------------------------------------------------
+  def __setitem__(self, key, value):
+    self.local[key] = value
+    if key in self.base:
+      self.hidden.add(key)
+
+  #----------------------------------------------------------------------------
+  def __delitem__(self, key):
+    if key in self.local:
+      del self.local[key]
+    elif key in self.base and key not in self.hidden:
+      self.hidden.add(key)
+    else:
+      raise KeyError(key)
+
+  #----------------------------------------------------------------------------
+  def __iter__(self):
+    for key in self.local:
+      yield key
+    for key in self.base:
+      if key not in self.hidden:
+        yield key
+
+  #----------------------------------------------------------------------------
+  def __len__(self):
+    return len(self.local) + len(self.base) - len(self.hidden)
+
+  #----------------------------------------------------------------------------
+  def clear(self):
+    self.base = dict()
+    self.local.clear()
+    self.hidden.clear()
+
+  #----------------------------------------------------------------------------
+  def owned(self, key, copy):
+    '''
+    Returns the value for `key` (or ``None`` if not present) such that
+    it can be modified in place, i.e. a value of `base` is first
+    replaced by ``copy(value)``.
+    '''
+    ret = self.local.get(key)
+    if ret is not None or key in self.hidden:
+      return ret
+    ret = self.base.get(key)
+    if ret is not None:
+      ret = self[key] = copy(ret)
+    return ret
+
+#------------------------------------------------------------------------------
+class OverlayImage(object):
+  '''
+  A frozen, compact and picklable copy of the entries of a
+  :class:`fso.FileSystemOverlay`, which other overlays (typically in
+  other processes, e.g. process-pool test workers) can use as their
+  base state. An image consists of a single contents blob and an
+  index of ``(path, mode, omode, offset, size, target)`` records
+  (where `target` is a symlink's target or a directory's origin). The
+  overlay structures derived from the index are only built once per
+  image (and process) and are then shared copy-on-write (see
+  :class:`LayeredDict`) by each overlay that attaches to it; the
+  contents are shared, never copied, so each overlay only pays for
+  its own changes. Images can also be saved to
+  (and memory-mapped from) a binary file, see :meth:`save` and
+  :meth:`load`.
+  '''
+
+  #----------------------------------------------------------------------------
+  def __init__(self, blob=b'', index=(), offset=0, size=None):
+    #: blob: the buffer that holds the contents, which may also be an
+    #:       mmap of an image file (see :meth:`load`), in which case
+    #:       the `size` bytes of contents start at `offset`.
+    self.blob   = blob
+    self.index  = tuple(index)
+    self.offset = offset
+    self.size   = len(blob) - offset if size is None else size
+    self._state = None
+
+  #----------------------------------------------------------------------------
+  @classmethod
+  def freeze(cls, entries, chunksize=65536):
+    '''
+    Creates an :class:`OverlayImage` from the dictionary of
+    :class:`fso.filesystemoverlay.OverlayEntry` objects `entries`.
+    The content of regular files is copied into the image (including
+    any ranges that still refer to the original files), so the image
+    is self-contained.
+    '''
+    blob  = io.BytesIO()
+    index = []
+    for path in sorted(entries.keys()):
+      entry  = entries[path]
+      offset = size = 0
+      target = None
+      if entry.data is not None:
+        offset = blob.tell()
+        for chunk in entry.data.iterchunks(chunksize=chunksize, views=True):
+          blob.write(chunk)
+        size = blob.tell() - offset
+      elif entry.mode == stat.S_IFLNK:
+        target = entry.content
+      elif entry.mode == stat.S_IFDIR:
+        target = entry.origin
+      index.append((path, entry.mode, entry.omode, offset, size, target))
+    return cls(blob.getvalue(), index)
+
+  #----------------------------------------------------------------------------
+  @classmethod
+  def dump(cls, entries, target, chunksize=65536):
+    '''
+    Saves an image of the dictionary of
+    :class:`fso.filesystemoverlay.OverlayEntry` objects `entries` to
+    `target` (a filename or a binary file-like object) in the binary
+    format that :meth:`load` maps, without building the image in
+    memory first, i.e. the content is streamed to `target` in chunks.
+    '''
+    if isinstance(target, six.string_types):
+      with _io_open(target, 'wb') as fp:
+        return cls.dump(entries, fp, chunksize=chunksize)
+    target.write(MAGIC)
+    index  = []
+    offset = 0
+    for path in sorted(entries.keys()):
+      entry = entries[path]
+      start = offset
+      ref   = None
+      if entry.data is not None:
+        for chunk in entry.data.iterchunks(chunksize=chunksize, views=True):
+          target.write(chunk)
+          offset += len(chunk)
+      elif entry.mode == stat.S_IFLNK:
+        ref = entry.content
+      elif entry.mode == stat.S_IFDIR:
+        ref = entry.origin
+      index.append((path, entry.mode, entry.omode, start, offset - start, ref))
+    cls._writeindex(target, index, len(MAGIC) + offset)
+
+  #----------------------------------------------------------------------------
+  @classmethod
+  def _writeindex(cls, fp, index, position):
+    for path, mode, omode, offset, size, target in index:
+      path = _encode(path)
+      if target is None or target is False:
+        kind, target = ( _NONE if target is None else _FALSE ), b''
+      else:
+        kind, target = _STR, _encode(target)
+      fp.write(_record.pack(
+        len(path), mode or 0, omode or 0, offset, size, kind, len(target)))
+      fp.write(path)
+      fp.write(target)
+    fp.write(_trailer.pack(position, len(index), MAGIC))
+
+  #----------------------------------------------------------------------------
+  def save(self, target):
+    '''
+    Saves this image to `target` (a filename or a binary file-like
+    object) in the binary format that :meth:`load` maps.
+    '''
+    if isinstance(target, six.string_types):
+      with _io_open(target, 'wb') as fp:
+        return self.save(fp)
+    target.write(MAGIC)
+    for pos in range(0, self.size, 1024 * 1024):
+      end = self.offset + min(self.size, pos + 1024 * 1024)
+      target.write(self.blob[self.offset + pos:end])
+    self._writeindex(target, self.index, len(MAGIC) + self.size)
+
+  #----------------------------------------------------------------------------
+  @classmethod
+  def load(cls, source):
+    '''
+    Loads an image that was saved with :meth:`save` (or :meth:`dump`)
+    from `source`, a filename (or a binary file-like object). Files
+    are memory-mapped, i.e. loading only parses the index: contents
+    are paged in by the OS when they are read. Reads into buffers
+    (e.g. ``readinto()``) and re-saving are served directly from the
+    mapping, i.e. without intermediate copies (see
+    :class:`fso.image.ImageSource`); other reads copy the requested
+    bytes out of the mapping. Raises ValueError if `source` is not an
+    image.
+    '''
+    if isinstance(source, six.string_types):
+      with _io_open(source, 'rb') as fp:
+        return cls.load(fp)
+    try:
+      buf = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, IOError, OSError, ValueError):
+      buf = source.read()
+    total = len(buf)
+    if total < len(MAGIC) + _trailer.size or buf[:len(MAGIC)] != MAGIC:
+      raise ValueError('not an fso image')
+    position, count, magic = _trailer.unpack(buf[total - _trailer.size:])
+    if magic != MAGIC:
+      raise ValueError('not an fso image (or truncated)')
+    blobend = position
+    index = []
+    for idx in range(count):
+      plen, mode, omode, offset, size, kind, tlen = \
+        _record.unpack(buf[position:position + _record.size])
+      position += _record.size
+      path = _decode(buf[position:position + plen])
+      position += plen
+      target = None
+      if kind == _FALSE:
+        target = False
+      elif kind == _STR:
+        target = _decode(buf[position:position + tlen])
+      position += tlen
+      index.append((path, mode or None, omode or None, offset, size, target))
+    return cls(buf, index, offset=len(MAGIC), size=blobend - len(MAGIC))
+
+  #----------------------------------------------------------------------------
+  def __repr__(self):
+    return '<OverlayImage entries=%d size=%d>' % (len(self.index), self.size)
+
+  #----------------------------------------------------------------------------
+  def __getstate__(self):
+    blob = self.blob
+    if self.offset or self.size != len(blob):
+      blob = blob[self.offset:self.offset + self.size]
+    return dict(blob=blob, index=self.index)
+
+  #----------------------------------------------------------------------------
+  def __setstate__(self, state):
+    self.__init__(state['blob'], state['index'])
+
+  #----------------------------------------------------------------------------
+  def __len__(self):
+    return len(self.index)
+
+  #----------------------------------------------------------------------------
+  def _build(self):
+    '''
+    Returns the overlay structures (the entries, sorted paths, sorted
+    changes, directory child index and directory origins) that this
+    image represents, building them on first use. These must never be
+    modified, since they are shared by all attached overlays.
+    '''
+    if self._state is not None:
+      return self._state
+    from .filesystemoverlay import OverlayEntry
+    source   = ImageSource(self.blob)
+    entries  = dict()
+    paths    = []
+    changes  = []
+    children = dict()
+    origins  = dict()
+    for path, mode, omode, offset, size, target in self.index:
+      origin = None
+      if mode == stat.S_IFREG:
+        content = Content([(source, self.offset + offset, size)] if size else [])
+      elif mode == stat.S_IFDIR:
+        content, origin = None, target
+      else:
+        content = target
+      entry = OverlayEntry(None, path, mode, content, omode=omode, origin=origin)
+      entries[path] = entry
+      if origin is not None:
+        origins[path] = origin
+      paths.append(path)
+      changes.append(entry.change)
+      cur = path
+      while True:
+        head, tail = os.path.split(cur)
+        if not tail:
+          break
+        kids = children.get(head)
+        if kids is not None:
+          kids.add(tail)
+          break
+        children[head] = set([tail])
+        cur = head
+    self._state = (entries, paths, changes, children, origins)
+    return self._state
+
+  #----------------------------------------------------------------------------
+  def attach(self, fso):
+    '''
+    Makes this image the current state of the (empty) overlay `fso`.
+    This is O(1), since the image's structures are layered under the
+    overlay's copy-on-write, see :meth:`fso.FileSystemOverlay._layer`.
+    '''
+    if fso.entries:
+      raise ValueError('cannot attach an image to a non-empty overlay')
+    return fso._layer(*self._build())
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
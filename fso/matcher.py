@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import re
+
+import morph
+
+from .cache import LRUCache
+
+__all__ = ('PathMatcher',)
+
+# characters that end the literal prefix of a regular expression
+_special = frozenset('.^$*+?{}[]\\|()')
+# characters that make the preceding character optional
+_optional = frozenset('*?{')
+
+#------------------------------------------------------------------------------
+def literal_prefix(regex):
+  '''
+  Returns the literal string that all paths matched (via ``match()``,
+  i.e. anchored at the start) by the compiled `regex` must start with,
+  which is the empty string if no such prefix can be determined.
+  '''
+  if regex.flags & re.IGNORECASE or '|' in regex.pattern:
+    return ''
+  pattern = regex.pattern
+  if pattern.startswith('^'):
+    pattern = pattern[1:]
+  for idx, char in enumerate(pattern):
+    if char in _special:
+      if char in _optional and idx > 0:
+        idx -= 1
+      return pattern[:idx]
+  return pattern
+
+
+#------------------------------------------------------------------------------
+class PathMatcher(object):
+  '''
+  Matches paths against a set of regular expressions (either strings
+  or compiled regexes, which are matched with ``match()``, i.e.
+  anchored at the start of the path). Instead of trying each
+  expression in turn:
+
+  * the literal prefixes of the expressions are kept in a trie, so
+    that paths that cannot possibly match (typically, the vast
+    majority) are rejected after a few character comparisons;
+
+  * the expressions are combined into a single regex (expressions
+    with differing flags are matched separately); and
+
+  * the decision for each path is cached in an LRU of `cache_size`
+    paths.
+  '''
+
+  #: the default maximum number of path decisions that are cached.
+  cache_size = 65536
+
+  #----------------------------------------------------------------------------
+  def __init__(self, patterns, cache_size=None):
+    if not morph.isseq(patterns):
+      patterns = [patterns]
+    self.patterns = [re.compile(expr) if morph.isstr(expr) else expr
+                     for expr in patterns]
+    self._trie    = dict()
+    self._always  = False
+    for regex in self.patterns:
+      prefix = literal_prefix(regex)
+      if not prefix:
+        self._always = True
+        continue
+      node = self._trie
+      for char in prefix:
+        node = node.setdefault(char, dict())
+      node[None] = True
+    byflags = dict()
+    for regex in self.patterns:
+      byflags.setdefault(regex.flags, []).append(regex)
+    self._regexes = []
+    for flags, regexes in byflags.items():
+      try:
+        self._regexes.append(re.compile(
+          '|'.join('(?:%s)' % (regex.pattern,) for regex in regexes), flags))
+      except re.error:
+        # e.g. duplicate group names or backreferences
+        self._regexes.extend(regexes)
+    self._cache = LRUCache(cache_size or self.cache_size)
+
+  #----------------------------------------------------------------------------
+  def __len__(self):
+    return len(self.patterns)
+
+  #----------------------------------------------------------------------------
+  def __iter__(self):
+    return iter(self.patterns)
+
+  #----------------------------------------------------------------------------
+  def _candidate(self, path):
+    'Returns whether or not `path` starts with any literal prefix.'
+    if self._always:
+      return True
+    node = self._trie
+    for char in path:
+      node = node.get(char)
+      if node is None:
+        return False
+      if None in node:
+        return True
+    return False
+
+  #----------------------------------------------------------------------------
+  def match(self, path):
+    'Returns whether or not `path` matches any of the expressions.'
+    ret = self._cache.get(path)
+    if ret is not None:
+      return ret
+    ret = False
+    if self._candidate(path):
+      for regex in self._regexes:
+        if regex.match(path):
+          ret = True
+          break
+    self._cache.put(path, ret)
+    return ret
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
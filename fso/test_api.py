@@ -89,6 +89,114 @@ class TestApi(unittest.TestCase):
         self.assertEqual(fp.read(), 'stuffs')
     self.assertFalse(os.path.exists(fname1))
 
+  #----------------------------------------------------------------------------
+  def test_api_scope(self):
+    import threading
+    fname   = tempfile.mktemp(prefix='fso-test_api-unittest.scope.')
+    count   = 8
+    results = dict()
+    written = []
+    cond    = threading.Condition()
+    def worker(num):
+      with api.scope() as overlay:
+        try:
+          self.assertIs(api.peek(), overlay)
+          with open(fname, 'wb') as fp:
+            fp.write('thread-%d' % (num,))
+        finally:
+          with cond:
+            written.append(num)
+            cond.notify_all()
+            while len(written) < count:
+              cond.wait()
+        # all threads have now written the same file, but each one
+        # only sees its own
+        with open(fname, 'rb') as fp:
+          results[num] = fp.read()
+        self.assertEqual(overlay.changes, ['add:' + fname])
+    stat    = os.stat
+    threads = [threading.Thread(target=worker, args=(num,))
+               for num in range(count)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(results, {num: 'thread-%d' % (num,) for num in range(count)})
+    self.assertFalse(os.path.exists(fname))
+    with api.scope() as outer:
+      self.assertIsNot(os.stat, stat)
+      os.mkdir(fname)
+      # a nested scope overlays the outer one
+      with api.scope() as inner:
+        self.assertIs(api.peek(), inner)
+        self.assertTrue(os.path.isdir(fname))
+        os.rmdir(fname)
+        self.assertFalse(os.path.exists(fname))
+        self.assertEqual(inner.changes, ['del:' + fname])
+      self.assertTrue(os.path.isdir(fname))
+      self.assertIs(api.peek(), outer)
+      self.assertEqual(outer.changes, ['add:' + fname])
+    self.assertFalse(os.path.exists(fname))
+    # the trampolines are removed when the last scope exits
+    self.assertFalse(api.dispatcher().installed)
+    self.assertIs(os.stat, stat)
+
+  #----------------------------------------------------------------------------
+  def test_api_scope_push(self):
+    fname = tempfile.mktemp(prefix='fso-test_api-unittest.scopepush.')
+    stat  = os.stat
+    # a scope within a push
+    pushed = api.push()
+    os.mkdir(fname)
+    with api.scope() as scoped:
+      self.assertIs(api.peek(), scoped)
+      self.assertTrue(os.path.isdir(fname))
+      os.rmdir(fname)
+      self.assertFalse(os.path.exists(fname))
+    self.assertTrue(os.path.isdir(fname))
+    self.assertIn(fname, api.pop())
+    self.assertFalse(os.path.exists(fname))
+    # a push within a scope
+    with api.scope() as scoped:
+      os.mkdir(fname)
+      pushed = api.push()
+      self.assertTrue(os.path.isdir(fname))
+      os.rmdir(fname)
+      self.assertFalse(os.path.exists(fname))
+      api.pop()
+      self.assertTrue(os.path.isdir(fname))
+      self.assertEqual(scoped.changes, ['add:' + fname])
+    self.assertFalse(os.path.exists(fname))
+    self.assertIs(os.stat, stat)
+
+  #----------------------------------------------------------------------------
+  def test_api_recycle(self):
+    fname = tempfile.mktemp(prefix='fso-test_api-unittest.recycle.')
+    overlay = api.push()
+    with open(fname, 'wb') as fp:
+      fp.write('data')
+    entries = api.pop(recycle=True)
+    self.assertEqual(entries.keys(), [fname])
+    self.assertEqual(entries[fname].content, 'data')
+    self.assertFalse(os.path.exists(fname))
+    # the recycled overlay is reused, but starts out empty
+    self.assertIs(api.push(), overlay)
+    try:
+      self.assertEqual(overlay.changes, [])
+      self.assertFalse(os.path.exists(fname))
+      os.mkdir(fname)
+      self.assertEqual(overlay.changes, ['add:' + fname])
+      overlay.reset()
+      self.assertTrue(overlay.active)
+      self.assertEqual(overlay.changes, [])
+    finally:
+      api.pop()
+    # explicitly specified overlays are never recycled
+    custom = api.push(api.FileSystemOverlay())
+    api.pop(recycle=True)
+    self.assertIsNot(api.push(), custom)
+    api.pop()
+
 
 #------------------------------------------------------------------------------
 # end of $Id$
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import os
+import io
+import unittest
+import tempfile
+import tarfile
+import zipfile
+import shutil
+
+from .filesystemoverlay import FileSystemOverlay
+from .archive import Archive
+
+#------------------------------------------------------------------------------
+class TestArchive(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def setUp(self):
+    self.tdir = tempfile.mkdtemp(prefix='fso-test_archive-unittest.')
+
+  #----------------------------------------------------------------------------
+  def tearDown(self):
+    shutil.rmtree(self.tdir)
+
+  #----------------------------------------------------------------------------
+  def makeTar(self):
+    path = os.path.join(self.tdir, 'fixture.tar.gz')
+    tar = tarfile.open(path, 'w:gz')
+    def add(name, data=None, **kw):
+      info = tarfile.TarInfo(name)
+      for key, value in kw.items():
+        setattr(info, key, value)
+      if data is not None:
+        info.size = len(data)
+        data = io.BytesIO(data)
+      tar.addfile(info, data)
+    add('app', type=tarfile.DIRTYPE)
+    add('app/main.py', b'print 1\n')
+    add('app/lib/util.py', b'x' * 1000)
+    add('app/link', type=tarfile.SYMTYPE, linkname='main.py')
+    add('app/hard', type=tarfile.LNKTYPE, linkname='app/main.py')
+    add('../evil', b'evil')
+    add('app/../../evil', b'evil')
+    add('/abs', b'abs')
+    add('app/./sub/../norm', b'norm')
+    tar.close()
+    return path
+
+  #----------------------------------------------------------------------------
+  def makeZip(self):
+    path = os.path.join(self.tdir, 'fixture.zip')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zfp:
+      zfp.writestr('app/main.py', b'print 1\n')
+      zfp.writestr('app/lib/util.py', b'x' * 1000)
+      zfp.writestr('/abs', b'abs')
+      zfp.writestr('../evil', b'evil')
+    return path
+
+  #----------------------------------------------------------------------------
+  def assertMounted(self, archive, root):
+    def read(name):
+      with open(os.path.join(root, name), 'rb') as fp:
+        return fp.read()
+    self.assertEqual(len(archive._cache), 0)
+    self.assertEqual(read('app/main.py'), b'print 1\n')
+    self.assertEqual(len(archive._cache), 1)
+    self.assertEqual(os.path.getsize(os.path.join(root, 'app/lib/util.py')), 1000)
+    self.assertEqual(read('app/lib/util.py'), b'x' * 1000)
+    self.assertEqual(sorted(os.listdir(os.path.join(root, 'app/lib'))), ['util.py'])
+    with open(os.path.join(root, 'app/main.py'), 'ab') as fp:
+      fp.write(b'print 2\n')
+    self.assertEqual(read('app/main.py'), b'print 1\nprint 2\n')
+
+  #----------------------------------------------------------------------------
+  def test_mount_tar(self):
+    root = os.path.join(self.tdir, 'mnt')
+    with FileSystemOverlay() as fso:
+      # note: the archive is itself an overlay file here
+      archive = fso.mount(root, self.makeTar())
+      self.assertEqual(
+        sorted(os.listdir(self.tdir)), ['fixture.tar.gz', 'mnt'])
+      self.assertEqual(
+        sorted(os.listdir(os.path.join(root, 'app'))),
+        ['hard', 'lib', 'link', 'main.py', 'norm'])
+      self.assertMounted(archive, root)
+      self.assertEqual(os.readlink(os.path.join(root, 'app/link')), 'main.py')
+      with open(os.path.join(root, 'app/hard'), 'rb') as fp:
+        self.assertEqual(fp.read(), b'print 1\n')
+      self.assertFalse(os.path.exists(os.path.join(self.tdir, 'evil')))
+      # absolute and parent-relative member names are skipped
+      self.assertEqual(os.listdir(root), ['app'])
+      with open(os.path.join(root, 'app/norm'), 'rb') as fp:
+        self.assertEqual(fp.read(), b'norm')
+      archive.close()
+    self.assertEqual(os.listdir(self.tdir), [])
+
+  #----------------------------------------------------------------------------
+  def test_mount_zip(self):
+    root = os.path.join(self.tdir, 'mnt')
+    path = self.makeZip()
+    with FileSystemOverlay() as fso:
+      archive = fso.mount(root, path)
+      self.assertEqual(os.listdir(root), ['app'])
+      self.assertMounted(archive, root)
+      archive.close()
+
+  #----------------------------------------------------------------------------
+  def test_cache_bound(self):
+    archive = Archive(self.makeZip(), cache_size=1000)
+    self.assertEqual(len(list(archive.members())), 2)
+    self.assertEqual(archive.read('app/main.py'), b'print 1\n')
+    self.assertEqual(archive.read('app/lib/util.py'), b'x' * 1000)
+    self.assertEqual(len(archive._cache), 1)
+    self.assertLessEqual(archive._cache.size, 1000)
+    archive.close()
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
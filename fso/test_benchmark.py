@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import os
+import json
+import shutil
+import unittest
+import tempfile
+
+from . import benchmark
+
+#------------------------------------------------------------------------------
+class TestBenchmark(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_json(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test-benchmark.')
+    try:
+      out = os.path.join(tdir, 'results.json')
+      self.assertEqual(benchmark.main([
+        '-n', '2', '-e', '10,2500', '-d', '1,3', '-b', 'stat', '-b', 'rmtree',
+        '--json', '-o', out]), 0)
+      with open(out) as fp:
+        data = json.load(fp)
+    finally:
+      shutil.rmtree(tdir)
+    self.assertEqual(data['number'], 2)
+    self.assertEqual(
+      sorted(set((res['name'], res['entries'], res['depth'])
+                 for res in data['results'])),
+      sorted((name, count, depth)
+             for name in ('stat', 'lstat', 'rmtree')
+             for count in (10, 2500) for depth in (1, 3)))
+    for res in data['results']:
+      self.assertGreater(res['usec'], 0)
+      self.assertGreater(res['native_usec'], 0)
+      self.assertAlmostEqual(res['ratio'], res['usec'] / res['native_usec'])
+
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
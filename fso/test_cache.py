@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import unittest
+
+from .cache import LRUCache
+
+#------------------------------------------------------------------------------
+class TestLRUCache(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_eviction(self):
+    cache = LRUCache(3)
+    for key in 'abc':
+      cache.put(key, key.upper())
+    self.assertEqual(cache.get('a'), 'A')
+    cache.put('d', 'D')
+    self.assertEqual(len(cache), 3)
+    self.assertNotIn('b', cache)
+    self.assertEqual(cache.get('b', 'missing'), 'missing')
+    self.assertEqual([cache.get(key) for key in 'acd'], ['A', 'C', 'D'])
+
+  #----------------------------------------------------------------------------
+  def test_sizeof(self):
+    cache = LRUCache(10, sizeof=len)
+    cache.put('a', 'xxxx')
+    cache.put('b', 'yyyy')
+    self.assertEqual(cache.size, 8)
+    cache.put('c', 'zzzz')
+    self.assertEqual(cache.size, 8)
+    self.assertNotIn('a', cache)
+    cache.put('d', 'w' * 11)
+    self.assertNotIn('d', cache)
+    self.assertEqual(cache.pop('b'), 'yyyy')
+    self.assertEqual(cache.size, 4)
+    cache.clear()
+    self.assertEqual((len(cache), cache.size), (0, 0))
+
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import os
+import unittest
+import tempfile
+
+from .content import Content, ContentReader, ContentStream, FileSource
+
+#------------------------------------------------------------------------------
+class TestContent(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def setUp(self):
+    fd, self.fname = tempfile.mkstemp(prefix='fso-test_content-unittest.')
+    os.write(fd, 'abcdefghij')
+    os.close(fd)
+
+  #----------------------------------------------------------------------------
+  def tearDown(self):
+    os.unlink(self.fname)
+
+  #----------------------------------------------------------------------------
+  def test_append(self):
+    base = Content.fromfile(self.fname, 10)
+    self.assertEqual(base.size, 10)
+    content = base.append('klm').append('nop')
+    self.assertEqual(content.size, 16)
+    self.assertIs(content.extents[0], base.extents[0])
+    self.assertEqual(len(content.extents), 2)
+    self.assertEqual(content.getvalue(), 'abcdefghijklmnop')
+    self.assertEqual(content.read(8, 4), 'ijkl')
+    self.assertEqual(list(content.iterchunks(2, 10, chunksize=3)),
+                     ['cde', 'fgh', 'ij', 'kl'])
+    self.assertEqual(base.getvalue(), 'abcdefghij')
+    self.assertIs(Content.frombytes('xyz').append('').extents[0][0], 'xyz')
+
+  #----------------------------------------------------------------------------
+  def test_reader(self):
+    content = Content.fromfile(self.fname, 4).append('\nxyz\n').append('last')
+    with ContentReader(content) as fp:
+      self.assertEqual(fp.readline(), 'abcd\n')
+      self.assertEqual(fp.tell(), 5)
+      self.assertEqual(fp.readlines(), ['xyz\n', 'last'])
+      self.assertEqual(fp.read(), '')
+      fp.seek(-6, 2)
+      self.assertEqual(fp.read(3), 'z\nl')
+      fp.seek(0)
+      self.assertEqual(fp.read(), 'abcd\nxyz\nlast')
+    with self.assertRaises(ValueError):
+      fp.read()
+
+  #----------------------------------------------------------------------------
+  def test_write_truncate(self):
+    base = Content.fromfile(self.fname, 10)
+    content = base.write(2, 'XY')
+    self.assertEqual(content.getvalue(), 'abXYefghij')
+    self.assertEqual(len(content.extents), 3)
+    self.assertEqual(content.write(3, 'Z').getvalue(), 'abXZefghij')
+    self.assertEqual(len(content.write(3, 'Z').extents), 3)
+    self.assertEqual(content.write(8, 'KLMN').getvalue(), 'abXYefghKLMN')
+    self.assertEqual(content.write(12, '!').getvalue(), 'abXYefghij\0\0!')
+    self.assertEqual(content.write(12, '!').extents[-2], (None, 0, 2))
+    self.assertEqual(content.truncate(3).getvalue(), 'abX')
+    self.assertEqual(content.truncate(12).getvalue(), 'abXYefghij\0\0')
+    self.assertIs(content.truncate(10), content)
+    self.assertEqual(base.getvalue(), 'abcdefghij')
+    sparse = Content().truncate(1 << 40).write((1 << 40) - 1, '!')
+    self.assertEqual(sparse.size, 1 << 40)
+    self.assertEqual(sparse.read((1 << 40) - 4), '\0\0\0!')
+
+  #----------------------------------------------------------------------------
+  def test_stream(self):
+    base = Content.fromfile(self.fname, 10)
+    fp = ContentStream(base, mode='r+b')
+    self.assertEqual(fp.read(3), 'abc')
+    fp.write('123')
+    fp.write('45')
+    self.assertEqual(fp.tell(), 8)
+    self.assertEqual(fp.read(), 'ij')
+    fp.seek(12)
+    fp.write('z')
+    fp.seek(0)
+    self.assertEqual(fp.read(), 'abc12345ij\0\0z')
+    fp.truncate(4)
+    self.assertEqual(fp.getcontent().getvalue(), 'abc1')
+    self.assertEqual(base.getvalue(), 'abcdefghij')
+    fp = ContentStream(base, mode='ab')
+    fp.seek(0)
+    fp.write('+')
+    self.assertEqual(fp.getcontent().getvalue(), 'abcdefghij+')
+    with self.assertRaises(IOError):
+      fp.read()
+
+  #----------------------------------------------------------------------------
+  def test_zerocopy(self):
+    data = 'x' * 1024 + '\n' + 'y' * 1024
+    content = Content.frombytes(data)
+    self.assertIs(content.extents[0][0], data)
+    self.assertIs(ContentReader(content).read(), data)
+    buf = bytearray(10)
+    fp = ContentReader(content.append('z' * 10))
+    fp.seek(1020)
+    self.assertEqual(fp.readinto(buf), 10)
+    self.assertEqual(bytes(buf), 'xxxx\nyyyyy')
+    fp.seek(-3, 2)
+    self.assertEqual(fp.readinto(buf), 3)
+    self.assertEqual(bytes(buf[:3]), 'zzz')
+    self.assertEqual(fp.readinto(buf), 0)
+
+  #----------------------------------------------------------------------------
+  def test_stream_bytes(self):
+    fp = ContentStream(mode='w+b')
+    buf = bytearray('abc')
+    fp.write(buf)
+    buf[0] = ord('X')
+    fp.write(memoryview(buf)[1:])
+    fp.write(u'de')
+    fp.seek(0)
+    self.assertEqual(fp.read(), 'abcbcde')
+    self.assertIsInstance(fp.getcontent().extents[0][0], bytes)
+    buf = bytearray(4)
+    fp.seek(3)
+    self.assertEqual(fp.readinto(buf), 4)
+    self.assertEqual(bytes(buf), 'bcde')
+
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
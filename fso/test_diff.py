@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import unittest
+import difflib
+import random
+
+from .content import Content
+from .diff import unified_diff
+
+#------------------------------------------------------------------------------
+class TestDiff(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def assertDiff(self, old, new, context=3):
+    ref = list(difflib.unified_diff(
+      old.splitlines(True), new.splitlines(True), 'a', 'b', n=context))
+    ref = [line if line.endswith('\n') else line + '\n\\ No newline at end of file\n'
+           for line in ref]
+    out = unified_diff(
+      Content.frombytes(old), Content.frombytes(new), 'a', 'b', context=context)
+    self.assertEqual(''.join(out), ''.join(ref))
+
+  #----------------------------------------------------------------------------
+  def test_matches_difflib(self):
+    rand  = random.Random(42)
+    lines = ['line %d\n' % (idx,) for idx in range(200)]
+    for count in range(50):
+      new = list(lines)
+      for edit in range(rand.randint(1, 4)):
+        idx = rand.randrange(len(new))
+        op  = rand.choice('adm')
+        if op == 'a':
+          new.insert(idx, 'added %d\n' % (edit,))
+        elif op == 'd':
+          del new[idx]
+        else:
+          new[idx] = new[idx][:-1] + ' (modified)\n'
+      for context in (0, 1, 3):
+        self.assertDiff(''.join(lines), ''.join(new), context=context)
+    self.assertDiff('a\nb\nc', 'a\nb\nd')
+    self.assertDiff('a\nb\nc\n', 'a\nb\nc')
+    self.assertDiff('', 'a\n')
+    self.assertDiff('a\n', '')
+    self.assertDiff('--- a\n', '+++ b\n')
+
+  #----------------------------------------------------------------------------
+  def test_nochange(self):
+    self.assertEqual(list(unified_diff(
+      Content.frombytes('abc\n'), Content.frombytes('abc\n'), 'a', 'b')), [])
+
+  #----------------------------------------------------------------------------
+  def test_binary(self):
+    self.assertEqual(list(unified_diff(
+      Content.frombytes('a\0b'), Content.frombytes('a\0c'), 'a', 'b')), [
+        'Binary files a and b differ\n'])
+    self.assertEqual(list(unified_diff(
+      None, Content.frombytes('\0'), 'a', 'b')), [
+        'Binary files /dev/null and b differ\n'])
+
+  #----------------------------------------------------------------------------
+  def test_shared_extents(self):
+    # the shared leading extent is never read, i.e. a source that
+    # cannot be read must not be a problem.
+    class Unreadable(object):
+      def open(self):
+        raise AssertionError('shared extent was read')
+    old = Content([(Unreadable(), 0, 1 << 30)])
+    new = old.append('more\n')
+    self.assertEqual(old.commonprefix(new), 1 << 30)
+    self.assertEqual(old.truncate(10).commonprefix(old), 10)
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
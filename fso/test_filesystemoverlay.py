@@ -28,9 +28,15 @@ import os
 import unittest
 import tempfile
 import stat
+import errno
+import re
 import shutil
+import tarfile
+import glob
 import uuid
 
+import six
+
 from .filesystemoverlay import FileSystemOverlay
 
 #------------------------------------------------------------------------------
@@ -519,6 +525,23 @@ class TestFileSystemOverlay(unittest.TestCase):
       with open(fname, 'rb') as fp:
         self.assertEqual(fp.read(), 'osopen.test\n')
       self.assertTrue(os.path.exists(fname))
+      # O_CREAT and O_TRUNC do not make read-only descriptors writable
+      fd = os.open(fname, os.O_RDONLY | os.O_TRUNC)
+      with self.assertRaises(OSError) as cm:
+        os.write(fd, 'data')
+      self.assertEqual(cm.exception.errno, errno.EBADF)
+      self.assertEqual(os.read(fd, 10), '')
+      os.close(fd)
+      self.assertEqual(os.stat(fname).st_size, 0)
+      os.unlink(fname)
+      fd = os.open(fname, os.O_RDONLY | os.O_CREAT, 0644)
+      self.assertTrue(os.path.exists(fname))
+      with self.assertRaises(OSError) as cm:
+        os.write(fd, 'data')
+      self.assertEqual(cm.exception.errno, errno.EBADF)
+      os.close(fd)
+      self.assertEqual(os.stat(fname).st_size, 0)
+      self.assertEqual(fso.changes, ['add:' + fname])
     self.assertFalse(os.path.exists(fname))
 
   #----------------------------------------------------------------------------
@@ -548,6 +571,1055 @@ class TestFileSystemOverlay(unittest.TestCase):
     self.assertEqual(open(fkeep, 'rb').read(), 'keep')
 
 
+  #----------------------------------------------------------------------------
+  def test_listdir_index(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.listdir_index.')
+    os.makedirs(os.path.join(tdir, 'a/b'))
+    with open(os.path.join(tdir, 'a/real'), 'wb') as fp:
+      fp.write('real')
+    with FileSystemOverlay() as fso:
+      os.makedirs(os.path.join(tdir, 'a/b/c/d'))
+      with open(os.path.join(tdir, 'a/b/c/d/file'), 'wb') as fp:
+        fp.write('data')
+      os.unlink(os.path.join(tdir, 'a/real'))
+      self.assertEqual(os.listdir(os.path.join(tdir, 'a')), ['b'])
+      self.assertEqual(os.listdir(os.path.join(tdir, 'a/b/c/d')), ['file'])
+      self.assertEqual(fso.get_changes(os.path.join(tdir, 'a/b')), [
+        'add:c',
+        'add:c/d',
+        'add:c/d/file',
+      ])
+      self.assertEqual(fso._children[os.path.join(tdir, 'a/b/c/d')], set(['file']))
+      self.assertEqual(fso._children[os.path.join(tdir, 'a/b')], set(['c']))
+      os.unlink(os.path.join(tdir, 'a/b/c/d/file'))
+      os.rmdir(os.path.join(tdir, 'a/b/c/d'))
+      os.rmdir(os.path.join(tdir, 'a/b/c'))
+      self.assertEqual(fso.get_changes(os.path.join(tdir, 'a/b')), [])
+      self.assertEqual(os.listdir(os.path.join(tdir, 'a/b')), [])
+      self.assertNotIn(os.path.join(tdir, 'a/b'), fso._children)
+    os.unlink(os.path.join(tdir, 'a/real'))
+    os.rmdir(os.path.join(tdir, 'a/b'))
+    os.rmdir(os.path.join(tdir, 'a'))
+    os.rmdir(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_deref_cache(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.deref_cache.')
+    os.makedirs(os.path.join(tdir, 'a/b/c'))
+    with FileSystemOverlay() as fso:
+      calls = []
+      def lstat(path, _lstat=fso.originals['os:lstat']):
+        calls.append(path)
+        return _lstat(path)
+      fso.originals['os:lstat'] = lstat
+      os.symlink('a', os.path.join(tdir, 'link'))
+      self.assertEqual(
+        fso.deref(os.path.join(tdir, 'link/b/c')), os.path.join(tdir, 'a/b/c'))
+      self.assertNotEqual(calls, [])
+      del calls[:]
+      self.assertEqual(
+        fso.deref(os.path.join(tdir, 'link/b/c')), os.path.join(tdir, 'a/b/c'))
+      self.assertEqual(
+        fso.deref(os.path.join(tdir, 'link/b')), os.path.join(tdir, 'a/b'))
+      self.assertEqual(calls, [])
+      os.unlink(os.path.join(tdir, 'link'))
+      os.makedirs(os.path.join(tdir, 'x/b/c'))
+      os.symlink('x', os.path.join(tdir, 'link'))
+      self.assertEqual(
+        fso.deref(os.path.join(tdir, 'link/b/c')), os.path.join(tdir, 'x/b/c'))
+      self.assertEqual(
+        fso.deref(os.path.join(tdir, 'a/b/c')), os.path.join(tdir, 'a/b/c'))
+      os.rmdir(os.path.join(tdir, 'a/b/c'))
+      with self.assertRaises(OSError):
+        fso.deref(os.path.join(tdir, 'a/b/c'))
+      self.assertEqual(
+        fso.deref(os.path.join(tdir, 'a/b')), os.path.join(tdir, 'a/b'))
+    os.rmdir(os.path.join(tdir, 'a/b/c'))
+    os.rmdir(os.path.join(tdir, 'a/b'))
+    os.rmdir(os.path.join(tdir, 'a'))
+    os.rmdir(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_snapshot(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.snapshot.')
+    os.makedirs(os.path.join(tdir, 'a/b'))
+    with open(os.path.join(tdir, 'a/b/file'), 'wb') as fp:
+      fp.write('data')
+    calls = []
+    def count(fso):
+      for symbol in ('os:stat', 'os:lstat', 'os:listdir'):
+        def wrapper(path, _symbol=symbol, _func=fso.originals[symbol]):
+          calls.append(_symbol)
+          return _func(path)
+        fso.originals[symbol] = wrapper
+    with FileSystemOverlay(snapshot=True) as fso:
+      count(fso)
+      self.assertTrue(os.path.exists(os.path.join(tdir, 'a/b/file')))
+      self.assertFalse(os.path.exists(os.path.join(tdir, 'a/b/nofile')))
+      self.assertEqual(os.listdir(os.path.join(tdir, 'a/b')), ['file'])
+      with self.assertRaises(OSError):
+        os.stat(os.path.join(tdir, 'a/b/nofile'))
+      self.assertNotEqual(calls, [])
+      del calls[:]
+      fso._resetcaches()
+      for idx in range(3):
+        self.assertTrue(os.path.exists(os.path.join(tdir, 'a/b/file')))
+        self.assertFalse(os.path.exists(os.path.join(tdir, 'a/b/nofile')))
+        self.assertEqual(os.listdir(os.path.join(tdir, 'a/b')), ['file'])
+        with self.assertRaises(OSError):
+          os.stat(os.path.join(tdir, 'a/b/nofile'))
+      self.assertEqual(calls, [])
+      os.unlink(os.path.join(tdir, 'a/b/file'))
+      self.assertEqual(os.listdir(os.path.join(tdir, 'a/b')), [])
+    with FileSystemOverlay(snapshot=2) as fso:
+      count(fso)
+      for name in ('a', 'a/b', 'a/b/file', 'a/b/nofile', 'a', 'a/b'):
+        os.path.exists(os.path.join(tdir, name))
+      self.assertEqual(len(fso._snapshot), 2)
+    os.unlink(os.path.join(tdir, 'a/b/file'))
+    os.rmdir(os.path.join(tdir, 'a/b'))
+    os.rmdir(os.path.join(tdir, 'a'))
+    os.rmdir(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_appendToReal_reference(self):
+    fname = tempfile.mktemp(prefix='fso-test_filesystemoverlay-unittest.appendref.')
+    with open(fname, 'wb') as fp:
+      fp.write('line 1\nline 2\n')
+    with FileSystemOverlay() as fso:
+      opened = []
+      def xopen(path, mode='r', buffering=-1, _open=fso.originals['__builtin__:open']):
+        opened.append(path)
+        return _open(path, mode, buffering)
+      fso.originals['__builtin__:open'] = xopen
+      with open(fname, 'ab') as fp:
+        fp.write('line 3\n')
+      with open(fname, 'ab') as fp:
+        fp.write('line 4\n')
+      self.assertEqual(opened, [])
+      self.assertEqual(os.stat(fname).st_size, 28)
+      self.assertEqual(fso.changes, ['mod:' + fname])
+      self.assertEqual(len(fso.entries[fname].data.extents), 2)
+      self.assertEqual(fso.entries[fname].data.extents[0][0].path, fname)
+      with open(fname, 'rb') as fp:
+        self.assertEqual(fp.readline(), 'line 1\n')
+        self.assertEqual(list(fp), ['line 2\n', 'line 3\n', 'line 4\n'])
+      self.assertEqual(opened, [fname])
+    with open(fname, 'rb') as fp:
+      self.assertEqual(fp.read(), 'line 1\nline 2\n')
+    os.unlink(fname)
+
+  #----------------------------------------------------------------------------
+  def test_update_modes(self):
+    fname = tempfile.mktemp(prefix='fso-test_filesystemoverlay-unittest.update.')
+    with open(fname, 'wb') as fp:
+      fp.write('0123456789')
+    with FileSystemOverlay() as fso:
+      with open(fname, 'r+b') as fp:
+        fp.seek(4)
+        fp.write('ab')
+        self.assertEqual(fp.read(2), '67')
+        fp.seek(12)
+        fp.write('!')
+      self.assertEqual(open(fname, 'rb').read(), '0123ab6789\0\0!')
+      self.assertEqual(os.stat(fname).st_size, 13)
+      with open(fname, 'w+b') as fp:
+        fp.write('new')
+        fp.seek(0)
+        self.assertEqual(fp.read(), 'new')
+      self.assertEqual(open(fname, 'rb').read(), 'new')
+      with open(fname, 'a+b') as fp:
+        fp.write('er')
+        fp.seek(0)
+        self.assertEqual(fp.read(), 'newer')
+      with self.assertRaises(IOError):
+        open(fname + '.nosuchfile', 'r+b')
+      fd = os.open(fname, os.O_RDWR)
+      os.write(fd, 'N')
+      os.close(fd)
+      self.assertEqual(open(fname, 'rb').read(), 'Newer')
+      fd = os.open(fname, os.O_RDONLY)
+      self.assertEqual(os.read(fd, 3), 'New')
+      os.close(fd)
+      with self.assertRaises(OSError):
+        os.open(fname, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+      self.assertEqual(fso.changes, ['mod:' + fname])
+      with open(fname, 'r+b') as fp:
+        fp.read()
+      self.assertEqual(fso.changes, ['mod:' + fname])
+    self.assertEqual(open(fname, 'rb').read(), '0123456789')
+    os.unlink(fname)
+
+  #----------------------------------------------------------------------------
+  def test_membudget(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.membudget.')
+    with FileSystemOverlay(membudget=100) as fso:
+      for name in 'abc':
+        with open(os.path.join(tdir, name), 'wb') as fp:
+          fp.write(name * 60)
+      self.assertEqual(fso._memused, 60)
+      self.assertEqual(fso.entries[os.path.join(tdir, 'a')].data.membytes, 60)
+      self.assertEqual(fso.entries[os.path.join(tdir, 'b')].data.membytes, 0)
+      self.assertEqual(fso.entries[os.path.join(tdir, 'c')].data.membytes, 0)
+      os.unlink(os.path.join(tdir, 'a'))
+      self.assertEqual(fso._memused, 0)
+      with open(os.path.join(tdir, 'a'), 'wb') as fp:
+        fp.write('a' * 60)
+      fso.membudget = 50
+      fso._enforcebudget()
+      self.assertEqual(fso._memused, 0)
+      self.assertEqual(fso.entries[os.path.join(tdir, 'a')].data.membytes, 0)
+      for name in 'abc':
+        with open(os.path.join(tdir, name), 'rb') as fp:
+          self.assertEqual(fp.read(), name * 60)
+      fp = open(os.path.join(tdir, 'big'), 'wb')
+      fp.pending_size = 64
+      for idx in range(100):
+        fp.write('%04d' % (idx,))
+      self.assertLess(fp.getcontent().membytes, 64)
+      fp.close()
+      self.assertEqual(os.path.getsize(os.path.join(tdir, 'big')), 400)
+      self.assertEqual(
+        open(os.path.join(tdir, 'big'), 'rb').read(),
+        ''.join('%04d' % (idx,) for idx in range(100)))
+      self.assertLessEqual(fso._memused, 100)
+      self.assertEqual(sorted(os.listdir(tdir)), ['a', 'b', 'big', 'c'])
+    self.assertEqual(os.listdir(tdir), [])
+    os.rmdir(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_open_shares_content(self):
+    fname = tempfile.mktemp(prefix='fso-test_filesystemoverlay-unittest.shared.')
+    data = os.urandom(1 << 16)
+    with FileSystemOverlay() as fso:
+      with open(fname, 'wb') as fp:
+        fp.write(data)
+      for idx in range(100):
+        with open(fname, 'rb') as fp:
+          self.assertIs(fp.content, fso.entries[fname].data)
+          self.assertEqual(fp.read(), data)
+      buf = bytearray(16)
+      with open(fname, 'rb') as fp:
+        fp.seek(100)
+        self.assertEqual(fp.readinto(buf), 16)
+      self.assertEqual(bytes(buf), data[100:116])
+
+  #----------------------------------------------------------------------------
+  def test_fd_operations(self):
+    import fcntl
+    fname = tempfile.mktemp(prefix='fso-test_filesystemoverlay-unittest.fd.')
+    with FileSystemOverlay() as fso:
+      fd = os.open(fname, os.O_RDWR | os.O_CREAT)
+      self.assertIn(fd, fso.fds)
+      # the descriptor is real, so non-overlayed calls still work
+      self.assertEqual(fcntl.fcntl(fd, fcntl.F_GETFD) & ~fcntl.FD_CLOEXEC, 0)
+      self.assertEqual(os.write(fd, b'abcdefghij'), 10)
+      self.assertEqual(os.fstat(fd).st_size, 10)
+      self.assertEqual(os.lseek(fd, 2, os.SEEK_SET), 2)
+      self.assertEqual(os.read(fd, 3), b'cde')
+      fd2 = os.dup(fd)
+      self.assertNotEqual(fd2, fd)
+      self.assertEqual(os.read(fd2, 2), b'fg')
+      os.ftruncate(fd, 4)
+      self.assertEqual(os.fstat(fd2).st_size, 4)
+      expect = b'abcd'
+      if hasattr(os, 'pread'):
+        expect = b'aXYd'
+        self.assertEqual(os.pwrite(fd, b'XY', 1), 2)
+        self.assertEqual(os.pread(fd, 10, 0), expect)
+        self.assertEqual(os.lseek(fd, 0, os.SEEK_CUR), 7)
+      os.close(fd)
+      self.assertNotIn(fd, fso.fds)
+      self.assertIn(fd2, fso.fds)
+      os.close(fd2)
+      self.assertEqual(len(fso.fds), 0)
+      fd = os.open(fname, os.O_RDONLY)
+      with os.fdopen(fd, 'rb') as fp:
+        self.assertEqual(fp.read(), expect)
+      self.assertNotIn(fd, fso.fds)
+      self.assertRaises(OSError, os.fstat, fd)
+    self.assertFalse(os.path.exists(fname))
+
+  #----------------------------------------------------------------------------
+  def test_iterchanges(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.iterchanges.')
+    with FileSystemOverlay() as fso:
+      for name in ('a', 'a-b', 'a/z', 'a/b', 'a0', 'b'):
+        os.mkdir(os.path.join(tdir, name))
+      self.assertEqual(fso.changes, [
+        'add:' + os.path.join(tdir, name)
+        for name in ('a', 'a-b', 'a/b', 'a/z', 'a0', 'b')])
+      self.assertEqual(fso.get_changes(os.path.join(tdir, 'a')), [
+        'add:', 'add:b', 'add:z'])
+      self.assertEqual(fso.get_changes(os.path.join(tdir, 'a'), relative=False), [
+        'add:' + os.path.join(tdir, 'a'),
+        'add:' + os.path.join(tdir, 'a/b'),
+        'add:' + os.path.join(tdir, 'a/z'),
+      ])
+      # the overlay can be modified while iterating
+      found = []
+      for change in fso.iterchanges(os.path.join(tdir, 'a')):
+        found.append(change)
+        if change == 'add:b':
+          os.rmdir(os.path.join(tdir, 'a/z'))
+          os.mkdir(os.path.join(tdir, 'a/c'))
+      self.assertEqual(found, ['add:', 'add:b', 'add:c'])
+      self.assertEqual(len(list(fso.iterchanges())), 6)
+    os.rmdir(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_diff(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.diff.')
+    big = ''.join('line %d\n' % (idx,) for idx in range(10000))
+    with open(os.path.join(tdir, 'big'), 'wb') as fp:
+      fp.write(big)
+    with open(os.path.join(tdir, 'gone'), 'wb') as fp:
+      fp.write('bye\n')
+    with FileSystemOverlay() as fso:
+      with open(os.path.join(tdir, 'big'), 'r+b') as fp:
+        fp.seek(big.index('line 5000\n'))
+        fp.write('LINE')
+      os.unlink(os.path.join(tdir, 'gone'))
+      os.mkdir(os.path.join(tdir, 'sub'))
+      with open(os.path.join(tdir, 'sub/new'), 'wb') as fp:
+        fp.write('hello\n')
+      diff = fso.diff(tdir)
+      self.assertEqual(next(diff), '--- big\n')
+      self.assertEqual(list(diff), [
+        '+++ big\n',
+        '@@ -4998,7 +4998,7 @@\n',
+        ' line 4997\n',
+        ' line 4998\n',
+        ' line 4999\n',
+        '-line 5000\n',
+        '+LINE 5000\n',
+        ' line 5001\n',
+        ' line 5002\n',
+        ' line 5003\n',
+        '--- gone\n',
+        '+++ /dev/null\n',
+        '@@ -1 +0,0 @@\n',
+        '-bye\n',
+        '--- /dev/null\n',
+        '+++ sub/new\n',
+        '@@ -0,0 +1 @@\n',
+        '+hello\n',
+      ])
+    os.unlink(os.path.join(tdir, 'big'))
+    os.unlink(os.path.join(tdir, 'gone'))
+    os.rmdir(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_checkpoint(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.checkpoint.')
+    with open(os.path.join(tdir, 'real'), 'wb') as fp:
+      fp.write('real')
+    with FileSystemOverlay() as fso:
+      fso.apply({os.path.join(tdir, 'f%d' % (idx,)): 'data' for idx in range(100)})
+      base    = fso.checkpoint()
+      changes = fso.changes
+      for count in range(3):
+        os.unlink(os.path.join(tdir, 'real'))
+        os.unlink(os.path.join(tdir, 'f1'))
+        with open(os.path.join(tdir, 'f2'), 'ab') as fp:
+          fp.write('more')
+        os.makedirs(os.path.join(tdir, 'x/y'))
+        self.assertEqual(os.listdir(os.path.join(tdir, 'x')), ['y'])
+        self.assertEqual(len(fso._journal), 5)
+        fso.rollback(base)
+        self.assertEqual(fso.changes, changes)
+        self.assertTrue(os.path.exists(os.path.join(tdir, 'real')))
+        self.assertFalse(os.path.exists(os.path.join(tdir, 'x')))
+        with open(os.path.join(tdir, 'f2'), 'rb') as fp:
+          self.assertEqual(fp.read(), 'data')
+      os.unlink(os.path.join(tdir, 'f3'))
+      nested = fso.checkpoint()
+      os.unlink(os.path.join(tdir, 'f4'))
+      fso.rollback(nested)
+      self.assertFalse(os.path.exists(os.path.join(tdir, 'f3')))
+      self.assertTrue(os.path.exists(os.path.join(tdir, 'f4')))
+      fso.rollback(base)
+      self.assertTrue(os.path.exists(os.path.join(tdir, 'f3')))
+      self.assertRaises(ValueError, fso.rollback, nested)
+      # a checkpoint taken after the restored one stays invalid even
+      # once the journal has grown past its position again
+      os.unlink(os.path.join(tdir, 'f5'))
+      os.unlink(os.path.join(tdir, 'f6'))
+      self.assertRaises(ValueError, fso.rollback, nested)
+      self.assertTrue(os.path.exists(os.path.join(tdir, 'f3')))
+      fso.rollback(base)
+      self.assertTrue(os.path.exists(os.path.join(tdir, 'f5')))
+      fso.release()
+      self.assertRaises(ValueError, fso.rollback, base)
+    os.unlink(os.path.join(tdir, 'real'))
+    os.rmdir(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_concurrency_stress(self):
+    import threading
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.stress.')
+    nthreads, nfiles = 8, 50
+    errors  = []
+    created = []
+    def worker(num):
+      try:
+        mine = os.path.join(tdir, 'w%d' % (num,))
+        os.mkdir(mine)
+        for idx in range(nfiles):
+          with open(os.path.join(mine, 'f%d' % (idx,)), 'wb') as fp:
+            fp.write('%d:%d' % (num, idx))
+          # all threads race to create the same shared directories
+          # and files, which must each succeed exactly once
+          try:
+            os.mkdir(os.path.join(tdir, 'shared%d' % (idx,)))
+            created.append('shared%d' % (idx,))
+          except OSError as err:
+            self.assertEqual(err.errno, errno.EEXIST)
+          try:
+            fd = os.open(os.path.join(tdir, 'excl%d' % (idx,)),
+                         os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            os.close(fd)
+            created.append('excl%d' % (idx,))
+          except OSError as err:
+            self.assertEqual(err.errno, errno.EEXIST)
+          # overlapping makedirs() must tolerate the shared ancestors
+          # being created concurrently
+          os.makedirs(os.path.join(tdir, 'deep%d' % (idx,), 'a', 'b', 'w%d' % (num,)))
+        for idx in range(0, nfiles, 2):
+          os.unlink(os.path.join(mine, 'f%d' % (idx,)))
+      except Exception as err:
+        errors.append(err)
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    try:
+      with FileSystemOverlay() as fso:
+        threads = [threading.Thread(target=worker, args=(num,))
+                   for num in range(nthreads)]
+        for thread in threads:
+          thread.start()
+        for thread in threads:
+          thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(created), 2 * nfiles)
+        self.assertEqual(len(set(created)), 2 * nfiles)
+        self.assertEqual(len(os.listdir(tdir)), nthreads + 3 * nfiles)
+        for idx in range(nfiles):
+          self.assertEqual(
+            sorted(os.listdir(os.path.join(tdir, 'deep%d' % (idx,), 'a', 'b'))),
+            sorted('w%d' % (num,) for num in range(nthreads)))
+        for num in range(nthreads):
+          mine = os.path.join(tdir, 'w%d' % (num,))
+          self.assertEqual(
+            sorted(os.listdir(mine)),
+            sorted('f%d' % (idx,) for idx in range(1, nfiles, 2)))
+          with open(os.path.join(mine, 'f1'), 'rb') as fp:
+            self.assertEqual(fp.read(), '%d:1' % (num,))
+        self.assertEqual(fso._paths, sorted(fso.entries.keys()))
+        self.assertEqual(fso.changes, [
+          fso.entries[path].change for path in fso._paths])
+    finally:
+      sys.setcheckinterval(interval)
+    os.rmdir(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_passthru_lookups(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.passthru_lookups.')
+    keep = os.path.join(tdir, 'keep')
+    os.mkdir(keep)
+    with FileSystemOverlay(passthru=re.escape(keep) + '(/.*)?$') as fso:
+      os.mkdir(os.path.join(tdir, 'drop'))
+      with open(os.path.join(keep, 'file'), 'wb') as fp:
+        fp.write('kept')
+      self.assertEqual(fso.changes, ['add:' + os.path.join(tdir, 'drop')])
+      # passthru paths are not even dereferenced
+      fso.deref = None
+      self.assertTrue(os.path.exists(os.path.join(keep, 'file')))
+      self.assertTrue(os.path.lexists(os.path.join(keep, 'file')))
+      self.assertTrue(os.access(os.path.join(keep, 'file'), os.R_OK))
+      self.assertEqual(os.listdir(keep), ['file'])
+      self.assertEqual(os.stat(os.path.join(keep, 'file')).st_size, 4)
+      with open(os.path.join(keep, 'file'), 'rb') as fp:
+        self.assertEqual(fp.read(), 'kept')
+      del fso.deref
+    self.assertEqual(os.listdir(tdir), ['keep'])
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_passthru_symlink(self):
+    tdir  = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.passthru_symlink.')
+    keep  = os.path.join(tdir, 'keep')
+    alias = os.path.join(tdir, 'alias')
+    os.mkdir(keep)
+    with FileSystemOverlay(
+        passthru=re.escape(keep) + '(/.*)?$', snapshot=True) as fso:
+      os.symlink(keep, alias)
+      fname = os.path.join(alias, 'ext')
+      self.assertFalse(os.path.exists(fname))
+      self.assertFalse(os.path.lexists(fname))
+      # a change made outside of the overlay (e.g. by another process)
+      # is seen through the symlink by all operations alike, i.e. none
+      # of them uses the overlay's snapshot
+      with fso.originals['__builtin__:open'](os.path.join(keep, 'ext'), 'wb') as fp:
+        fp.write('ext')
+      self.assertTrue(os.path.exists(fname))
+      self.assertTrue(os.path.lexists(fname))
+      self.assertTrue(os.access(fname, os.R_OK))
+      self.assertEqual(os.stat(fname).st_size, 3)
+      self.assertEqual(os.lstat(fname).st_size, 3)
+      with open(fname, 'rb') as fp:
+        self.assertEqual(fp.read(), 'ext')
+      self.assertEqual(fso.changes, ['add:' + alias])
+    self.assertEqual(os.listdir(tdir), ['keep'])
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_scandir_walk(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.walk.')
+    os.makedirs(os.path.join(tdir, 'a/b'))
+    for name in ('a/f1', 'a/f2', 'a/b/f3'):
+      with open(os.path.join(tdir, name), 'wb') as fp:
+        fp.write(name)
+    with FileSystemOverlay() as fso:
+      os.unlink(os.path.join(tdir, 'a/f1'))
+      os.makedirs(os.path.join(tdir, 'a/c/d'))
+      with open(os.path.join(tdir, 'a/c/f4'), 'wb') as fp:
+        fp.write('f4')
+      with open(os.path.join(tdir, 'a/f2'), 'ab') as fp:
+        fp.write('+')
+      os.symlink('c', os.path.join(tdir, 'a/link'))
+      entries = {entry.name: entry
+                 for entry in fso.fso_scandir(os.path.join(tdir, 'a'))}
+      self.assertEqual(sorted(entries.keys()), ['b', 'c', 'f2', 'link'])
+      self.assertTrue(entries['b'].is_dir())
+      self.assertTrue(entries['c'].is_dir())
+      self.assertTrue(entries['f2'].is_file())
+      self.assertEqual(entries['f2'].stat().st_size, len('a/f2+'))
+      self.assertTrue(entries['link'].is_symlink())
+      self.assertTrue(entries['link'].is_dir())
+      self.assertFalse(entries['link'].is_dir(follow_symlinks=False))
+      self.assertEqual(entries['c'].path, os.path.join(tdir, 'a', 'c'))
+      def walk(**kw):
+        return [(path[len(tdir):], sorted(dirs), sorted(files))
+                for path, dirs, files in os.walk(tdir, **kw)]
+      self.assertEqual(sorted(walk()), [
+        ('',     ['a'],                 []),
+        ('/a',   ['b', 'c', 'link'],    ['f2']),
+        ('/a/b', [],                    ['f3']),
+        ('/a/c', ['d'],                 ['f4']),
+        ('/a/c/d', [],                  []),
+      ])
+      self.assertEqual(len(walk(followlinks=True)), 7)
+      self.assertEqual(walk(topdown=False)[-1][0], '')
+      # pruning in topdown mode
+      for path, dirs, files in os.walk(tdir):
+        self.assertNotEqual(path, os.path.join(tdir, 'a/c'))
+        if 'c' in dirs:
+          dirs.remove('c')
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_walk_indirect(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.walkind.')
+    os.makedirs(os.path.join(tdir, 'R/sub/deep'))
+    for name in ('R/f', 'R/sub/g'):
+      with open(os.path.join(tdir, name), 'wb') as fp:
+        fp.write(name)
+    expected = [
+      ('',          ['sub'],  ['f']),
+      ('/sub',      ['deep'], ['g']),
+      ('/sub/deep', [],       []),
+    ]
+    def walk(top):
+      return sorted((path[len(top):], sorted(dirs), sorted(files))
+                    for path, dirs, files in os.walk(top))
+    cwd = os.getcwd()
+    with FileSystemOverlay():
+      # through an overlay-only symlink
+      link = os.path.join(tdir, 'L')
+      os.symlink('R', link)
+      self.assertEqual(walk(link), expected)
+      self.assertEqual(
+        sorted(glob.glob(os.path.join(link, '*', '*'))),
+        [os.path.join(link, 'sub', 'deep'), os.path.join(link, 'sub', 'g')])
+      # through a renamed directory, with a relative top
+      os.rename(os.path.join(tdir, 'R'), os.path.join(tdir, 'N'))
+      os.chdir(tdir)
+      try:
+        self.assertEqual(walk('N'), expected)
+      finally:
+        os.chdir(cwd)
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_glob(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.glob.')
+    os.makedirs(os.path.join(tdir, 'a/b'))
+    for name in ('a/f1.txt', 'a/f2.py', 'a/b/f3.txt', 'a/.hidden.txt'):
+      with open(os.path.join(tdir, name), 'wb') as fp:
+        fp.write(name)
+    def rel(paths):
+      return sorted(path[len(tdir) + 1:] for path in paths)
+    with FileSystemOverlay() as fso:
+      os.unlink(os.path.join(tdir, 'a/f1.txt'))
+      os.makedirs(os.path.join(tdir, 'a/c'))
+      with open(os.path.join(tdir, 'a/c/f4.txt'), 'wb') as fp:
+        fp.write('f4')
+      self.assertEqual(rel(glob.glob(os.path.join(tdir, 'a/*.txt'))), [])
+      self.assertEqual(
+        rel(glob.glob(os.path.join(tdir, 'a/*/*.txt'))),
+        ['a/b/f3.txt', 'a/c/f4.txt'])
+      self.assertEqual(
+        rel(glob.iglob(os.path.join(tdir, 'a/.*'))), ['a/.hidden.txt'])
+      self.assertEqual(
+        rel(glob.glob(os.path.join(tdir, 'a/[bc]/'))), ['a/b/', 'a/c/'])
+      self.assertEqual(
+        rel(glob.glob(os.path.join(tdir, 'a/c/f4.txt'))), ['a/c/f4.txt'])
+      self.assertEqual(glob.glob(os.path.join(tdir, 'a/f1.txt')), [])
+      self.assertEqual(glob.glob(os.path.join(tdir, 'nope/*')), [])
+      self.assertEqual(
+        rel(fso.fso_glob(os.path.join(tdir, '**/*.txt'), recursive=True)),
+        ['a/b/f3.txt', 'a/c/f4.txt'])
+      self.assertEqual(
+        rel(fso.fso_glob(os.path.join(tdir, 'a/**'), recursive=True)),
+        ['a/', 'a/b', 'a/b/f3.txt', 'a/c', 'a/c/f4.txt', 'a/f2.py'])
+      # relative patterns produce relative paths
+      cwd = os.getcwd()
+      os.chdir(os.path.join(tdir, 'a'))
+      try:
+        self.assertEqual(sorted(glob.glob('*/f*')), ['b/f3.txt', 'c/f4.txt'])
+        self.assertEqual(
+          sorted(fso.fso_glob('**', recursive=True)),
+          ['b', 'b/f3.txt', 'c', 'c/f4.txt', 'f2.py'])
+      finally:
+        os.chdir(cwd)
+      # lazy
+      self.assertIsNotNone(next(glob.iglob(os.path.join(tdir, '*'))))
+    self.assertEqual(
+      rel(glob.glob(os.path.join(tdir, 'a/*.txt'))), ['a/f1.txt'])
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_copy_move(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.copy.')
+    os.makedirs(os.path.join(tdir, 'src/sub'))
+    for name in ('src/f1', 'src/sub/f2'):
+      with open(os.path.join(tdir, name), 'wb') as fp:
+        fp.write(name)
+    os.symlink('f1', os.path.join(tdir, 'src/link'))
+    def path(name):
+      return os.path.join(tdir, name)
+    def read(name):
+      with open(path(name), 'rb') as fp:
+        return fp.read()
+    with FileSystemOverlay() as fso:
+      # copies of real files only reference the original
+      self.assertEqual(shutil.copyfile(path('src/f1'), path('c1')), path('c1'))
+      self.assertEqual(read('c1'), 'src/f1')
+      self.assertEqual(
+        [type(ext[0]).__name__ for ext in fso.entries[path('c1')].data.extents],
+        ['FileSource'])
+      # copies of overlay files share the content
+      shutil.copy(path('c1'), path('src/sub'))
+      self.assertIs(
+        fso.entries[path('src/sub/c1')].data, fso.entries[path('c1')].data)
+      with self.assertRaises(shutil.Error):
+        shutil.copyfile(path('c1'), path('c1'))
+      with self.assertRaises(IOError):
+        shutil.copyfile(path('nope'), path('c2'))
+      with self.assertRaises(IOError):
+        shutil.copyfile(path('c1'), path('nope/c2'))
+      shutil.copytree(path('src'), path('dst'), symlinks=True)
+      self.assertEqual(sorted(os.listdir(path('dst'))), ['f1', 'link', 'sub'])
+      self.assertEqual(os.readlink(path('dst/link')), 'f1')
+      self.assertEqual(read('dst/sub/f2'), 'src/sub/f2')
+      self.assertEqual(read('dst/sub/c1'), 'src/f1')
+      shutil.copytree(path('src'), path('dst2'))
+      self.assertFalse(os.path.islink(path('dst2/link')))
+      self.assertEqual(read('dst2/link'), 'src/f1')
+      with self.assertRaises(OSError):
+        shutil.copytree(path('src'), path('dst'))
+      # modifying a copy does not affect the source
+      with open(path('dst/f1'), 'ab') as fp:
+        fp.write('+')
+      self.assertEqual(read('dst/f1'), 'src/f1+')
+      self.assertEqual(read('src/f1'), 'src/f1')
+      # move
+      os.makedirs(path('moved'))
+      self.assertEqual(
+        shutil.move(path('dst'), path('moved')), path('moved/dst'))
+      self.assertFalse(os.path.exists(path('dst')))
+      self.assertEqual(read('moved/dst/f1'), 'src/f1+')
+      self.assertEqual(os.readlink(path('moved/dst/link')), 'f1')
+      shutil.move(path('c1'), path('c3'))
+      self.assertFalse(os.path.exists(path('c1')))
+      self.assertEqual(read('c3'), 'src/f1')
+      with self.assertRaises(shutil.Error):
+        shutil.move(path('moved'), path('moved/dst'))
+      # as natively, a directory can be moved into a missing parent
+      # (which is created by the copy), but a file cannot
+      shutil.move(path('dst2'), path('missing/deeper/dst2'))
+      self.assertFalse(os.path.exists(path('dst2')))
+      self.assertEqual(read('missing/deeper/dst2/sub/f2'), 'src/sub/f2')
+      with self.assertRaises(IOError):
+        shutil.move(path('c3'), path('absent/c3'))
+      self.assertEqual(read('c3'), 'src/f1')
+      changes = fso.get_changes(root=tdir)
+      self.assertIn('add:c3', changes)
+      self.assertNotIn('add:c1', changes)
+    self.assertEqual(os.listdir(tdir), ['src'])
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_rename(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.rename.')
+    def path(name):
+      return os.path.join(tdir, name)
+    def read(name):
+      with open(path(name), 'rb') as fp:
+        return fp.read()
+    for name in ('src/sub', 'empty', 'full', 'gone'):
+      os.makedirs(path(name))
+    for name in ('src/f1', 'src/sub/f2', 'full/f3', 'gone/f1', 'file'):
+      with open(path(name), 'wb') as fp:
+        fp.write(name)
+    with FileSystemOverlay() as fso:
+      # the "atomic write" pattern
+      with open(path('tmp'), 'wb') as fp:
+        fp.write('data')
+      os.rename(path('tmp'), path('file'))
+      self.assertEqual(read('file'), 'data')
+      self.assertFalse(os.path.exists(path('tmp')))
+      self.assertEqual(fso.get_changes(root=tdir), ['mod:file'])
+      # renaming an original directory
+      with open(path('src/f1'), 'ab') as fp:
+        fp.write('+')
+      token = fso.checkpoint()
+      os.rename(path('src'), path('dst'))
+      self.assertFalse(os.path.exists(path('src')))
+      self.assertEqual(sorted(os.listdir(path('dst'))), ['f1', 'sub'])
+      self.assertEqual(read('dst/f1'), 'src/f1+')
+      self.assertEqual(read('dst/sub/f2'), 'src/sub/f2')
+      self.assertEqual(
+        fso.get_changes(root=tdir),
+        ['add:dst', 'mod:dst/f1', 'mod:file', 'del:src'])
+      with open(path('dst/sub/f2'), 'ab') as fp:
+        fp.write('+')
+      self.assertEqual(read('dst/sub/f2'), 'src/sub/f2+')
+      os.rename(path('dst/sub'), path('sub'))
+      self.assertEqual(read('sub/f2'), 'src/sub/f2+')
+      self.assertEqual(os.listdir(path('dst')), ['f1'])
+      os.rename(path('dst'), path('empty'))
+      self.assertEqual(os.listdir(path('empty')), ['f1'])
+      with self.assertRaises(OSError) as cm:
+        os.rename(path('empty'), path('full'))
+      self.assertEqual(cm.exception.errno, errno.ENOTEMPTY)
+      with self.assertRaises(OSError) as cm:
+        os.rename(path('empty'), path('file'))
+      self.assertEqual(cm.exception.errno, errno.ENOTDIR)
+      with self.assertRaises(OSError) as cm:
+        os.rename(path('file'), path('full'))
+      self.assertEqual(cm.exception.errno, errno.EISDIR)
+      with self.assertRaises(OSError) as cm:
+        os.rename(path('empty'), path('empty/inner'))
+      self.assertEqual(cm.exception.errno, errno.EINVAL)
+      with self.assertRaises(OSError) as cm:
+        os.rename(path('nope'), path('nope2'))
+      self.assertEqual(cm.exception.errno, errno.ENOENT)
+      # replacing a removed directory does not expose its children
+      shutil.rmtree(path('gone'))
+      os.rename(path('sub'), path('gone'))
+      self.assertEqual(os.listdir(path('gone')), ['f2'])
+      os.mkdir(path('new'))
+      os.rename(path('gone'), path('new/gone'))
+      self.assertEqual(read('new/gone/f2'), 'src/sub/f2+')
+      fso.fso_replace(path('full/f3'), path('new/f3'))
+      self.assertEqual(read('new/f3'), 'full/f3')
+      self.assertEqual(os.listdir(path('full')), [])
+      # images retain renamed directories
+      image = fso.freeze()
+      with FileSystemOverlay(install=False, base=image) as fso2:
+        self.assertEqual(read('empty/f1'), 'src/f1+')
+        self.assertEqual(sorted(os.listdir(path('new'))), ['f3', 'gone'])
+      # rollback
+      fso.rollback(token)
+      self.assertEqual(sorted(os.listdir(path('src'))), ['f1', 'sub'])
+      self.assertEqual(read('src/sub/f2'), 'src/sub/f2')
+      self.assertFalse(os.path.exists(path('empty/f1')))
+      self.assertEqual(read('gone/f1'), 'gone/f1')
+    self.assertEqual(
+      sorted(os.listdir(tdir)), ['empty', 'file', 'full', 'gone', 'src'])
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_rename_overlay_tree(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.rename_tree.')
+    with FileSystemOverlay() as fso:
+      src = os.path.join(tdir, 'src')
+      for idx in range(10):
+        os.makedirs(os.path.join(src, 'd%d' % (idx,)))
+      fso.apply({os.path.join(src, 'd%d/f%d' % (idx % 10, idx)): 'data'
+                 for idx in range(200)})
+      changes = fso.get_changes(root=src)
+      token   = fso.checkpoint()
+      touched = []
+      def track(name):
+        orig = getattr(fso, name)
+        def wrapper(arg):
+          touched.append(arg)
+          return orig(arg)
+        setattr(fso, name, wrapper)
+      for name in ('_setentry', '_putentry', '_popentry', '_lower_lstat'):
+        track(name)
+      os.rename(src, os.path.join(tdir, 'dst'))
+      # only the renamed directory itself is touched, not its content
+      self.assertLess(len(touched), 10)
+      for name in ('_setentry', '_putentry', '_popentry', '_lower_lstat'):
+        delattr(fso, name)
+      self.assertEqual(os.listdir(tdir), ['dst'])
+      self.assertEqual(len(os.listdir(os.path.join(tdir, 'dst'))), 10)
+      self.assertEqual(len(os.listdir(os.path.join(tdir, 'dst/d3'))), 20)
+      with open(os.path.join(tdir, 'dst/d3/f13'), 'rb') as fp:
+        self.assertEqual(fp.read(), 'data')
+      self.assertEqual(fso.get_changes(root=os.path.join(tdir, 'dst')), changes)
+      fso.rollback(token)
+      self.assertEqual(os.listdir(tdir), ['src'])
+      self.assertEqual(fso.get_changes(root=src), changes)
+    os.rmdir(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_hermetic(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.hermetic.')
+    def path(name):
+      return os.path.join(tdir, name)
+    for name in ('keep', 'other'):
+      os.makedirs(path(name))
+      with open(path(name + '/file'), 'wb') as fp:
+        fp.write(name)
+    with FileSystemOverlay(hermetic=True) as fso:
+      self.assertEqual(os.listdir('/'), [])
+      self.assertFalse(os.path.exists(tdir))
+      self.assertFalse(os.path.exists(__file__))
+      with self.assertRaises(IOError):
+        open(path('keep/file'), 'rb')
+      os.makedirs(path('new'))
+      with open(path('new/file'), 'wb') as fp:
+        fp.write('new')
+      self.assertEqual(os.listdir(tdir), ['new'])
+      with open(path('new/file'), 'rb') as fp:
+        self.assertEqual(fp.read(), 'new')
+    with FileSystemOverlay(hermetic=[path('keep')]) as fso:
+      top = tdir.split(os.sep)[1]
+      self.assertEqual(os.listdir('/'), [top])
+      self.assertEqual(os.listdir(tdir), ['keep'])
+      self.assertTrue(os.path.isdir(tdir))
+      self.assertFalse(os.path.exists(path('other/file')))
+      with open(path('keep/file'), 'rb') as fp:
+        self.assertEqual(fp.read(), 'keep')
+      with open(path('keep/file'), 'ab') as fp:
+        fp.write('+')
+      with open(path('keep/file'), 'rb') as fp:
+        self.assertEqual(fp.read(), 'keep+')
+      self.assertEqual(os.listdir(path('keep')), ['file'])
+      self.assertEqual(fso.get_changes(root=tdir), ['mod:keep/file'])
+    with open(path('keep/file'), 'rb') as fp:
+      self.assertEqual(fp.read(), 'keep')
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_export_commit(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.export.')
+    def path(name):
+      return os.path.join(tdir, name)
+    for name in ('keep', 'deldir', 'src/sub'):
+      os.makedirs(path(name))
+    for name in ('keep/f', 'mod.txt', 'del.txt', 'deldir/x', 'src/f1', 'src/sub/f2'):
+      with open(path(name), 'wb') as fp:
+        fp.write(name)
+    layer = path('layer')
+    with FileSystemOverlay() as fso:
+      with open(path('mod.txt'), 'ab') as fp:
+        fp.write('+')
+      os.unlink(path('del.txt'))
+      shutil.rmtree(path('deldir'))
+      os.makedirs(path('new'))
+      with open(path('new/file'), 'wb') as fp:
+        fp.write('new')
+      os.symlink('mod.txt', path('link'))
+      os.rename(path('src'), path('dst'))
+      with open(path('dst/f1'), 'ab') as fp:
+        fp.write('+')
+      expected = [
+        '.wh.del.txt', '.wh.deldir', '.wh.src', 'dst', 'dst/f1', 'dst/sub',
+        'dst/sub/f2', 'link', 'mod.txt', 'new', 'new/file']
+      # tarball
+      buf = six.BytesIO()
+      self.assertEqual(fso.export(buf, root=tdir), len(expected))
+      tar = tarfile.open(fileobj=six.BytesIO(buf.getvalue()))
+      self.assertEqual(sorted(tar.getnames()), expected)
+      self.assertEqual(tar.extractfile('dst/f1').read(), 'src/f1+')
+      self.assertEqual(tar.extractfile('dst/sub/f2').read(), 'src/sub/f2')
+      self.assertEqual(tar.getmember('link').linkname, 'mod.txt')
+      self.assertTrue(tar.getmember('dst').isdir())
+      # directory (which is written to the underlying filesystem)
+      fso.export(layer, root=tdir)
+      self.assertNotIn('add:layer', fso.get_changes(root=tdir))
+      # commit (note: the ancestors of `tdir` are reported too)
+      self.assertEqual(fso.commit(), len(expected) + len(tdir.split(os.sep)) - 1)
+      self.assertEqual(fso.changes, [])
+      self.assertEqual(os.readlink(path('link')), 'mod.txt')
+    def read(name):
+      with open(path(name), 'rb') as fp:
+        return fp.read()
+    self.assertEqual(
+      sorted(os.listdir(layer)),
+      ['.wh.del.txt', '.wh.deldir', '.wh.src', 'dst', 'link', 'mod.txt', 'new'])
+    self.assertEqual(read('layer/dst/sub/f2'), 'src/sub/f2')
+    self.assertEqual(read('layer/mod.txt'), 'mod.txt+')
+    shutil.rmtree(layer)
+    self.assertEqual(
+      sorted(os.listdir(tdir)), ['dst', 'keep', 'link', 'mod.txt', 'new'])
+    self.assertEqual(read('mod.txt'), 'mod.txt+')
+    self.assertEqual(read('link'), 'mod.txt+')
+    self.assertEqual(read('new/file'), 'new')
+    self.assertEqual(read('dst/f1'), 'src/f1+')
+    self.assertEqual(read('dst/sub/f2'), 'src/sub/f2')
+    self.assertEqual(read('keep/f'), 'keep/f')
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_commit_replaced_dir(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.replaced.')
+    def path(name):
+      return os.path.join(tdir, name)
+    os.makedirs(path('a/b'))
+    with open(path('a/f'), 'wb') as fp:
+      fp.write('a/f')
+    with FileSystemOverlay() as fso:
+      shutil.rmtree(path('a'))
+      with open(path('a'), 'wb') as fp:
+        fp.write('file')
+      buf = six.BytesIO()
+      self.assertEqual(fso.export(buf, root=tdir), 1)
+      tar = tarfile.open(fileobj=six.BytesIO(buf.getvalue()))
+      self.assertEqual(tar.getnames(), ['a'])
+      self.assertTrue(tar.getmember('a').isfile())
+      fso.commit()
+    self.assertTrue(os.path.isfile(path('a')))
+    with open(path('a'), 'rb') as fp:
+      self.assertEqual(fp.read(), 'file')
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_commit_file_parent(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.parent.')
+    fname = os.path.join(tdir, 'h')
+    with open(fname, 'wb') as fp:
+      fp.write('h')
+    with FileSystemOverlay() as fso:
+      os.mkdir(os.path.join(fname, 'sub'))
+      with self.assertRaises(OSError) as cm:
+        fso.commit()
+      self.assertEqual(cm.exception.errno, errno.ENOTDIR)
+    self.assertTrue(os.path.isfile(fname))
+    self.assertEqual(os.listdir(tdir), ['h'])
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_changes_cached(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.changes.')
+    with FileSystemOverlay() as fso:
+      os.mkdir(os.path.join(tdir, 'a'))
+      changes = fso.changes
+      # callers own the returned list
+      changes.append('add:/nope')
+      self.assertEqual(fso.changes, ['add:' + os.path.join(tdir, 'a')])
+      self.assertIsNot(fso.changes, fso.changes)
+      os.mkdir(os.path.join(tdir, 'b'))
+      self.assertEqual(fso.changes, [
+        'add:' + os.path.join(tdir, 'a'), 'add:' + os.path.join(tdir, 'b')])
+      # ... also when merging with an attached image's changes
+      with FileSystemOverlay(install=False, base=fso.freeze()) as fso2:
+        fso2.fso_mkdir(os.path.join(tdir, 'c'))
+        changes = fso2.changes
+        changes.pop()
+        self.assertEqual(fso2.get_changes(), [
+          'add:' + os.path.join(tdir, name) for name in 'abc'])
+        fso2.fso_rmdir(os.path.join(tdir, 'a'))
+        self.assertEqual(fso2.changes, [
+          'add:' + os.path.join(tdir, name) for name in 'bc'])
+    os.rmdir(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_passthru_mutators(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.passthru_mutators.')
+    keep = os.path.join(tdir, 'keep')
+    os.mkdir(keep)
+    with open(os.path.join(keep, 'file'), 'wb') as fp:
+      fp.write('kept')
+    with FileSystemOverlay(
+        passthru=re.escape(keep) + '(/.*)?$', snapshot=True) as fso:
+      self.assertEqual(os.listdir(keep), ['file'])
+      os.mkdir(os.path.join(keep, 'sub'))
+      os.makedirs(os.path.join(keep, 'deep/er'))
+      os.symlink('file', os.path.join(keep, 'link'))
+      os.unlink(os.path.join(keep, 'file'))
+      self.assertTrue(os.path.isdir(os.path.join(keep, 'sub')))
+      self.assertTrue(os.path.isdir(os.path.join(keep, 'deep/er')))
+      self.assertEqual(os.readlink(os.path.join(keep, 'link')), 'file')
+      self.assertFalse(os.path.exists(os.path.join(keep, 'file')))
+      self.assertFalse(os.path.exists(os.path.join(keep, 'link')))
+      self.assertEqual(sorted(os.listdir(keep)), ['deep', 'link', 'sub'])
+      os.rmdir(os.path.join(keep, 'sub'))
+      shutil.rmtree(os.path.join(keep, 'deep'))
+      self.assertEqual(os.listdir(keep), ['link'])
+      self.assertEqual(fso.changes, [])
+    self.assertEqual(os.listdir(keep), ['link'])
+    self.assertEqual(os.readlink(os.path.join(keep, 'link')), 'file')
+    shutil.rmtree(tdir)
+
+  #----------------------------------------------------------------------------
+  def test_commit_staging(self):
+    tdir = tempfile.mkdtemp(prefix='fso-test_filesystemoverlay-unittest.staging.')
+    def path(name):
+      return os.path.join(tdir, name)
+    def read(name):
+      with open(path(name), 'rb') as fp:
+        return fp.read()
+    for name in ('orig', 'mod'):
+      with open(path(name), 'wb') as fp:
+        fp.write(name)
+    # only content that refers to replaced files is staged, i.e. these
+    # changes are committed without a (usable) staging directory
+    with FileSystemOverlay() as fso:
+      fso.spill_dir = path('nostage')
+      with open(path('new'), 'wb') as fp:
+        fp.write('new')
+      shutil.copyfile(path('orig'), path('copy'))
+      with open(path('copy'), 'ab') as fp:
+        fp.write('+')
+      fso.commit()
+    self.assertEqual(sorted(os.listdir(tdir)), ['copy', 'mod', 'new', 'orig'])
+    self.assertEqual(read('copy'), 'orig+')
+    self.assertEqual(read('new'), 'new')
+    for name in ('mod', 'orig'):
+      with FileSystemOverlay() as fso:
+        fso.spill_dir = path('nostage')
+        if name == 'mod':
+          with open(path('mod'), 'ab') as fp:
+            fp.write('+')
+        else:
+          os.rename(path('orig'), path('moved'))
+        with self.assertRaises(OSError) as cm:
+          fso.commit()
+        self.assertEqual(cm.exception.errno, errno.ENOENT)
+        fso.spill_dir = None
+        fso.commit()
+    self.assertEqual(sorted(os.listdir(tdir)), ['copy', 'mod', 'moved', 'new'])
+    self.assertEqual(read('mod'), 'mod+')
+    self.assertEqual(read('moved'), 'orig')
+    shutil.rmtree(tdir)
+
+
 #------------------------------------------------------------------------------
 # end of $Id$
 # $ChangeLog$
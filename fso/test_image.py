@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import os
+import unittest
+import tempfile
+import pickle
+import stat
+import io
+import mmap
+
+from . import api
+from .filesystemoverlay import FileSystemOverlay
+from .image import OverlayImage, ImageSource
+
+#------------------------------------------------------------------------------
+class TestImage(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def setUp(self):
+    self.tdir = tempfile.mkdtemp(prefix='fso-test_image-unittest.')
+    with open(os.path.join(self.tdir, 'real'), 'wb') as fp:
+      fp.write('real')
+
+  #----------------------------------------------------------------------------
+  def tearDown(self):
+    os.unlink(os.path.join(self.tdir, 'real'))
+    os.rmdir(self.tdir)
+
+  #----------------------------------------------------------------------------
+  def makeImage(self):
+    with FileSystemOverlay() as fso:
+      os.makedirs(os.path.join(self.tdir, 'a/b'))
+      with open(os.path.join(self.tdir, 'a/b/file'), 'wb') as fp:
+        fp.write('fixture')
+      with open(os.path.join(self.tdir, 'real'), 'ab') as fp:
+        fp.write('+more')
+      os.symlink('b/file', os.path.join(self.tdir, 'a/link'))
+      with open(os.path.join(self.tdir, 'a/empty'), 'wb') as fp:
+        pass
+      changes = fso.changes
+      image   = fso.freeze()
+    return image, changes
+
+  #----------------------------------------------------------------------------
+  def test_freeze_attach(self):
+    image, changes = self.makeImage()
+    image = pickle.loads(pickle.dumps(image, pickle.HIGHEST_PROTOCOL))
+    self.assertEqual(len(image), len(changes))
+    for count in range(2):
+      with FileSystemOverlay(base=image) as fso:
+        self.assertEqual(fso.changes, changes)
+        self.assertEqual(
+          sorted(os.listdir(os.path.join(self.tdir, 'a'))), ['b', 'empty', 'link'])
+        with open(os.path.join(self.tdir, 'a/link'), 'rb') as fp:
+          self.assertEqual(fp.read(), 'fixture')
+        with open(os.path.join(self.tdir, 'real'), 'rb') as fp:
+          self.assertEqual(fp.read(), 'real+more')
+        with open(os.path.join(self.tdir, 'a/empty'), 'rb') as fp:
+          self.assertEqual(fp.read(), '')
+        # the contents are shared with the image, not copied
+        entry = fso.entries[os.path.join(self.tdir, 'a/b/file')]
+        self.assertIsInstance(entry.data.extents[0][0], ImageSource)
+        self.assertEqual(fso._memused, 0)
+        # ... and changes only affect this overlay
+        with open(os.path.join(self.tdir, 'a/b/file'), 'ab') as fp:
+          fp.write('!')
+        os.unlink(os.path.join(self.tdir, 'a/empty'))
+        with open(os.path.join(self.tdir, 'a/b/file'), 'rb') as fp:
+          self.assertEqual(fp.read(), 'fixture!')
+    self.assertFalse(os.path.exists(os.path.join(self.tdir, 'a')))
+
+  #----------------------------------------------------------------------------
+  def test_attach_copy_on_write(self):
+    image, changes = self.makeImage()
+    def path(name):
+      return os.path.join(self.tdir, name)
+    entries, paths, bchanges, children, origins = image._build()
+    state = (
+      dict(entries), list(paths), list(bchanges),
+      dict((key, set(kids)) for key, kids in children.items()))
+    first  = FileSystemOverlay(base=image)
+    second = FileSystemOverlay(base=image)
+    # attaching shares the image's structures instead of copying them
+    self.assertIs(first.entries.base, entries)
+    self.assertIs(first._basepaths, paths)
+    self.assertEqual(len(first.entries.local), 0)
+    with first:
+      with open(path('a/b/file'), 'ab') as fp:
+        fp.write('!')
+      with open(path('a/b/new'), 'wb') as fp:
+        fp.write('new')
+      os.unlink(path('a/empty'))
+      os.mkdir(path('c'))
+      self.assertEqual(sorted(os.listdir(path('a'))), ['b', 'link'])
+      self.assertEqual(sorted(os.listdir(path('a/b'))), ['file', 'new'])
+      expected = sorted(
+        [change for change in changes if not change.endswith('/a/empty')]
+        + ['add:' + path('a/b/new'), 'add:' + path('c')],
+        key=lambda change: change[4:])
+      self.assertEqual(first.changes, expected)
+      self.assertEqual(
+        first.get_changes(root=path('a/b')), ['add:', 'add:file', 'add:new'])
+      # ... and only its own changes are stored
+      self.assertEqual(
+        sorted(first.entries.local), [path('a/b/file'), path('a/b/new'), path('c')])
+      self.assertEqual(first._paths, [path('a/b/file'), path('a/b/new'), path('c')])
+    self.assertEqual(state, (
+      dict(entries), list(paths), list(bchanges),
+      dict((key, set(kids)) for key, kids in children.items())))
+    with second:
+      self.assertEqual(second.changes, changes)
+      self.assertEqual(sorted(os.listdir(path('a/b'))), ['file'])
+      with open(path('a/b/file'), 'rb') as fp:
+        self.assertEqual(fp.read(), 'fixture')
+
+  #----------------------------------------------------------------------------
+  def test_api_push(self):
+    image, changes = self.makeImage()
+    fso = api.push(image)
+    try:
+      self.assertIs(api.peek(), fso)
+      self.assertEqual(fso.changes, changes)
+      self.assertEqual(
+        stat.S_IFMT(os.lstat(os.path.join(self.tdir, 'a/link')).st_mode),
+        stat.S_IFLNK)
+    finally:
+      api.pop()
+    self.assertRaises(ValueError, image.attach, FileSystemOverlay(base=image))
+
+  #----------------------------------------------------------------------------
+  def test_save_load(self):
+    image, changes = self.makeImage()
+    path = os.path.join(self.tdir, 'image.fsoimg')
+    image.save(path)
+    try:
+      loaded = OverlayImage.load(path)
+      self.assertEqual(loaded.index, image.index)
+      self.assertIsInstance(loaded.blob, mmap.mmap)
+      with FileSystemOverlay(base=loaded) as fso:
+        self.assertEqual(fso.changes, changes)
+        with open(os.path.join(self.tdir, 'a/link'), 'rb') as fp:
+          self.assertEqual(fp.read(), 'fixture')
+        with open(os.path.join(self.tdir, 'real'), 'rb') as fp:
+          self.assertEqual(fp.read(), 'real+more')
+        entry = fso.entries[os.path.join(self.tdir, 'a/b/file')]
+        self.assertIs(entry.data.extents[0][0].buffer, loaded.blob)
+        self.assertEqual(fso._memused, 0)
+        # partial reads into buffers are served from the mapping
+        chunks = list(entry.data.iterchunks(1, 3, views=True))
+        self.assertEqual([bytes(chunk) for chunk in chunks], ['ixt'])
+        self.assertNotIsInstance(chunks[0], bytes)
+        with open(os.path.join(self.tdir, 'a/b/file'), 'rb') as fp:
+          data = bytearray(4)
+          self.assertEqual(fp.readinto(data), 4)
+          self.assertEqual(bytes(data), 'fixt')
+        # overlays can be saved directly, and re-loaded
+        buf = io.BytesIO()
+        fso.save(buf)
+      buf.seek(0)
+      with FileSystemOverlay.load(buf) as fso:
+        self.assertEqual(fso.changes, changes)
+        with open(os.path.join(self.tdir, 'a/b/file'), 'rb') as fp:
+          self.assertEqual(fp.read(), 'fixture')
+      # loaded images remain picklable
+      copy = pickle.loads(pickle.dumps(loaded, pickle.HIGHEST_PROTOCOL))
+      self.assertEqual(copy.index, image.index)
+      self.assertEqual(copy.blob, image.blob)
+      with self.assertRaises(ValueError):
+        OverlayImage.load(os.path.join(self.tdir, 'real'))
+    finally:
+      os.unlink(path)
+
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------
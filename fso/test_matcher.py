@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#------------------------------------------------------------------------------
+# file: $Id$
+# auth: metagriffin <mg.github@metagriffin.net>
+# date: 2026/10/18
+# copy: (C) Copyright 2026-EOT metagriffin -- see LICENSE.txt
+#------------------------------------------------------------------------------
+# This software is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This software is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see http://www.gnu.org/licenses/.
+#------------------------------------------------------------------------------
+
+import re
+import unittest
+
+from .matcher import PathMatcher, literal_prefix
+
+#------------------------------------------------------------------------------
+class TestMatcher(unittest.TestCase):
+
+  #----------------------------------------------------------------------------
+  def test_literal_prefix(self):
+    for expr, prefix in (
+        ('/srv/venv/.*',    '/srv/venv/'),
+        ('^/proc/',         '/proc/'),
+        ('/tmp/ab?c',       '/tmp/a'),
+        ('/tmp/a{2}',       '/tmp/'),
+        ('.*\\.pyc$',       ''),
+        ('/a/|/b/',         ''),
+        ('/plain',          '/plain'),
+      ):
+      self.assertEqual(literal_prefix(re.compile(expr)), prefix)
+    self.assertEqual(literal_prefix(re.compile('/Proc/', re.I)), '')
+
+  #----------------------------------------------------------------------------
+  def test_match(self):
+    matcher = PathMatcher([
+      '/srv/venv/.*', re.compile('/proc/[0-9]+/'), re.compile('/CASE/', re.I)])
+    self.assertEqual(len(matcher), 3)
+    for path, expect in (
+        ('/srv/venv/lib/site.py', True),
+        ('/srv/venvx', False),
+        ('/proc/123/status', True),
+        ('/proc/self/status', False),
+        ('/case/x', True),
+        ('/etc/hosts', False),
+      ):
+      self.assertEqual(matcher.match(path), expect, path)
+      # and again, from the cache
+      self.assertEqual(matcher.match(path), expect, path)
+
+  #----------------------------------------------------------------------------
+  def test_prefix_fastpath(self):
+    matcher = PathMatcher(['/srv/venv/.*', '/proc/'])
+    self.assertFalse(matcher._always)
+    calls = []
+    class Spy(object):
+      def match(self, path):
+        calls.append(path)
+        return None
+    matcher._regexes = [Spy()]
+    self.assertFalse(matcher.match('/etc/hosts'))
+    self.assertFalse(matcher.match('/srv/other'))
+    self.assertEqual(calls, [])
+    self.assertFalse(matcher.match('/proc/nothing'))
+    self.assertEqual(calls, ['/proc/nothing'])
+
+  #----------------------------------------------------------------------------
+  def test_uncombinable(self):
+    matcher = PathMatcher(['/(?P<x>a)/', '/(?P<x>b)/'])
+    self.assertTrue(matcher.match('/a/'))
+    self.assertTrue(matcher.match('/b/'))
+    self.assertFalse(matcher.match('/c/'))
+
+#------------------------------------------------------------------------------
+# end of $Id$
+# $ChangeLog$
+#------------------------------------------------------------------------------